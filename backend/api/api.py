@@ -1,9 +1,17 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 
-from backend.api.creators import creator_router
+from backend.api.creators import creator_router, close_rendered_images
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # The rendered images spilled to the disk are only the process' own, and removed with it.
+    close_rendered_images()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(creator_router)
 
 
@@ -1,12 +1,42 @@
-from starlette.responses import StreamingResponse
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
+from typing import Optional
+from pathlib import Path
+import threading
+import tempfile
 import json
-import io
 
 from backend.data_management.saver import Saver
+from backend.api.image_cache import RenderedImageCache, get_card_image_key, render_card_image, make_image_response
 
+# The fields a card is listed with, its image is fetched on its own (see get_solved_card_image).
+CREATOR_CARD_FIELDS = ["name", "creator", "riddle", "solution"]
 creator_router = APIRouter(prefix="/creators")
 saver = Saver()
+_rendered_images: Optional[RenderedImageCache] = None
+_rendered_images_lock = threading.Lock()
+
+
+def get_rendered_images() -> RenderedImageCache:
+    """
+    Returns the cache of the cards' rendered images, created the first time it's needed.
+    """
+    global _rendered_images
+    with _rendered_images_lock:
+        if _rendered_images is None:
+            # Spilled to a directory of the process' own in the temporary directory, see RenderedImageCache.
+            _rendered_images = RenderedImageCache(spill_dir=Path(tempfile.gettempdir()))
+        return _rendered_images
+
+
+def close_rendered_images():
+    """
+    Closes the cache of the cards' rendered images, if it was created, removing its spilled images.
+    """
+    global _rendered_images
+    with _rendered_images_lock:
+        if _rendered_images is not None:
+            _rendered_images.close()
+            _rendered_images = None
 
 
 @creator_router.get("/")
@@ -22,8 +52,7 @@ def get_creator_cards(creator: str):
     :param creator: The creator of the cards to be returned.
     :return:
     """
-    cards = saver.find_cards(True, creator=creator)
-    return cards
+    return saver.find_card_fields(True, CREATOR_CARD_FIELDS, creator=creator)
 
 
 @creator_router.get("/{creator}/cards/{card_name}")
@@ -40,7 +69,7 @@ def get_solved_card_by_name(creator: str, card_name: str):
 
 
 @creator_router.get("/{creator}/cards/{card_name}/image.jpg")
-def get_solved_card_image(creator: str, card_name: str):
+def get_solved_card_image(creator: str, card_name: str, request: Request):
     """
     This function receives a creator and returns all the solved cards of the given creator.
     :param creator: The creator of the cards to be returned.
@@ -51,7 +80,6 @@ def get_solved_card_image(creator: str, card_name: str):
     if len(cards) == 0:
         return json.dumps({})
     card = cards[0]
-    image_bytes_io = io.BytesIO()
-    card.image.image.save(image_bytes_io, format="JPEG")
-    image_bytes_io.seek(0)
-    return StreamingResponse(io.BytesIO(image_bytes_io.read()), media_type="image/jpeg")
+    # Encoded once per image, later requests get the cached bytes (or just a 304 if they have them already).
+    rendered = get_rendered_images().get(get_card_image_key(card, "JPEG"), lambda: render_card_image(card, "JPEG"))
+    return make_image_response(rendered, request.headers, media_type="image/jpeg")
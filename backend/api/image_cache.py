@@ -0,0 +1,265 @@
+from collections import OrderedDict
+from typing import Optional, Hashable, Callable, Mapping
+from starlette.responses import Response
+from pathlib import Path
+import threading
+import tempfile
+import hashlib
+import shutil
+import uuid
+import os
+import io
+
+from game.card import Card
+
+DEFAULT_MEMORY_SIZE = 32 * 2 ** 20
+DEFAULT_DISK_SIZE = 512 * 2 ** 20
+# Every cache spills to a directory of its own in the spill directory, named with this prefix.
+SPILL_DIR_PREFIX = "rendered_images."
+# A card's image doesn't change, but a card may be removed and saved again under the same name, so clients check
+# back every so often (cheaply, with If-None-Match).
+IMAGE_CACHE_CONTROL = "public, max-age=3600"
+
+
+class RenderedImage:
+    """
+    The bytes of a rendered (encoded) image, and their strong ETag.
+    """
+    __slots__ = ("data", "etag")
+
+    def __init__(self, data: bytes, etag: Optional[str] = None):
+        self.data = data
+        self.etag = etag if etag is not None else f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+
+    def __len__(self):
+        return len(self.data)
+
+
+class RenderedImageCache:
+    """
+    A cache of rendered images, so an image is encoded once rather than on every request for it. The most recently
+    used images are kept in memory, and the ones that don't fit are spilled to files in a directory, up to a size too.
+    Images are cached by a key naming both the image and how it was rendered, see get_card_image_key.
+    A single cache may be used by many threads. Files are only written, read and removed outside the cache's lock, so
+    a slow disk doesn't hold up images that are in memory.
+    """
+
+    def __init__(self,
+                 max_memory_size: int = DEFAULT_MEMORY_SIZE,
+                 spill_dir: Optional[Path] = None,
+                 max_disk_size: int = DEFAULT_DISK_SIZE):
+        """
+        :param max_memory_size: The most bytes of images kept in memory.
+        :param spill_dir: The directory images are spilled to, in a directory of the cache's own (removed on close),
+        so caches of many processes may share it. Images aren't spilled without one.
+        :param max_disk_size: The most bytes of images spilled to the directory.
+        """
+        self.max_memory_size = max_memory_size
+        self.max_disk_size = max_disk_size
+        self.spill_dir: Optional[Path] = None
+        if spill_dir is not None:
+            Path(spill_dir).mkdir(parents=True, exist_ok=True)
+            # Spilled files are only known to the cache that spilled them.
+            self.spill_dir = Path(tempfile.mkdtemp(prefix=SPILL_DIR_PREFIX, dir=spill_dir))
+        self.memory: OrderedDict[Hashable, RenderedImage] = OrderedDict()
+        self.memory_size = 0
+        # key -> (the spilled file, its ETag, its size)
+        self.disk: OrderedDict[Hashable, tuple[Path, str, int]] = OrderedDict()
+        self.disk_size = 0
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"<RenderedImageCache ({len(self.memory)} images in memory, {len(self.disk)} on disk)>"
+
+    def _spill(self, images: list[tuple[Hashable, RenderedImage]]):
+        """
+        Spills images that were dropped from memory to the disk, dropping the least recently used spilled images if
+        they don't all fit. Called without the lock.
+        """
+        if self.spill_dir is None:
+            return
+        for key, rendered in images:
+            if len(rendered) > self.max_disk_size:
+                continue
+            with self.lock:
+                if key in self.disk:
+                    continue
+            # A name of its own, so a file that's being read (or removed) is never written over.
+            spill_path = self.spill_dir / uuid.uuid4().hex
+            try:
+                spill_path.write_bytes(rendered.data)
+            except OSError as e:
+                print(f"Couldn't spill a rendered image to {spill_path}: {e!r}")
+                continue
+            dropped_paths = []
+            with self.lock:
+                if key in self.disk:
+                    # Spilled by another thread meanwhile.
+                    dropped_paths.append(spill_path)
+                else:
+                    self.disk[key] = (spill_path, rendered.etag, len(rendered))
+                    self.disk_size += len(rendered)
+                    while self.disk_size > self.max_disk_size:
+                        _, (old_path, _, old_size) = self.disk.popitem(last=False)
+                        self.disk_size -= old_size
+                        dropped_paths.append(old_path)
+            for dropped_path in dropped_paths:
+                dropped_path.unlink(missing_ok=True)
+
+    def _add_to_memory(self, key: Hashable, rendered: RenderedImage) -> list[tuple[Hashable, RenderedImage]]:
+        """
+        Adds an image to memory, dropping the least recently used images if it doesn't fit. Called with the lock.
+        :return: The images that were dropped, to be spilled (without the lock).
+        """
+        if len(rendered) > self.max_memory_size:
+            return [(key, rendered)]
+        self.memory[key] = rendered
+        self.memory_size += len(rendered)
+        dropped = []
+        while self.memory_size > self.max_memory_size:
+            old_key, old_rendered = self.memory.popitem(last=False)
+            self.memory_size -= len(old_rendered)
+            dropped.append((old_key, old_rendered))
+        return dropped
+
+    def _read_spilled(self, key: Hashable, spilled: tuple[Path, str, int]) -> Optional[RenderedImage]:
+        """
+        Reads a spilled image, called without the lock.
+        :return: The image, or None if its file couldn't be read (it was dropped meanwhile, say).
+        """
+        spill_path, etag, size = spilled
+        try:
+            data = spill_path.read_bytes()
+        except OSError:
+            with self.lock:
+                if self.disk.get(key) == spilled:
+                    del self.disk[key]
+                    self.disk_size -= size
+            return None
+        return RenderedImage(data, etag)
+
+    def get(self, key: Hashable, render: Callable[[], bytes]) -> RenderedImage:
+        """
+        Returns the cached image with the given key, rendering it if it isn't cached.
+        :param render: Renders the image, returning its bytes.
+        """
+        with self.lock:
+            rendered = self.memory.get(key)
+            if rendered is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return rendered
+            spilled = self.disk.get(key)
+            if spilled is not None:
+                self.disk.move_to_end(key)
+        if spilled is not None and (rendered := self._read_spilled(key, spilled)) is not None:
+            with self.lock:
+                self.disk_hits += 1
+                dropped = self._add_to_memory(key, rendered) if key not in self.memory else []
+            self._spill(dropped)
+            return rendered
+        with self.lock:
+            self.misses += 1
+        # Rendered outside the lock, so a slow render doesn't hold up images that are cached.
+        rendered = RenderedImage(render())
+        with self.lock:
+            dropped = self._add_to_memory(key, rendered) if key not in self.memory else []
+        self._spill(dropped)
+        return rendered
+
+    def close(self):
+        """
+        Removes the cache's spilled images, and its directory.
+        """
+        with self.lock:
+            self.disk.clear()
+            self.disk_size = 0
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def get_stats(self) -> dict[str, int]:
+        with self.lock:
+            return {"memory_images": len(self.memory),
+                    "memory_size": self.memory_size,
+                    "disk_images": len(self.disk),
+                    "disk_size": self.disk_size,
+                    "memory_hits": self.memory_hits,
+                    "disk_hits": self.disk_hits,
+                    "misses": self.misses}
+
+
+def get_card_image_key(card: Card, image_format: str) -> Hashable:
+    """
+    Returns the key a card's image rendered in the given format is cached by: the image's digest if it's in a blob
+    store, or its file's path, size and mtime otherwise.
+    """
+    if card.image_digest is not None:
+        return card.image_digest, image_format
+    image_stat = os.stat(card.image_path)
+    return card.image_path, image_stat.st_size, image_stat.st_mtime_ns, image_format
+
+
+def render_card_image(card: Card, image_format: str) -> bytes:
+    image_file = io.BytesIO()
+    card.image.image.convert('RGB').save(image_file, format=image_format)
+    return image_file.getvalue()
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match is compared weakly, W/"x" matches "x".
+    return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+
+def parse_byte_range(range_header: str, size: int) -> Optional[tuple[int, int]]:
+    """
+    Parses a Range header of a single byte range (bytes=start-end, bytes=start- or bytes=-suffix_length).
+    :return: The first and last byte of the range, or None if the header isn't one the cache serves ranges for (the
+    whole image is served instead).
+    :raises ValueError: If the range is out of the image's bounds.
+    """
+    unit, _, byte_range = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in byte_range:
+        return None
+    start, separator, end = byte_range.strip().partition("-")
+    if not separator or not (start + end).isdigit():
+        return None
+    if not start:
+        suffix_length = int(end)
+        if suffix_length == 0:
+            raise ValueError(f"Empty suffix range in {range_header!r}")
+        return max(size - suffix_length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or end < start:
+        raise ValueError(f"Range {range_header!r} is out of the image's {size} bytes")
+    return start, end
+
+
+def make_image_response(rendered: RenderedImage, request_headers: Mapping[str, str], media_type: str) -> Response:
+    """
+    Makes the response for a rendered image: 304 Not Modified if the client has it already (If-None-Match), 206
+    Partial Content for a range of it (Range, and If-Range if given), and the whole image otherwise.
+    """
+    headers = {"ETag": rendered.etag, "Cache-Control": IMAGE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if _etag_matches(request_headers.get("if-none-match"), rendered.etag):
+        return Response(status_code=304, headers=headers)
+    range_header = request_headers.get("range")
+    if range_header is not None and request_headers.get("if-range", rendered.etag) == rendered.etag:
+        try:
+            byte_range = parse_byte_range(range_header, len(rendered))
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{len(rendered)}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(rendered)}"
+            return Response(content=rendered.data[start:end + 1], status_code=206, media_type=media_type,
+                            headers=headers)
+    return Response(content=rendered.data, media_type=media_type, headers=headers)
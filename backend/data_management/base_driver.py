@@ -1,9 +1,14 @@
 from __future__ import annotations
+from typing import Optional, Iterator, Union, Any
 from abc import abstractmethod
 
 
+from game.card_summary import CardSummary
 from game.card import Card
 
+# The amount of cards fetched from storage at a time by the iter_* methods.
+DEFAULT_ITER_BATCH_SIZE = 100
+
 
 class BaseDriver:
 
@@ -21,9 +26,11 @@ class BaseDriver:
         pass
 
     @abstractmethod
-    def get_unsolved_card_by_name(self, name: str = None) -> list[Card]:
+    def get_unsolved_card_by_name(self, name: str = None) -> list[Union[Card, CardSummary]]:
         """
         This function receives a name and returns the card with the given name.
+        Drivers may return unsolved cards as CardSummary objects, which stand in for the cards and only read their
+        images when they're needed.
         :param name: The name of the card to be returned.
         :return: A list of cards, either a singleton, or all of the unsolved cards (if no name is given).
         """
@@ -39,9 +46,9 @@ class BaseDriver:
         pass
 
     @abstractmethod
-    def get_unsolved_cards_by_creator(self, creator: str) -> list[Card]:
+    def get_unsolved_cards_by_creator(self, creator: str) -> list[Union[Card, CardSummary]]:
         """
-        This function receives a creator and returns all the cards of the given creator.
+        This function receives a creator and returns all the cards of the given creator, see get_unsolved_card_by_name.
         :param creator: The creator of the cards to be returned.
         :return: A list of all the cards of the given creator.
         """
@@ -65,4 +72,44 @@ class BaseDriver:
         :param creator: The creator of the cards to be returned.
         :return: A list of all the cards of the given creator.
         """
-        pass
\ No newline at end of file
+        pass
+
+    @abstractmethod
+    def iter_solved_cards(self, name: str = None, creator: str = None,
+                          batch_size: int = DEFAULT_ITER_BATCH_SIZE,
+                          after: Optional[tuple[str, str]] = None,
+                          limit: Optional[int] = None) -> Iterator[Card]:
+        """
+        This function yields the solved cards with the given name and creator (either may be None to match any),
+        ordered by name and then creator. Cards are fetched batch_size at a time, so only a batch is held at once.
+        :param name: The name of the cards to be yielded.
+        :param creator: The creator of the cards to be yielded.
+        :param batch_size: The amount of cards fetched at a time.
+        :param after: The (name, creator) of a card, to resume from the card after it (the last card yielded before).
+        :param limit: The most cards to yield.
+        :return: An iterator of the cards.
+        """
+        pass
+
+    @abstractmethod
+    def iter_unsolved_cards(self, name: str = None, creator: str = None,
+                            batch_size: int = DEFAULT_ITER_BATCH_SIZE,
+                            after: Optional[tuple[str, str]] = None,
+                            limit: Optional[int] = None) -> Iterator[Union[Card, CardSummary]]:
+        """
+        This function yields the unsolved cards with the given name and creator, see iter_solved_cards.
+        """
+        pass
+
+    def find_card_fields(self, solved: bool, fields: list[str], name: Optional[str] = None,
+                         creator: Optional[str] = None) -> list[dict[str, Any]]:
+        """
+        This function returns only the given fields of the cards with the given name and creator (either may be None
+        to match any), for listings that don't need whole cards. Drivers that can fetch only some of a card's fields
+        override this, by default the fields are taken from the whole cards.
+        :param solved: Whether to look for solved or unsolved cards.
+        :param fields: The fields to return, e.g. ["name", "riddle"].
+        :return: A dictionary of the given fields per card.
+        """
+        cards = self.iter_solved_cards(name, creator) if solved else self.iter_unsolved_cards(name, creator)
+        return [{field: getattr(card, field, None) for field in fields} for card in cards]
@@ -0,0 +1,129 @@
+from pathlib import Path
+import threading
+import hashlib
+import sqlite3
+import uuid
+import os
+
+from game.card import Card
+
+REFS_FILE_NAME = "refs.sqlite3"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refs INTEGER NOT NULL
+);
+"""
+
+
+class BlobStore:
+    """
+    A content-addressed store of image files, shared by every solved card. A blob is kept under the SHA-256 digest of
+    its bytes, in directories sharded by the digest's first bytes (ab/cd/abcd...), so an image saved by many cards is
+    stored once. Every blob counts the cards referencing it, and is deleted once the last of them releases it.
+    Blobs never change, so anything read from one may be cached by its digest.
+    A single store may be used by many threads.
+    """
+
+    def __init__(self, blob_dir: Path):
+        self.blob_dir = Path(blob_dir)
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.blob_dir / REFS_FILE_NAME, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def __repr__(self):
+        return f"<BlobStore at {self.blob_dir}>"
+
+    def __contains__(self, digest: str) -> bool:
+        return self.get_refs(digest) > 0
+
+    @staticmethod
+    def get_digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def get_path(self, digest: str) -> Path:
+        return self.blob_dir / digest[:2] / digest[2:4] / digest
+
+    def put(self, data: bytes) -> str:
+        """
+        Adds a reference to the blob with the given bytes, storing it if it's new.
+        :return: The blob's digest.
+        """
+        digest = self.get_digest(data)
+        blob_path = self.get_path(digest)
+        with self.lock, self.connection:
+            cursor = self.connection.execute("UPDATE blobs SET refs = refs + 1 WHERE digest = ?", (digest,))
+            if cursor.rowcount and blob_path.exists():
+                return digest
+            blob_path.parent.mkdir(parents=True, exist_ok=True)
+            # A blob only takes its name once it's written whole, so a digest always names the bytes it was made of.
+            partial_path = blob_path.with_name(f".{digest}.{uuid.uuid4().hex}.partial")
+            partial_path.write_bytes(data)
+            os.replace(partial_path, blob_path)
+            if not cursor.rowcount:
+                self.connection.execute("INSERT INTO blobs VALUES (?, ?, 1)", (digest, len(data)))
+        return digest
+
+    def put_file(self, path: Path) -> str:
+        """
+        Adds a reference to the blob with the bytes of the given file, see put.
+        """
+        with open(path, mode="rb") as blob_file:
+            return self.put(blob_file.read())
+
+    def put_card_image(self, card: Card) -> str:
+        """
+        Adds a reference to the blob of a solved card's image, and points the card at it.
+        :return: The blob's digest.
+        """
+        if card.image_path is None:
+            # The card was received serialised, its image has no file yet.
+            card.image_digest = self.put(card.image.get_file_bytes())
+        else:
+            card.image_digest = self.put_file(Path(card.image_path))
+        card.image_path = str(self.get_path(card.image_digest))
+        return card.image_digest
+
+    def get(self, digest: str) -> bytes:
+        return self.get_path(digest).read_bytes()
+
+    def get_refs(self, digest: str) -> int:
+        with self.lock:
+            row = self.connection.execute("SELECT refs FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def release(self, digest: str) -> bool:
+        """
+        Removes a reference to a blob, deleting the blob if it was the last one.
+        :return: True if the blob was deleted, False if it's still referenced (or there's no such blob).
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT refs FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if row is None:
+                return False
+            if row[0] > 1:
+                self.connection.execute("UPDATE blobs SET refs = refs - 1 WHERE digest = ?", (digest,))
+                return False
+            self.connection.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            try:
+                os.remove(self.get_path(digest))
+            except FileNotFoundError:
+                pass
+            return True
+
+    def get_stats(self) -> dict[str, int]:
+        """
+        Returns the amount of blobs, the bytes they take, and the bytes they'd take without deduplication.
+        """
+        with self.lock:
+            blobs, stored_size, referenced_size = self.connection.execute(
+                "SELECT COUNT(*), TOTAL(size), TOTAL(size * refs) FROM blobs").fetchone()
+        return {"blobs": blobs, "stored_size": int(stored_size), "referenced_size": int(referenced_size)}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
@@ -0,0 +1,141 @@
+from collections import OrderedDict
+from typing import Optional
+import threading
+import time
+
+from game.card import Card
+
+DEFAULT_CARD_CACHE_SIZE = 64 * 2 ** 20
+DEFAULT_CARD_CACHE_TTL = 60
+# The bytes an entry takes up besides its cards (its key, list and place in the cache), so that many small or empty
+# results don't escape the cache's bound.
+ENTRY_OVERHEAD = 256
+# (solved, creator, name), either of creator and name may be None for queries that match any.
+CacheKey = tuple[bool, Optional[str], Optional[str]]
+
+
+def get_card_size(card: Card) -> int:
+    """
+    Returns the amount of bytes a card takes up in memory, roughly: its text fields, and its image if it's loaded.
+    """
+    size = sum(len(field) for field in (card.name, card.creator, card.riddle, card.solution, card.image_path)
+               if field is not None)
+    image = getattr(card, "image", None)
+    if image is not None:
+        size += image.get_memory_size()
+    return size
+
+
+class CardCache:
+    """
+    A least recently used cache of the results of card queries, bounded by the bytes the cached cards take up
+    (including their images once they're loaded, and ENTRY_OVERHEAD per result). Results are cached by (solved,
+    creator, name), and invalidated when a card they may include is saved. Cards saved by other processes aren't seen
+    by the cache, so results also expire ttl seconds after they're cached.
+    The cached cards are shared by everyone getting them from the cache, and mustn't be changed.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_CARD_CACHE_SIZE, ttl: Optional[float] = DEFAULT_CARD_CACHE_TTL):
+        """
+        :param max_size: The most bytes the cached cards may take up, 0 disables the cache.
+        :param ttl: The seconds a result stays cached, None to keep results until they're evicted or invalidated.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        # The cached cards of every query, with their size and the (monotonic) time they were cached.
+        self.entries: OrderedDict[CacheKey, tuple[list[Card], int, float]] = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        # Bumped by every invalidation, so a query that ran while a card was saved isn't cached, see put.
+        self.generation = 0
+
+    def __repr__(self):
+        return f"<CardCache ({len(self.entries)} entries, {self.size}/{self.max_size} bytes)>"
+
+    def _evict(self):
+        while self.size > self.max_size and self.entries:
+            _, (_, entry_size, _) = self.entries.popitem(last=False)
+            self.size -= entry_size
+            self.evictions += 1
+
+    @staticmethod
+    def _get_entry_size(cards: list[Card]) -> int:
+        return ENTRY_OVERHEAD + sum(get_card_size(card) for card in cards)
+
+    def get(self, key: CacheKey) -> Optional[list[Card]]:
+        """
+        Returns the cached cards of a query, or None if they aren't cached (or expired).
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[2] > self.ttl:
+                del self.entries[key]
+                self.size -= entry[1]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            cards, entry_size, cached_time = entry
+            # The cards' images may have been loaded since they were cached, so they're measured again.
+            new_size = self._get_entry_size(cards)
+            self.entries[key] = (cards, new_size, cached_time)
+            self.entries.move_to_end(key)
+            self.size += new_size - entry_size
+            self._evict()
+            return list(cards)
+
+    def put(self, key: CacheKey, cards: list[Card], generation: Optional[int] = None):
+        """
+        Caches the cards of a query.
+        :param generation: The cache's generation from before the query ran. If anything was invalidated since, the
+        cards may be stale, and aren't cached.
+        """
+        entry_size = self._get_entry_size(cards)
+        if entry_size > self.max_size:
+            return
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            old_entry = self.entries.pop(key, None)
+            if old_entry is not None:
+                self.size -= old_entry[1]
+            self.entries[key] = (list(cards), entry_size, time.monotonic())
+            self.size += entry_size
+            self._evict()
+
+    def invalidate(self, solved: bool, creator: str, name: str):
+        """
+        Drops the cached results of every query that may include the given card.
+        """
+        with self.lock:
+            self.generation += 1
+            for key in [(solved, creator, name), (solved, creator, None), (solved, None, name)]:
+                entry = self.entries.pop(key, None)
+                if entry is not None:
+                    self.size -= entry[1]
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def get_stats(self) -> dict[str, int]:
+        """
+        Returns a snapshot of the cache's counters.
+        """
+        with self.lock:
+            return {"entries": len(self.entries),
+                    "size": self.size,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "expirations": self.expirations,
+                    "invalidations": self.invalidations}
@@ -0,0 +1,117 @@
+from typing import Optional, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+import threading
+import fcntl
+import uuid
+import os
+
+DEFAULT_COMPACTION_INTERVAL = 300
+# Next to the log, locked by whoever appends to or compacts it. Compaction replaces the log's file, so the lock can't
+# be taken on the log itself.
+LOCK_SUFFIX = ".lock"
+
+
+class CreatorRegistry:
+    """
+    The creators of the saved cards, kept in memory, so checking for a creator or listing them never touches the
+    disk. New creators are appended to a log file, a line each, which is read once when the registry is created.
+    The log is compacted (rewritten with every creator once) when it's loaded and then periodically, which also picks
+    up creators appended to it by other processes in the meanwhile. Processes sharing a log take turns on it, through
+    a lock file next to it, so a creator appended while the log is compacted isn't lost.
+    A single registry may be used by many threads.
+    """
+
+    def __init__(self, log_path: Path):
+        self.log_path = Path(log_path)
+        self.lock = threading.Lock()
+        # A dict rather than a set, so creators are listed in the order they were added.
+        self.creators: dict[str, None] = {}
+        self.compactor: Optional[threading.Thread] = None
+        self.stop_compactor = threading.Event()
+        self.compact()
+
+    def __repr__(self):
+        return f"<CreatorRegistry at {self.log_path} ({len(self.creators)} creators)>"
+
+    def __len__(self):
+        return len(self.creators)
+
+    def __contains__(self, creator: str) -> bool:
+        return creator in self.creators
+
+    def _read_log(self) -> list[str]:
+        try:
+            with open(self.log_path, mode='r') as log_file:
+                return log_file.read().split("\n")
+        except FileNotFoundError:
+            return []
+
+    @contextmanager
+    def _lock_log(self) -> Iterator[None]:
+        """
+        Holds the log's lock (waiting for other processes to release it) for as long as the context is open.
+        """
+        self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        # Closing the lock file releases the lock.
+        with open(self.log_path.with_name(self.log_path.name + LOCK_SUFFIX), mode='a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def add(self, creator: str) -> bool:
+        """
+        Adds a creator to the registry.
+        :return: True if the creator was added, False if the creator already exists.
+        """
+        if creator in self.creators:
+            return False
+        with self.lock:
+            if creator in self.creators:
+                return False
+            with self._lock_log(), open(self.log_path, mode='a') as log_file:
+                log_file.write(creator + "\n")
+            self.creators[creator] = None
+            return True
+
+    def get_creators(self) -> list[str]:
+        return list(self.creators)
+
+    def compact(self) -> int:
+        """
+        Merges the creators in the log into the registry, and rewrites the log with every creator once.
+        :return: The amount of lines dropped from the log.
+        """
+        with self.lock, self._lock_log():
+            lines = self._read_log()
+            for creator in lines:
+                if creator:
+                    self.creators.setdefault(creator, None)
+            compacted_lines = list(self.creators) + [""]
+            if lines == compacted_lines or not self.creators:
+                return 0
+            partial_path = self.log_path.with_name(f".{self.log_path.name}.{uuid.uuid4().hex}.partial")
+            with open(partial_path, mode='w') as log_file:
+                log_file.writelines(creator + "\n" for creator in self.creators)
+            os.replace(partial_path, self.log_path)
+            return max(len(lines) - len(compacted_lines), 0)
+
+    def start_compactor(self, interval: float = DEFAULT_COMPACTION_INTERVAL):
+        """
+        Compacts the log every interval seconds, on a background thread.
+        """
+        self.stop_compactor.clear()
+        self.compactor = threading.Thread(target=self._compact_periodically, args=[interval], daemon=True)
+        self.compactor.start()
+
+    def _compact_periodically(self, interval: float):
+        while not self.stop_compactor.wait(interval):
+            try:
+                self.compact()
+            except OSError as e:
+                print(f"Failed compacting {self}: {e!r}")
+
+    def close(self):
+        if self.compactor is not None:
+            self.stop_compactor.set()
+            self.compactor.join()
+            self.compactor = None
@@ -1,16 +1,152 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Union, Iterator, Callable
 from pathlib import Path
+import threading
+import argparse
+import uuid
 import json
+import time
 import os
 
-from backend.data_management.base_driver import BaseDriver
+from backend.data_management.base_driver import BaseDriver, DEFAULT_ITER_BATCH_SIZE
+from backend.data_management.blob_store import BlobStore
+from backend.data_management.drivers.filesystem_index import FilesystemIndex, IndexEntry
+from backend.data_management.drivers.pack_store import PackStore
+from backend.data_management.drivers.ingest_journal import IngestJournal, DEFAULT_BATCH_SIZE, DEFAULT_BATCH_INTERVAL, \
+    fsync_dir
+from game.card_summary import CardSummary
+from game.card_format import CardView
 from game.card import Card
 
+# Kept in the unsolved directory, hidden so it's never taken for a card.
+INDEX_FILE_NAME = ".metadata_index.sqlite3"
+DEFAULT_REINDEX_WORKERS = 8
+# An unsolved directory with this (hidden) subdirectory keeps its cards in pack files there, see PackStore.
+PACK_DIR_NAME = ".packs"
+DEFAULT_COMPACTION_INTERVAL = 60
+# Kept in the unsolved directory when cards are saved through the ingest journal, see IngestJournal.
+JOURNAL_FILE_NAME = ".ingest.journal"
+# Kept in the solved directory, the images of the solved cards, see BlobStore.
+BLOB_DIR_NAME = ".blobs"
+
+
+class UnsolvedCardWriter:
+    """
+    Writes a card serialisation to the unsolved directory piece by piece. The pieces go to a hidden temporary file,
+    which only takes the card's name on commit, so a card that was cut off midway never shows up as a card.
+    """
+
+    def __init__(self, card_path: Path, on_commit: Optional[Callable[[Path], None]] = None):
+        """
+        :param card_path: The path the card is saved at.
+        :param on_commit: Called with the card's path once it's saved.
+        """
+        self.card_path = card_path
+        self.on_commit = on_commit
+        self.partial_path = card_path.with_name(f".{card_path.name}.{uuid.uuid4().hex}.partial")
+        self.card_file = open(self.partial_path, mode="xb")
+
+    def write(self, data: bytes):
+        self.card_file.write(data)
+
+    def commit(self) -> bool:
+        """
+        Moves the written card to its final path.
+        :return: True if the card was saved, False if a card with the same path was saved in the meanwhile.
+        """
+        self.card_file.close()
+        if self.card_path.exists():
+            print(f"Card at {self.card_path} already exists! Potentially a duplicate card? Not saving")
+            os.remove(self.partial_path)
+            return False
+        os.replace(self.partial_path, self.card_path)
+        if self.on_commit is not None:
+            self.on_commit(self.card_path)
+        return True
+
+    def abort(self):
+        self.card_file.close()
+        os.remove(self.partial_path)
+
+
+class PackedCardWriter(UnsolvedCardWriter):
+    """
+    Writes a card serialisation piece by piece to a temporary file, which is appended to the pack store on commit.
+    """
+
+    def __init__(self, pack_store: PackStore, card_path: Path, on_commit: Optional[Callable[[Path], None]] = None):
+        self.pack_store = pack_store
+        super().__init__(card_path, on_commit)
+
+    def commit(self) -> bool:
+        self.card_file.close()
+        with open(self.partial_path, mode="rb") as card_file:
+            saved = self.pack_store.append_file(self.card_path.name, card_file)
+        os.remove(self.partial_path)
+        if not saved:
+            print(f"Card {self.card_path.name} already exists! Potentially a duplicate card? Not saving")
+            return False
+        if self.on_commit is not None:
+            self.on_commit(self.card_path)
+        return True
+
 
 class FilesystemDriver(BaseDriver):
 
-    def __init__(self, solved_dir: Path, unsolved_dir: Path):
+    def __init__(self, solved_dir: Path, unsolved_dir: Path, index_path: Optional[Path] = None,
+                 use_packs: Optional[bool] = None, use_journal: bool = False,
+                 journal_batch_size: int = DEFAULT_BATCH_SIZE, journal_batch_interval: float = DEFAULT_BATCH_INTERVAL):
+        """
+        :param index_path: The path of the cards' metadata index, by default kept in the unsolved directory. A new
+        index is built from the solved cards already in the directories, the unsolved cards are indexed by the first
+        query for them (see refresh_unsolved), so opening the driver doesn't read them.
+        :param use_packs: Whether to keep unsolved cards in pack files (see PackStore) instead of a file per card. By
+        default, packs are used if the unsolved directory has a pack directory already.
+        :param use_journal: Whether unsolved card serialisations are saved through a write-ahead journal (see
+        IngestJournal), which is fsynced once per batch of cards, and saved to their final place in the background.
+        Cards left in the journal by a previous run are saved either way.
+        :param journal_batch_size: The amount of cards after which the journal is committed.
+        :param journal_batch_interval: The time, in seconds, after which the journal is committed anyway.
+        """
         self.solved_dir = solved_dir
         self.unsolved_dir = unsolved_dir
+        pack_dir = unsolved_dir / PACK_DIR_NAME
+        if use_packs is None:
+            use_packs = pack_dir.is_dir()
+        self.pack_store: Optional[PackStore] = None
+        if use_packs:
+            # Raises StoreInUseException if another driver has the packs open, see PackStore.
+            self.pack_store = PackStore(pack_dir)
+        try:
+            self.index = FilesystemIndex(index_path if index_path is not None else unsolved_dir / INDEX_FILE_NAME)
+            if self.index.created:
+                self.index.update(self._read_solved_entries(DEFAULT_REINDEX_WORKERS), [])
+        except BaseException:
+            # The packs are released for the next driver.
+            if self.pack_store is not None:
+                self.pack_store.close()
+            raise
+        if self.pack_store is not None:
+            self.pack_store.start_compactor(DEFAULT_COMPACTION_INTERVAL)
+        self.write_lock = threading.Lock()
+        # The cards that are in the journal but weren't saved to their final place yet.
+        self.journaled_paths: set[Path] = set()
+        # The card files saved from the journal since it was last synced, see _sync_journaled_cards.
+        self.unsynced_paths: list[Path] = []
+        # Whether the unsolved index was brought up to date with the directory since the driver was opened, see
+        # _refresh_unsolved_once.
+        self.unsolved_refreshed = False
+        self.journal: Optional[IngestJournal] = None
+        self.blob_store: Optional[BlobStore] = None
+        journal_path = unsolved_dir / JOURNAL_FILE_NAME
+        if use_journal:
+            self.journal = IngestJournal(journal_path, self._apply_journaled_serialisation,
+                                         journal_batch_size, journal_batch_interval, sync=self._sync_journaled_cards)
+            self.journal.start()
+        elif journal_path.exists():
+            # Left alone if the journal is in use, by a server saving cards to the directory for example.
+            IngestJournal(journal_path, self._apply_journaled_serialisation,
+                          sync=self._sync_journaled_cards).replay()
 
     @classmethod
     def get_default_driver(cls) -> BaseDriver:
@@ -20,61 +156,452 @@ class FilesystemDriver(BaseDriver):
         default_unsolved_dir = base_data_dir / "unsolved_cards"
         return cls(solved_dir=default_solved_dir, unsolved_dir=default_unsolved_dir)
 
+    def _get_blob_store(self) -> BlobStore:
+        # Only opened once it's needed, so directories with no solved cards don't get one.
+        with self.write_lock:
+            if self.blob_store is None:
+                self.blob_store = BlobStore(self.solved_dir / BLOB_DIR_NAME)
+            return self.blob_store
+
     def save_solved_card(self, card: Card) -> bool:
         card_dir = self.solved_dir / card.name
         if card_dir.exists():
             print(f"Card at {card_dir} already exists! Potentially a duplicate card? Not saving")
             return False
         os.mkdir(card_dir)
+        self._get_blob_store().put_card_image(card)
         metadata_json = card.generate_metadata_json()
         # Saving inside a directory just for the card in case we'll want to add
         # more files
         with open(card_dir / "metadata.json", mode="w") as metadata_file:
             metadata_file.write(metadata_json)
+        self.index.add(IndexEntry(card_dir / "metadata.json", card.name, card.creator, solved=True))
+        return True
+
+    def remove_solved_card(self, name: str) -> bool:
+        """
+        Removes a solved card, and releases its image in the blob store.
+        :return: True if the card was removed, False if there's no such card.
+        """
+        metadata_path = self.solved_dir / name / "metadata.json"
+        try:
+            with open(metadata_path, mode='r') as metadata_file:
+                metadata = json.load(metadata_file)
+        except FileNotFoundError:
+            return False
+        if metadata.get("image_digest") is not None:
+            self._get_blob_store().release(metadata["image_digest"])
+        os.remove(metadata_path)
+        os.rmdir(metadata_path.parent)
+        self.index.remove(metadata_path)
         return True
 
     def save_unsolved_card(self, card: Card) -> bool:
-        card_path = self.unsolved_dir / (card.creator + card.name)
-        if card_path.exists():
+        return self._write_unsolved_serialisation(card, card.serialise())
+
+    def save_unsolved_serialisation(self, card_serialisation: bytes) -> bool:
+        """
+        This function receives a card serialisation (as received from a client) and saves it as is.
+        :param card_serialisation: The serialisation of the card to be saved.
+        :return: True if the card was saved, False otherwise.
+        """
+        card_view = CardView(card_serialisation)
+        return self._write_unsolved_serialisation(card_view, card_serialisation)
+
+    def open_unsolved_card_writer(self, name: str, creator: str) -> Optional[UnsolvedCardWriter]:
+        """
+        This function opens a writer for an unsolved card that will be saved in pieces, so it never has to be held
+        in memory whole.
+        :param name: The name of the card.
+        :param creator: The creator of the card.
+        :return: A writer for the card's serialisation, or None if the card already exists.
+        """
+        card_path = self._get_unsolved_card_path(name, creator)
+        if self._unsolved_card_exists(card_path):
             print(f"Card at {card_path} already exists! Potentially a duplicate card? Not saving")
+            return None
+        if self.pack_store is not None:
+            return PackedCardWriter(self.pack_store, card_path, on_commit=self._index_unsolved_card)
+        return UnsolvedCardWriter(card_path, on_commit=self._index_unsolved_card)
+
+    def _get_unsolved_card_path(self, name: str, creator: str) -> Path:
+        """
+        Returns the path of an unsolved card. A packed card has no file of its own, its path is in the pack directory
+        only so cards are known by their path either way.
+        """
+        if self.pack_store is not None:
+            return self.pack_store.pack_dir / (creator + name)
+        return self.unsolved_dir / (creator + name)
+
+    def _unsolved_card_exists(self, card_path: Path) -> bool:
+        if card_path in self.journaled_paths:
+            return True
+        if self.pack_store is not None:
+            return card_path.name in self.pack_store
+        return card_path.exists()
+
+    def _write_unsolved_serialisation(self, card: Union[Card, CardView], card_serialisation: bytes) -> bool:
+        card_path = self._get_unsolved_card_path(card.name, card.creator)
+        with self.write_lock:
+            if self._unsolved_card_exists(card_path):
+                print(f"Card at {card_path} already exists! Potentially a duplicate card? Not saving")
+                return False
+            if self.journal is not None:
+                self.journaled_paths.add(card_path)
+        if self.journal is not None:
+            try:
+                self.journal.submit(card_serialisation)
+            except OSError:
+                with self.write_lock:
+                    self.journaled_paths.discard(card_path)
+                raise
+            return True
+        return self._store_unsolved_serialisation(card_path, card_serialisation)
+
+    def _store_unsolved_serialisation(self, card_path: Path, card_serialisation: bytes) -> bool:
+        """
+        Saves a card serialisation to its final place, a pack or a file that only takes the card's name once it's
+        written whole.
+        """
+        if self.pack_store is not None:
+            if not self.pack_store.append(card_path.name, card_serialisation):
+                print(f"Card at {card_path} already exists! Potentially a duplicate card? Not saving")
+                return False
+        else:
+            card_writer = UnsolvedCardWriter(card_path)
+            card_writer.write(card_serialisation)
+            if not card_writer.commit():
+                return False
+        self._index_unsolved_card(card_path)
+        return True
+
+    def _apply_journaled_serialisation(self, card_serialisation: bytes):
+        card_view = CardView(card_serialisation)
+        card_path = self._get_unsolved_card_path(card_view.name, card_view.creator)
+        # A card replayed from the journal may have been saved already, before the journal was emptied.
+        stored = self._store_unsolved_serialisation(card_path, card_serialisation)
+        with self.write_lock:
+            self.journaled_paths.discard(card_path)
+            if stored and self.pack_store is None:
+                self.unsynced_paths.append(card_path)
+
+    def _sync_journaled_cards(self):
+        """
+        Makes the cards saved from the journal durable before it's emptied: their files and the directory they were
+        renamed into, or the pack store. Every file is synced after all were written, so their writeback overlaps.
+        """
+        if self.pack_store is not None:
+            self.pack_store.sync()
+            return
+        with self.write_lock:
+            card_paths, self.unsynced_paths = self.unsynced_paths, []
+        try:
+            for card_path in card_paths:
+                try:
+                    card_fd = os.open(card_path, os.O_RDONLY)
+                except FileNotFoundError:
+                    # Removed since (solved, maybe), there's nothing to lose.
+                    continue
+                try:
+                    os.fsync(card_fd)
+                finally:
+                    os.close(card_fd)
+            fsync_dir(self.unsolved_dir)
+        except OSError:
+            # Synced again next time, the journal isn't emptied until they are.
+            with self.write_lock:
+                self.unsynced_paths[:0] = card_paths
+            raise
+
+    def iter_unsolved_cards(self, name: str = None, creator: str = None,
+                            batch_size: int = DEFAULT_ITER_BATCH_SIZE,
+                            after: Optional[tuple[str, str]] = None,
+                            limit: Optional[int] = None) -> Iterator[CardSummary]:
+        refreshed = self._refresh_unsolved_once()
+        for entries in self.index.iter_find(False, batch_size, name, creator, after, limit):
+            if not refreshed:
+                entries = self._check_unsolved_entries(entries, name, creator)
+            yield from self._load_unsolved_cards(entries)
+
+    def iter_solved_cards(self, name: str = None, creator: str = None,
+                          batch_size: int = DEFAULT_ITER_BATCH_SIZE,
+                          after: Optional[tuple[str, str]] = None,
+                          limit: Optional[int] = None) -> Iterator[Card]:
+        for entries in self.index.iter_find(True, batch_size, name, creator, after, limit):
+            yield from self._load_solved_cards(entries)
+
+    def flush(self):
+        """
+        Waits until every card saved through the journal is in its final place.
+        """
+        if self.journal is not None:
+            self.journal.flush()
+
+    def _read_unsolved_card(self, card_path: Path) -> CardSummary:
+        if self.pack_store is None:
+            return CardSummary.from_path(card_path)
+        serialisation = self.pack_store.get(card_path.name)
+        if serialisation is None:
+            raise FileNotFoundError(f"No card {card_path.name} in {self.pack_store}")
+        return CardSummary.from_serialisation(card_path, serialisation)
+
+    def _make_unsolved_entry(self, card_path: Path) -> IndexEntry:
+        if self.pack_store is None:
+            # Taken before the card is read, so a card changed while it's read is read again by the next refresh.
+            card_stat = os.stat(card_path)
+            return IndexEntry.from_summary(self._read_unsolved_card(card_path), card_stat.st_size,
+                                           card_stat.st_mtime_ns)
+        card = self._read_unsolved_card(card_path)
+        return IndexEntry.from_summary(card, len(card._serialisation), time.time_ns())
+
+    def _index_unsolved_card(self, card_path: Path):
+        self.index.add(self._make_unsolved_entry(card_path))
+
+    def remove_unsolved_card(self, name: str, creator: str) -> bool:
+        """
+        Removes an unsolved card (once it's solved, for example). Packed cards are only marked removed, their space is
+        reclaimed by the pack store's compaction.
+        :return: True if the card was removed, False if there's no such card.
+        """
+        card_path = self._get_unsolved_card_path(name, creator)
+        if self.pack_store is not None:
+            removed = self.pack_store.remove(card_path.name)
+        else:
+            removed = card_path.exists()
+            if removed:
+                os.remove(card_path)
+        self.index.remove(card_path)
+        return removed
+
+    def _stat_unsolved_card_paths(self, indexed_stats: dict[Path, tuple[int, int]]) -> dict[Path, tuple[int, int]]:
+        """
+        Returns the size and mtime of every card file in the unsolved directory, by its path. Packed cards are only
+        ever changed through the driver, so they're taken to be as indexed, and only cards missing from the index are
+        told apart.
+        """
+        card_stats = {}
+        for card_path in self._iter_unsolved_card_paths():
+            if self.pack_store is not None:
+                card_stats[card_path] = indexed_stats.get(card_path)
+                continue
+            try:
+                card_stat = os.stat(card_path)
+            except FileNotFoundError:
+                continue
+            card_stats[card_path] = (card_stat.st_size, card_stat.st_mtime_ns)
+        return card_stats
+
+    def _diff_unsolved(self) -> tuple[list[Path], list[Path], set[Path]]:
+        """
+        Compares every card file's size and mtime to the index of the unsolved cards.
+        :return: The paths of the new and changed cards, of the indexed cards that are gone, and of the indexed cards
+        that are as indexed.
+        """
+        indexed_stats = self.index.get_file_stats(solved=False)
+        card_stats = self._stat_unsolved_card_paths(indexed_stats)
+        changed_paths = [card_path for card_path, card_stat in card_stats.items()
+                         if card_path not in indexed_stats or indexed_stats[card_path] != card_stat]
+        # Cards indexed after the index was read are only missing from the listing if they're gone since.
+        removed_paths = [card_path for card_path in indexed_stats if card_path not in card_stats]
+        unchanged_paths = set(card_stats).difference(changed_paths)
+        return changed_paths, removed_paths, unchanged_paths
+
+    def _index_unsolved_paths(self, card_paths: list[Path], workers: int,
+                              batch_size: int) -> Iterator[list[IndexEntry]]:
+        """
+        Reads the headers of the given cards on a pool of threads, and indexes them a batch at a time.
+        :return: An iterator of the batches of entries, each yielded once it's indexed.
+        """
+        if not card_paths:
+            return
+        with ThreadPoolExecutor(workers) as executor:
+            batch, removed_paths = [], []
+            for card_path, entry in zip(card_paths, executor.map(self._read_unsolved_entry, card_paths)):
+                if entry is None:
+                    removed_paths.append(card_path)
+                else:
+                    batch.append(entry)
+                if len(batch) + len(removed_paths) >= batch_size:
+                    self.index.update(batch, removed_paths)
+                    yield batch
+                    batch, removed_paths = [], []
+            self.index.update(batch, removed_paths)
+            yield batch
+
+    def refresh_unsolved(self, workers: int = DEFAULT_REINDEX_WORKERS) -> bool:
+        """
+        Brings the index of the unsolved cards up to date with the unsolved directory, so cards put in it, changed or
+        removed without the driver are found like the rest. Every card file's size and mtime are compared to the
+        index, and only the headers of the new and changed cards are read, on a pool of threads.
+        The first unsolved query of a driver refreshes the index, later queries only check the cards they return.
+        :param workers: The amount of threads reading cards.
+        :return: Whether anything changed.
+        """
+        changed_paths, removed_paths, _ = self._diff_unsolved()
+        self.index.update([], removed_paths)
+        for _ in self._index_unsolved_paths(changed_paths, workers, DEFAULT_ITER_BATCH_SIZE):
+            pass
+        self.unsolved_refreshed = True
+        return bool(changed_paths or removed_paths)
+
+    def iter_refreshed_unsolved_cards(self, workers: int = DEFAULT_REINDEX_WORKERS,
+                                      batch_size: int = DEFAULT_ITER_BATCH_SIZE) -> Iterator[CardSummary]:
+        """
+        Refreshes the index of the unsolved cards (see refresh_unsolved), yielding every unsolved card as it's ready:
+        first the cards that are as indexed, and then the new and changed cards a batch at a time, as they're read and
+        indexed. For listing every card while a new (or stale) index is built, without waiting for all of it.
+        """
+        changed_paths, removed_paths, unchanged_paths = self._diff_unsolved()
+        self.index.update([], removed_paths)
+        for entries in self.index.iter_find(False, batch_size):
+            yield from self._load_unsolved_cards([entry for entry in entries if entry.path in unchanged_paths])
+        for entries in self._index_unsolved_paths(changed_paths, workers, batch_size):
+            yield from self._load_unsolved_cards(entries)
+        self.unsolved_refreshed = True
+
+    def _refresh_unsolved_once(self) -> bool:
+        """
+        Refreshes the index of the unsolved cards, unless it was refreshed since the driver was opened.
+        :return: Whether it was refreshed now.
+        """
+        if self.unsolved_refreshed:
             return False
-        card_serialisation = card.serialise()
-        with open(card_path, mode="wb") as card_file:
-            card_file.write(card_serialisation)
+        self.refresh_unsolved()
         return True
 
+    def _check_unsolved_entries(self, entries: list[IndexEntry], name: Optional[str] = None,
+                                creator: Optional[str] = None) -> list[IndexEntry]:
+        """
+        Checks the files of the given entries (and only theirs) against the index: cards removed without the driver
+        are dropped from it, and cards changed without it are read again. Packed cards are only ever changed through
+        the driver, and aren't checked.
+        :param name: The name the entries were found by, a card changed to another name is dropped from the result.
+        :param creator: The creator the entries were found by, likewise.
+        :return: The entries, as they are now.
+        """
+        if self.pack_store is not None:
+            return entries
+        checked, changed, removed_paths = [], [], []
+        for entry in entries:
+            try:
+                card_stat = os.stat(entry.path)
+            except FileNotFoundError:
+                removed_paths.append(entry.path)
+                continue
+            if (card_stat.st_size, card_stat.st_mtime_ns) != (entry.size, entry.mtime_ns):
+                card_path, entry = entry.path, self._read_unsolved_entry(entry.path)
+                if entry is None:
+                    removed_paths.append(card_path)
+                    continue
+                changed.append(entry)
+            if (name is None or entry.name == name) and (creator is None or entry.creator == creator):
+                checked.append(entry)
+        if changed or removed_paths:
+            self.index.update(changed, removed_paths)
+        return checked
+
+    def _find_unsolved_entries(self, name: Optional[str] = None, creator: Optional[str] = None) -> list[IndexEntry]:
+        if self._refresh_unsolved_once():
+            return self.index.find(solved=False, name=name, creator=creator)
+        return self._check_unsolved_entries(self.index.find(solved=False, name=name, creator=creator), name, creator)
+
+    def _iter_unsolved_card_paths(self) -> Iterator[Path]:
+        if self.pack_store is not None:
+            for key in self.pack_store.keys():
+                yield self.pack_store.pack_dir / key
+            return
+        if not self.unsolved_dir.is_dir():
+            return
+        for card_file in os.listdir(self.unsolved_dir):
+            # Hidden files are cards that are still being written (see UnsolvedCardWriter), or the index.
+            if card_file.startswith("."):
+                continue
+            card_path = self.unsolved_dir / card_file
+            if card_path.is_file():
+                yield card_path
+
+    def _iter_solved_metadata_paths(self) -> Iterator[Path]:
+        if not self.solved_dir.is_dir():
+            return
+        for card_dir in os.listdir(self.solved_dir):
+            if card_dir.startswith("."):
+                continue
+            metadata_path = self.solved_dir / card_dir / "metadata.json"
+            if metadata_path.is_file():
+                yield metadata_path
+
+    def _read_unsolved_entry(self, card_path: Path) -> Optional[IndexEntry]:
+        try:
+            return self._make_unsolved_entry(card_path)
+        except (ValueError, OSError) as e:
+            print(f"Couldn't read the unsolved card at {card_path}, not indexing it: {e}")
+            return None
+
     @staticmethod
-    def _serialisation_file_to_card(card_path: Path) -> Card:
+    def _read_solved_entry(metadata_path: Path) -> Optional[IndexEntry]:
+        try:
+            with open(metadata_path, mode='r') as metadata_file:
+                metadata = json.load(metadata_file)
+            return IndexEntry(metadata_path, metadata["name"], metadata["creator"], solved=True)
+        except (ValueError, KeyError, OSError) as e:
+            print(f"Couldn't read the solved card at {metadata_path}, not indexing it: {e}")
+            return None
+
+    def _read_solved_entries(self, workers: int) -> list[IndexEntry]:
+        with ThreadPoolExecutor(workers) as executor:
+            entries = executor.map(self._read_solved_entry, list(self._iter_solved_metadata_paths()))
+            return [entry for entry in entries if entry is not None]
+
+    def reindex(self, workers: int = DEFAULT_REINDEX_WORKERS) -> int:
         """
-        This function receives a path to a card serialisation file, and returns a card object.
+        Rebuilds the metadata index from the cards in the directories, reading them on a pool of threads.
+        :param workers: The amount of threads reading cards.
+        :return: The amount of cards indexed.
         """
-        with open(card_path, mode='rb') as card_file:
-            serialisation = card_file.read()
-        card = Card.deserialize(serialisation)
-        return card
+        with ThreadPoolExecutor(workers) as executor:
+            unsolved_entries = executor.map(self._read_unsolved_entry, list(self._iter_unsolved_card_paths()))
+            entries = [entry for entry in unsolved_entries if entry is not None]
+        entries += self._read_solved_entries(workers)
+        self.index.replace_all(entries)
+        self.unsolved_refreshed = True
+        return len(entries)
 
-    def _get_all_unsolved_cards(self) -> list[Card]:
-        unsolved_card_paths = [Path(card_path) for card_path in os.listdir(self.unsolved_dir)]
+    def _load_unsolved_cards(self, entries: list[IndexEntry]) -> list[CardSummary]:
+        if self.pack_store is None:
+            # The cards' headers are in the index, their files are only read if and when their images are needed.
+            return [entry.to_summary() for entry in entries]
         cards = []
-        for card_path in unsolved_card_paths:
-            if not card_path.exists():
-                continue
-            card = self._serialisation_file_to_card(card_path)
-            cards.append(card)
+        for entry in entries:
+            try:
+                cards.append(self._read_unsolved_card(entry.path))
+            except FileNotFoundError:
+                # The card was removed since it was found, it's gone from the index too.
+                self.index.remove(entry.path)
         return cards
 
-    def get_unsolved_card_by_name(self, name: str = None) -> list[Card]:
+    def _load_solved_cards(self, entries: list[IndexEntry]) -> list[Card]:
+        cards = []
+        for entry in entries:
+            try:
+                cards.append(self._json_to_card(entry.path))
+            except FileNotFoundError:
+                self.index.remove(entry.path)
+        return cards
+
+    def _get_all_unsolved_cards(self) -> list[CardSummary]:
+        return self._load_unsolved_cards(self._find_unsolved_entries())
+
+    def get_unsolved_card_by_name(self, name: str = None) -> list[CardSummary]:
         # unsolved cards are kept using only their serialisation.
         if name is None:
             return self._get_all_unsolved_cards()
-        card_path = self.unsolved_dir / name
-        if not card_path.exists():
-            raise FileNotFoundError(f"No such unsolved card {card_path}\n Maybe its been solved already?")
-        card = self._serialisation_file_to_card(card_path)
-        return [card]
+        cards = self._load_unsolved_cards(self._find_unsolved_entries(name=name))
+        if not cards:
+            raise FileNotFoundError(f"No such unsolved card {name} in {self.unsolved_dir}\n"
+                                    f" Maybe its been solved already?")
+        return cards
 
-    @staticmethod
-    def _json_to_card(metadata_path: Path) -> Card:
+    def _json_to_card(self, metadata_path: Path) -> Card:
         """
         This function receives a path to a card metadata file, and returns a card object
         generated from the given metadata file.
@@ -82,6 +609,9 @@ class FilesystemDriver(BaseDriver):
         with open(metadata_path, mode='r') as metadata_file:
             metadata_json = metadata_file.read()
             metadata = json.loads(metadata_json)
+        if metadata.get("image_digest") is not None:
+            # The image is found by its digest, so the blob store may move along with the directory.
+            metadata["path"] = str(self._get_blob_store().get_path(metadata["image_digest"]))
         card = Card.load_from_metadata(metadata)
         return card
 
@@ -89,45 +619,57 @@ class FilesystemDriver(BaseDriver):
         """
         This function returns a list of all solved cards.
         """
-        solved_card_paths = [Path(card_path) for card_path in os.listdir(self.solved_dir)]
-        cards = []
-        for card_path in solved_card_paths:
-            if not card_path.exists():
-                continue
-            card = self._json_to_card(card_path / "metadata.json")
-            cards.append(card)
-        return cards
+        return self._load_solved_cards(self.index.find(solved=True))
 
     def get_solved_card_by_name(self, name: str = None) -> list[Card]:
         if name is None:
             return self._get_all_solved_cards()
-        card_path = self.solved_dir / name
-        if not card_path.exists():
-            raise FileNotFoundError(f"No such solved card {card_path}\n")
-        card = self._json_to_card(card_path / "metadata.json")
-        return [card]
-
-    def get_unsolved_cards_by_creator(self, creator: str) -> list[Card]:
-        unsolved_card_paths = [Path(card_path) for card_path in os.listdir(self.unsolved_dir)]
-        cards = []
-        for card_path in unsolved_card_paths:
-            if not card_path.exists():
-                continue
-            card = self._serialisation_file_to_card(card_path)
-            if card.creator == creator:
-                cards.append(card)
+        cards = self._load_solved_cards(self.index.find(solved=True, name=name))
+        if not cards:
+            raise FileNotFoundError(f"No such solved card {name} in {self.solved_dir}\n")
         return cards
 
+    def get_unsolved_cards_by_creator(self, creator: str) -> list[CardSummary]:
+        return self._load_unsolved_cards(self._find_unsolved_entries(creator=creator))
+
     def get_solved_cards_by_creator(self, creator: str) -> list[Card]:
-        solved_card_paths = [Path(card_path) for card_path in os.listdir(self.solved_dir)]
-        cards = []
-        for card_path in solved_card_paths:
-            if not card_path.exists():
-                continue
-            card = self._json_to_card(card_path / "metadata.json")
-            if card.creator == creator:
-                cards.append(card)
-        return cards
+        return self._load_solved_cards(self.index.find(solved=True, creator=creator))
+
+    def get_solved_cards(self, name: str = None, creator: str = None) -> list[Card]:
+        return self._load_solved_cards(self.index.find(solved=True, name=name, creator=creator))
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+        if self.pack_store is not None:
+            self.pack_store.close()
+        if self.blob_store is not None:
+            self.blob_store.close()
+        self.index.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Manage the cards saved by the filesystem driver.")
+    parser.add_argument("command",
+                        choices=["reindex"],
+                        help="reindex: rebuild the cards' metadata index from the cards in the directories")
+    parser.add_argument("solved_dir",
+                        type=str,
+                        help="The directory in which the solved cards are stored")
+    parser.add_argument("unsolved_dir",
+                        type=str,
+                        help="The directory in which the unsolved cards are stored")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=DEFAULT_REINDEX_WORKERS,
+                        help="The amount of threads reading cards")
+    return parser.parse_args()
+
 
-    # Didn't implement all methods, final version uses MongoDB anyways.
-    # This does have the basics though.
+if __name__ == '__main__':
+    args = parse_args()
+    driver = FilesystemDriver(solved_dir=Path(args.solved_dir), unsolved_dir=Path(args.unsolved_dir))
+    try:
+        print(f"Indexed {driver.reindex(args.workers)} card(s).")
+    finally:
+        driver.close()
@@ -0,0 +1,213 @@
+from __future__ import annotations
+from typing import Optional, Iterable, Iterator
+from pathlib import Path
+import threading
+import sqlite3
+import os
+
+from game.card_summary import CardSummary
+
+# Indexes of an older version are dropped and rebuilt, see FilesystemIndex.created.
+INDEX_VERSION = 2
+# The header fields of an unsolved card are kept in the index too, so listing the cards doesn't read their files.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cards (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    creator TEXT NOT NULL,
+    solved INTEGER NOT NULL,
+    key_hash BLOB,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    riddle TEXT,
+    image_width INTEGER,
+    image_height INTEGER,
+    codec TEXT,
+    image_format TEXT
+);
+CREATE INDEX IF NOT EXISTS cards_by_name ON cards (solved, name);
+CREATE INDEX IF NOT EXISTS cards_by_creator ON cards (solved, creator);
+"""
+INSERT_QUERY = "INSERT OR REPLACE INTO cards VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+class IndexEntry:
+    """
+    A row of the index, the metadata of a card saved by the filesystem driver.
+    """
+    __slots__ = ("path", "name", "creator", "solved", "key_hash", "size", "mtime_ns", "riddle", "image_size",
+                 "codec", "image_format")
+
+    def __init__(self, path: Path, name: str, creator: str, solved: bool, key_hash: Optional[bytes] = None,
+                 size: Optional[int] = None, mtime_ns: Optional[int] = None, riddle: Optional[str] = None,
+                 image_size: Optional[tuple[int, int]] = None, codec: Optional[str] = None,
+                 image_format: Optional[str] = None):
+        """
+        :param path: The card's file, the serialisation of an unsolved card or the metadata file of a solved card.
+        :param size: The size of the card's file, taken from the file if not given (along with mtime_ns).
+        :param riddle: The riddle of an unsolved card, the rest of its header is in image_size, codec and
+        image_format.
+        """
+        self.path = Path(path)
+        self.name = name
+        self.creator = creator
+        self.solved = solved
+        self.key_hash = key_hash
+        if size is None or mtime_ns is None:
+            card_stat = os.stat(path)
+            size, mtime_ns = card_stat.st_size, card_stat.st_mtime_ns
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.riddle = riddle
+        self.image_size = image_size
+        self.codec = codec
+        self.image_format = image_format
+
+    def __repr__(self):
+        return f"<IndexEntry {self.name} by {self.creator} at {self.path}>"
+
+    def to_row(self) -> tuple:
+        image_width, image_height = self.image_size if self.image_size is not None else (None, None)
+        return (str(self.path), self.name, self.creator, int(self.solved), self.key_hash, self.size, self.mtime_ns,
+                self.riddle, image_width, image_height, self.codec, self.image_format)
+
+    @classmethod
+    def from_row(cls, row: tuple) -> IndexEntry:
+        path, name, creator, solved, key_hash, size, mtime_ns, riddle, image_width, image_height, codec, \
+            image_format = row
+        image_size = (image_width, image_height) if image_width is not None else None
+        return cls(Path(path), name, creator, bool(solved), key_hash, size, mtime_ns, riddle, image_size, codec,
+                   image_format)
+
+    @classmethod
+    def from_summary(cls, card: CardSummary, size: int, mtime_ns: int) -> IndexEntry:
+        """
+        Makes the entry of an unsolved card from its summary, and the stat of its file.
+        """
+        return cls(card.path, card.name, card.creator, False, card.key_hash, size, mtime_ns, card.riddle,
+                   card.image_size, card.codec, card.image_format)
+
+    def to_summary(self) -> CardSummary:
+        """
+        Makes the summary of an unsolved card from its entry, without reading the card's file.
+        """
+        return CardSummary(self.path, self.name, self.creator, self.riddle, self.key_hash, self.image_size,
+                           self.codec, self.image_format)
+
+
+class FilesystemIndex:
+    """
+    An SQLite index of the cards saved by the filesystem driver, so looking cards up by name or creator is an indexed
+    query instead of a scan of the cards directories. Every entry keeps the size and mtime of its card's file, so
+    unsolved cards put in the directory (or changed) without the driver are found by comparing them to the directory
+    (see FilesystemDriver.refresh_unsolved).
+    A single index may be used by many threads.
+    """
+
+    def __init__(self, index_path: Path):
+        self.index_path = index_path
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        # Whether the index is new (or was of an older version, and dropped), and has to be built from the cards.
+        self.created = not index_path.exists()
+        self.connection = sqlite3.connect(index_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            if not self.created and self.connection.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+                self.connection.execute("DROP TABLE IF EXISTS cards")
+                self.created = True
+            self.connection.executescript(SCHEMA)
+            self.connection.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+
+    def __repr__(self):
+        return f"<FilesystemIndex at {self.index_path}>"
+
+    def add(self, entry: IndexEntry):
+        with self.lock, self.connection:
+            self.connection.execute(INSERT_QUERY, entry.to_row())
+
+    def remove(self, path: Path):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM cards WHERE path = ?", (str(path),))
+
+    def update(self, entries: Iterable[IndexEntry], removed_paths: Iterable[Path]):
+        """
+        Adds (or replaces) the given entries and removes the entries of the given paths, in a single transaction.
+        """
+        with self.lock, self.connection:
+            self.connection.executemany(INSERT_QUERY, (entry.to_row() for entry in entries))
+            self.connection.executemany("DELETE FROM cards WHERE path = ?", ((str(path),) for path in removed_paths))
+
+    def get_file_stats(self, solved: bool) -> dict[Path, tuple[int, int]]:
+        """
+        Returns the size and mtime of the file of every solved or unsolved card in the index, by its path.
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT path, size, mtime_ns FROM cards WHERE solved = ?",
+                                           (int(solved),)).fetchall()
+        return {Path(path): (size, mtime_ns) for path, size, mtime_ns in rows}
+
+    def replace_all(self, entries: Iterable[IndexEntry]):
+        """
+        Replaces every entry in the index with the given ones, in a single transaction.
+        """
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM cards")
+            self.connection.executemany(INSERT_QUERY, (entry.to_row() for entry in entries))
+
+    def find(self, solved: bool, name: Optional[str] = None, creator: Optional[str] = None) -> list[IndexEntry]:
+        """
+        Returns the entries of the solved or unsolved cards with the given name and creator, either may be None to
+        match any.
+        """
+        query = "SELECT * FROM cards WHERE solved = ?"
+        parameters = [int(solved)]
+        if name is not None:
+            query += " AND name = ?"
+            parameters.append(name)
+        if creator is not None:
+            query += " AND creator = ?"
+            parameters.append(creator)
+        with self.lock:
+            rows = self.connection.execute(query + " ORDER BY name, creator", parameters).fetchall()
+        return [IndexEntry.from_row(row) for row in rows]
+
+    def iter_find(self, solved: bool, batch_size: int, name: Optional[str] = None, creator: Optional[str] = None,
+                  after: Optional[tuple[str, str]] = None,
+                  limit: Optional[int] = None) -> Iterator[list[IndexEntry]]:
+        """
+        Yields the entries find would return in batches, each fetched by its own query that resumes after the last
+        (name, creator) of the batch before it. No query stays open between batches, so the index may change while
+        they're consumed.
+        :param after: The (name, creator) to resume after.
+        :param limit: The most entries to yield.
+        """
+        query = "SELECT * FROM cards WHERE solved = ?"
+        parameters = [int(solved)]
+        if name is not None:
+            query += " AND name = ?"
+            parameters.append(name)
+        if creator is not None:
+            query += " AND creator = ?"
+            parameters.append(creator)
+        while limit is None or limit > 0:
+            fetch_size = batch_size if limit is None else min(batch_size, limit)
+            batch_query, batch_parameters = query, list(parameters)
+            if after is not None:
+                batch_query += " AND (name, creator) > (?, ?)"
+                batch_parameters += after
+            with self.lock:
+                rows = self.connection.execute(batch_query + " ORDER BY name, creator LIMIT ?",
+                                               batch_parameters + [fetch_size]).fetchall()
+            if not rows:
+                return
+            entries = [IndexEntry.from_row(row) for row in rows]
+            yield entries
+            if limit is not None:
+                limit -= len(entries)
+            if len(entries) < fetch_size:
+                return
+            after = (entries[-1].name, entries[-1].creator)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,309 @@
+from typing import Optional, Callable, BinaryIO, TextIO
+from pathlib import Path
+import threading
+import struct
+import fcntl
+import queue
+import zlib
+import time
+import os
+
+from exceptions import StoreInUseException
+
+# Every record is its length and crc32, followed by the data. A record that's cut off or doesn't match its crc was
+# never committed, and ends the journal.
+RECORD_HEADER_FORMAT = "<II"
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER_FORMAT)
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_BATCH_INTERVAL = 0.005
+# Next to the journal, locked by whoever is writing to (or replaying) the journal.
+LOCK_SUFFIX = ".lock"
+
+
+def fsync_dir(dir_path: Path):
+    """
+    Makes the entries of a directory durable, the files created in (or renamed into) it.
+    """
+    dir_fd = os.open(dir_path, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+class IngestJournal:
+    """
+    A write-ahead journal for saving cards at a high rate. Submitted cards are appended to the journal and fsynced in
+    batches (group commit): a batch is committed once it has batch_size cards, or once its first card waited
+    batch_interval seconds, so a burst of cards shares a single fsync. Committed cards are applied (saved to their
+    final place) in the background, and the journal is emptied whenever every card in it was applied.
+    A card is safe once submit returns, if the process dies before it's applied, it's applied again when the journal
+    is replayed on the next start. A card that fails to apply is kept in the journal, which isn't emptied anymore.
+    A journal has a single owner, who holds a lock on it (a file next to it) from start until close. Replaying is
+    left to the owner while the journal is in use.
+    """
+
+    def __init__(self,
+                 journal_path: Path,
+                 apply: Callable[[bytes], None],
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 batch_interval: float = DEFAULT_BATCH_INTERVAL,
+                 sync: Optional[Callable[[], None]] = None):
+        """
+        :param journal_path: The journal's file.
+        :param apply: Saves a journaled card to its final place, must be fine with being called again for a card it
+        already saved (when the journal is replayed).
+        :param batch_size: The amount of cards after which a batch is committed.
+        :param batch_interval: The time, in seconds, after which a batch is committed even if it isn't full.
+        :param sync: Makes the cards applied so far durable (fsyncs them), called before the journal is emptied. The
+        journal may only be emptied once what it holds is safe elsewhere.
+        """
+        self.journal_path = journal_path
+        self.apply = apply
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.sync = sync
+        self.journal_file: Optional[BinaryIO] = None
+        self.lock_file: Optional[TextIO] = None
+        # Set if a card left by a previous run failed to apply, which keeps the journal from being emptied.
+        self.replay_failed = False
+        self.cond = threading.Condition()
+        self.io_lock = threading.Lock()
+        self.pending: list[bytes] = []
+        self.first_pending_time = 0.0
+        self.apply_queue: queue.Queue = queue.Queue()
+        self.threads: list[threading.Thread] = []
+        self.closed = False
+        self.error: Optional[OSError] = None
+        # Counters, see get_stats
+        self.submitted = 0
+        self.committed = 0
+        self.batches = 0
+        self.written = 0
+        self.applied = 0
+        self.failed = 0
+
+    def __repr__(self):
+        return f"IngestJournal({self.journal_path}, batch_size={self.batch_size}, " \
+               f"batch_interval={self.batch_interval})"
+
+    def _lock(self) -> bool:
+        """
+        Takes the journal's lock, without waiting for it.
+        :return: True if the lock was taken, False if someone else holds it.
+        """
+        self.lock_file = open(self.journal_path.with_name(self.journal_path.name + LOCK_SUFFIX), mode="a")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._unlock()
+            return False
+        return True
+
+    def _unlock(self):
+        # Closing the lock file releases the lock.
+        self.lock_file.close()
+        self.lock_file = None
+
+    def _sync_and_empty(self, empty: Callable[[], None]) -> bool:
+        """
+        Makes the applied cards durable, and only then empties the journal.
+        :return: Whether the journal was emptied.
+        """
+        try:
+            if self.sync is not None:
+                self.sync()
+            empty()
+        except OSError as e:
+            print(f"Failed syncing the cards applied from {self.journal_path}, keeping them in the journal: {e!r}")
+            return False
+        return True
+
+    def replay(self) -> int:
+        """
+        Applies the cards committed to the journal by a previous run, in order, and empties it. If a card fails to
+        apply, the replay stops there and the journal is kept whole (and reported), to be replayed again next time.
+        A journal that's in use (started by a driver, maybe in another process) is left alone, its cards are its
+        owner's to apply.
+        :return: The amount of cards replayed.
+        """
+        owned = self.lock_file is not None
+        if not owned and not self._lock():
+            print(f"The journal at {self.journal_path} is in use, leaving its cards to its owner")
+            return 0
+        try:
+            return self._replay()
+        finally:
+            if not owned:
+                self._unlock()
+
+    def _replay(self) -> int:
+        replayed = 0
+        try:
+            journal_file = open(self.journal_path, mode="rb")
+        except FileNotFoundError:
+            return 0
+        # The end of the last complete record, what follows it was never committed.
+        committed_size = 0
+        with journal_file:
+            while len(header := journal_file.read(RECORD_HEADER_SIZE)) == RECORD_HEADER_SIZE:
+                length, crc = struct.unpack(RECORD_HEADER_FORMAT, header)
+                data = journal_file.read(length)
+                if len(data) != length or zlib.crc32(data) != crc:
+                    break
+                committed_size = journal_file.tell()
+                if self.replay_failed:
+                    # The rest of the cards wait for the one that failed, they're only read to find the journal's end.
+                    continue
+                try:
+                    self.apply(data)
+                    replayed += 1
+                except Exception as e:
+                    print(f"Failed replaying card #{replayed + 1} from {self.journal_path}, stopping and keeping the "
+                          f"journal: {e!r}")
+                    self.replay_failed = True
+        if self.replay_failed:
+            # Only the uncommitted tail is dropped, so cards appended from now on follow the committed ones.
+            os.truncate(self.journal_path, committed_size)
+        else:
+            self._sync_and_empty(lambda: os.truncate(self.journal_path, 0))
+        return replayed
+
+    def start(self):
+        """
+        Takes the journal's lock (for as long as it's open), replays it, and starts committing and applying cards.
+        :raises StoreInUseException: If another journal (in this process or another) has the journal started.
+        """
+        if not self._lock():
+            raise StoreInUseException(f"The journal at {self.journal_path} is in use by another journal (is the "
+                                      f"server running on this directory?)")
+        try:
+            replayed = self.replay()
+        except BaseException:
+            self._unlock()
+            raise
+        if replayed:
+            print(f"Replayed {replayed} card(s) from {self.journal_path}")
+        self.journal_file = open(self.journal_path, mode="ab")
+        for target in (self._commit_batches, self._apply_batches):
+            journal_thread = threading.Thread(target=target, daemon=True)
+            journal_thread.start()
+            self.threads.append(journal_thread)
+
+    def submit(self, data: bytes):
+        """
+        Adds a card to the journal, and waits until it's committed (but not necessarily applied).
+        """
+        with self.cond:
+            if self.closed or self.error is not None:
+                raise OSError(f"The journal at {self.journal_path} isn't accepting cards") from self.error
+            if not self.pending:
+                self.first_pending_time = time.monotonic()
+            self.pending.append(data)
+            self.submitted += 1
+            sequence = self.submitted
+            self.cond.notify_all()
+            while self.committed < sequence:
+                self.cond.wait()
+            if self.error is not None:
+                raise OSError(f"Failed writing to the journal at {self.journal_path}") from self.error
+
+    def _take_batch(self) -> Optional[list[bytes]]:
+        with self.cond:
+            while not self.pending and not self.closed:
+                self.cond.wait()
+            if not self.pending:
+                return None
+            deadline = self.first_pending_time + self.batch_interval
+            while len(self.pending) < self.batch_size and not self.closed \
+                    and (remaining := deadline - time.monotonic()) > 0:
+                self.cond.wait(remaining)
+            batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+            if self.pending:
+                self.first_pending_time = time.monotonic()
+            return batch
+
+    def _commit_batches(self):
+        while (batch := self._take_batch()) is not None:
+            try:
+                with self.io_lock:
+                    for data in batch:
+                        self.journal_file.write(struct.pack(RECORD_HEADER_FORMAT, len(data), zlib.crc32(data)))
+                        self.journal_file.write(data)
+                    self.journal_file.flush()
+                    os.fsync(self.journal_file.fileno())
+                    self.written += len(batch)
+            except OSError as e:
+                print(f"Failed committing to {self.journal_path}: {e!r}")
+                with self.cond:
+                    self.error = e
+                    self.committed += len(batch)
+                    self.cond.notify_all()
+                continue
+            with self.cond:
+                self.committed += len(batch)
+                self.batches += 1
+                self.cond.notify_all()
+            self.apply_queue.put(batch)
+        self.apply_queue.put(None)
+
+    def _apply_batches(self):
+        while (batch := self.apply_queue.get()) is not None:
+            applied = 0
+            for data in batch:
+                try:
+                    self.apply(data)
+                    applied += 1
+                except Exception as e:
+                    # The card stays in the journal (which isn't emptied anymore), and is applied again on replay.
+                    print(f"Failed applying a card from {self.journal_path}, it's kept in the journal: {e!r}")
+            with self.io_lock:
+                self.applied += applied
+                caught_up = self.applied == self.written
+            if caught_up and not self.replay_failed:
+                # Synced without the io lock, so cards are committed meanwhile, the journal is only emptied if none
+                # were.
+                def empty():
+                    with self.io_lock:
+                        if self.applied == self.written:
+                            self.journal_file.truncate(0)
+                self._sync_and_empty(empty)
+            with self.cond:
+                self.failed += len(batch) - applied
+                self.cond.notify_all()
+
+    def flush(self):
+        """
+        Waits until every card submitted so far was applied (or failed to apply).
+        """
+        with self.cond:
+            while self.applied + self.failed < self.committed or self.committed < self.submitted:
+                self.cond.wait()
+
+    def close(self):
+        """
+        Commits and applies the cards submitted so far, and stops the journal.
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for journal_thread in self.threads:
+            journal_thread.join()
+        self.threads = []
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
+        if self.lock_file is not None:
+            self._unlock()
+
+    def get_stats(self) -> dict[str, int]:
+        """
+        Returns a snapshot of the journal's counters.
+        """
+        with self.cond:
+            return {"submitted": self.submitted,
+                    "committed": self.committed,
+                    "batches": self.batches,
+                    "applied": self.applied,
+                    "failed": self.failed,
+                    "pending": len(self.pending)}
@@ -1,9 +1,16 @@
 from __future__ import annotations
 
-from pymongo import MongoClient
-from typing import Mapping, Any
+from pymongo import MongoClient, IndexModel, ASCENDING
+from pymongo.collection import Collection
+from typing import Mapping, Any, Optional, Iterator
+from pathlib import Path
+import threading
+import atexit
 
-from backend.data_management.base_driver import BaseDriver
+from backend.data_management.base_driver import BaseDriver, DEFAULT_ITER_BATCH_SIZE
+from backend.data_management.blob_store import BlobStore
+from backend.data_management.drivers.write_behind import WriteBehindWriter, DEFAULT_BATCH_SIZE, DEFAULT_BATCH_DELAY, \
+    DEFAULT_QUEUE_SIZE
 from exceptions import CardNotFound
 from game.card import Card
 
@@ -11,6 +18,15 @@ DEFAULT_MONGO_CONN_STR = "mongodb://127.0.0.1:27017"
 DEFAULT_DATABASE_NAME = "CARDAZIM"
 DEFAULT_UNSOLVED_COLLECTION_NAME = "unsolved_cards"
 DEFAULT_SOLVED_COLLECTION_NAME = "solved_cards"
+DEFAULT_BLOB_DIR = Path("../../data/blobs")
+# The indexes both collections need for the driver's queries, by name (and creator) and by creator.
+CARD_INDEXES = [IndexModel([("name", ASCENDING), ("creator", ASCENDING)], name="name_creator"),
+                IndexModel([("creator", ASCENDING), ("name", ASCENDING)], name="creator_name")]
+# The fields a card is made of, so nothing else stored with it is fetched.
+SOLVED_CARD_FIELDS = ["name", "creator", "riddle", "image_path", "image_digest", "solution"]
+UNSOLVED_CARD_FIELDS = ["name", "creator", "riddle", "image_path", "image_digest", "key_hash"]
+# The shapes of the driver's filtered queries, see check_query_shapes.
+QUERY_SHAPES = [{"name": ""}, {"creator": ""}, {"name": "", "creator": ""}]
 
 
 class MongoDriver(BaseDriver):
@@ -19,29 +35,80 @@ class MongoDriver(BaseDriver):
                  mongo_conn_str: str,
                  database_name: str,
                  unsolved_cards_collection_name: str,
-                 solved_cards_collection_name: str):
+                 solved_cards_collection_name: str,
+                 blob_store: Optional[BlobStore] = None,
+                 blob_dir: Optional[Path] = None,
+                 write_behind: bool = False,
+                 write_batch_size: int = DEFAULT_BATCH_SIZE,
+                 write_batch_delay: float = DEFAULT_BATCH_DELAY,
+                 write_queue_size: int = DEFAULT_QUEUE_SIZE,
+                 create_indexes: bool = True):
+        """
+        :param blob_store: Where the images of solved cards are kept, so documents reference them by digest. Without
+        one, documents keep the path the card's image was created from.
+        :param blob_dir: Where to open the blob store (instead of passing one), once the driver first needs it.
+        :param write_behind: Whether saved cards are inserted in batches in the background (see WriteBehindWriter)
+        rather than one by one as they're saved. Saved cards are only found once they're flushed, see flush.
+        :param write_batch_size: The amount of cards after which a batch is inserted.
+        :param write_batch_delay: The time, in seconds, after which a batch is inserted even if it isn't full.
+        :param write_queue_size: The amount of cards that may wait to be inserted before saving blocks.
+        :param create_indexes: Whether to create the indexes the driver's queries need (see ensure_indexes) before
+        its first query. They aren't created when the driver is made, so making one doesn't wait for the database.
+        """
+        self.blob_store = blob_store
+        self.blob_dir = blob_dir
+        self.blob_store_lock = threading.Lock()
+        # Only closed by the driver if the driver opened it.
+        self.owns_blob_store = False
         self.client = MongoClient(mongo_conn_str)
         self.database = self.client.get_database(database_name)
         self.solved_cards_collection = self.database.get_collection(solved_cards_collection_name)
         self.unsolved_cards_collection = self.database.get_collection(unsolved_cards_collection_name)
+        # Whether the indexes still need to be made before the next query, see _get_collection.
+        self.indexes_needed = create_indexes
+        self.indexes_lock = threading.Lock()
+        self.solved_cards_writer: Optional[WriteBehindWriter] = None
+        self.unsolved_cards_writer: Optional[WriteBehindWriter] = None
+        if write_behind:
+            self.solved_cards_writer = WriteBehindWriter(self.solved_cards_collection, write_batch_size,
+                                                         write_batch_delay, write_queue_size)
+            self.unsolved_cards_writer = WriteBehindWriter(self.unsolved_cards_collection, write_batch_size,
+                                                           write_batch_delay, write_queue_size)
+            # Cards still queued when the process exits are inserted before it does.
+            atexit.register(self.close)
 
     @classmethod
     def get_default_driver(cls) -> MongoDriver:
         return cls(DEFAULT_MONGO_CONN_STR,
                    DEFAULT_DATABASE_NAME,
                    DEFAULT_UNSOLVED_COLLECTION_NAME,
-                   DEFAULT_SOLVED_COLLECTION_NAME)
+                   DEFAULT_SOLVED_COLLECTION_NAME,
+                   blob_dir=DEFAULT_BLOB_DIR)
+
+    def _get_blob_store(self) -> Optional[BlobStore]:
+        # Only opened once it's needed, so drivers that never touch an image don't create the blob directory.
+        with self.blob_store_lock:
+            if self.blob_store is None and self.blob_dir is not None:
+                self.blob_store = BlobStore(self.blob_dir)
+                self.owns_blob_store = True
+            return self.blob_store
 
     def save_solved_card(self, card: Card) -> bool:
         card_dict = {'name': card.name,
                      'creator': card.creator,
                      'riddle': card.riddle,
-                     'image_path': card.image_path,
                      'solution': card.solution}
-        if None in card_dict.values():
+        blob_store = self._get_blob_store()
+        if None in card_dict.values() or (card.image_path is None and blob_store is None):
             print("Card is missing fields, not saving...")
             return False
-        self.solved_cards_collection.insert_one(card_dict)
+        if blob_store is not None:
+            card_dict['image_digest'] = blob_store.put_card_image(card)
+        card_dict['image_path'] = card.image_path
+        if self.solved_cards_writer is not None:
+            self.solved_cards_writer.submit(card_dict)
+        else:
+            self.solved_cards_collection.insert_one(card_dict)
         return True
 
     def save_unsolved_card(self, card: Card) -> bool:
@@ -53,11 +120,36 @@ class MongoDriver(BaseDriver):
         if None in card_dict.values():
             print("Card is missing fields, not saving...")
             return False
-        self.unsolved_cards_collection.insert_one(card_dict)
+        if self.unsolved_cards_writer is not None:
+            self.unsolved_cards_writer.submit(card_dict)
+        else:
+            self.unsolved_cards_collection.insert_one(card_dict)
         return True
 
-    @staticmethod
-    def _document_to_card(card_document: Mapping[str, Any], solved: bool) -> Card:
+    def flush(self):
+        """
+        Waits until every card saved so far is in the database, when saving in the background.
+        """
+        for writer in (self.solved_cards_writer, self.unsolved_cards_writer):
+            if writer is not None:
+                writer.flush()
+
+    def close(self):
+        """
+        Inserts the cards still waiting to be (when saving in the background), and closes the connection (and the blob
+        store, if the driver opened it).
+        """
+        for writer in (self.solved_cards_writer, self.unsolved_cards_writer):
+            if writer is not None:
+                writer.close()
+        self.client.close()
+        with self.blob_store_lock:
+            if self.owns_blob_store:
+                self.blob_store.close()
+                self.blob_store = None
+                self.owns_blob_store = False
+
+    def _document_to_card(self, card_document: Mapping[str, Any], solved: bool) -> Card:
         """
         This function receives a card document and returns a card object from the fields
         in the document.
@@ -69,79 +161,196 @@ class MongoDriver(BaseDriver):
         creator = card_document.get('creator')
         riddle = card_document.get('riddle')
         path = card_document.get('image_path')
+        image_digest = card_document.get('image_digest')
+        if image_digest is not None and (blob_store := self._get_blob_store()) is not None:
+            path = str(blob_store.get_path(image_digest))
         solution = None
         key_hash = None
         if solved:
             solution = card_document.get('solution')
         else:
             key_hash = card_document.get('key_hash')
-        card = Card.create_from_path(name, creator, path, riddle, solution, key_hash)
+        # The image is only opened if it's needed, most queries only list cards.
+        card = Card.create_from_path(name, creator, path, riddle, solution, key_hash, lazy=True)
+        card.image_digest = image_digest
         return card
 
+    def ensure_indexes(self):
+        """
+        Creates the indexes the driver's queries need. Indexes that exist already are left as they are, so this is
+        safe to run every time the driver starts. Unless the driver was made with create_indexes=False, it's run
+        before the driver's first query.
+        """
+        for collection in (self.solved_cards_collection, self.unsolved_cards_collection):
+            collection.create_indexes(CARD_INDEXES)
+
+    def _get_collection(self, solved: bool) -> Collection:
+        """
+        Returns the collection to query, creating the driver's indexes first if this is its first query.
+        """
+        if self.indexes_needed:
+            with self.indexes_lock:
+                if self.indexes_needed:
+                    self.ensure_indexes()
+                    self.indexes_needed = False
+        return self.solved_cards_collection if solved else self.unsolved_cards_collection
+
+    @staticmethod
+    def _get_projection(fields: list[str]) -> dict[str, bool]:
+        projection = {field: True for field in fields}
+        projection["_id"] = False
+        return projection
+
+    def _find_cards(self, solved: bool, query: Mapping[str, Any]) -> list[Card]:
+        fields = SOLVED_CARD_FIELDS if solved else UNSOLVED_CARD_FIELDS
+        card_documents = self._get_collection(solved).find(query, self._get_projection(fields))
+        return [self._document_to_card(card_document, solved) for card_document in card_documents]
+
+    def _find_card(self, solved: bool, query: Mapping[str, Any]) -> Optional[Card]:
+        fields = SOLVED_CARD_FIELDS if solved else UNSOLVED_CARD_FIELDS
+        card_document = self._get_collection(solved).find_one(query, self._get_projection(fields))
+        if card_document is None:
+            return None
+        return self._document_to_card(card_document, solved)
+
+    def _iter_cards(self, solved: bool, name: Optional[str], creator: Optional[str], batch_size: int,
+                    after: Optional[tuple[str, str]], limit: Optional[int]) -> Iterator[Card]:
+        if limit == 0:
+            # A limit of 0 is no limit to Mongo.
+            return
+        query = {}
+        if name is not None:
+            query['name'] = name
+        if creator is not None:
+            query['creator'] = creator
+        if after is not None:
+            after_name, after_creator = after
+            query['$or'] = [{'name': {'$gt': after_name}},
+                            {'name': after_name, 'creator': {'$gt': after_creator}}]
+        fields = SOLVED_CARD_FIELDS if solved else UNSOLVED_CARD_FIELDS
+        # Sorted along the name_creator index, so the cursor streams the cards rather than sorting them all first.
+        card_documents = self._get_collection(solved).find(query, self._get_projection(fields)) \
+            .sort([('name', ASCENDING), ('creator', ASCENDING)]) \
+            .batch_size(batch_size)
+        if limit is not None:
+            card_documents = card_documents.limit(limit)
+        with card_documents:
+            for card_document in card_documents:
+                yield self._document_to_card(card_document, solved)
+
+    def iter_solved_cards(self, name: str = None, creator: str = None,
+                          batch_size: int = DEFAULT_ITER_BATCH_SIZE,
+                          after: Optional[tuple[str, str]] = None,
+                          limit: Optional[int] = None) -> Iterator[Card]:
+        return self._iter_cards(True, name, creator, batch_size, after, limit)
+
+    def iter_unsolved_cards(self, name: str = None, creator: str = None,
+                            batch_size: int = DEFAULT_ITER_BATCH_SIZE,
+                            after: Optional[tuple[str, str]] = None,
+                            limit: Optional[int] = None) -> Iterator[Card]:
+        return self._iter_cards(False, name, creator, batch_size, after, limit)
+
+    def find_card_fields(self, solved: bool, fields: list[str], name: Optional[str] = None,
+                         creator: Optional[str] = None) -> list[dict[str, Any]]:
+        """
+        This function returns only the given fields of the cards with the given name and creator (either may be None
+        to match any), for listings that don't need whole cards. Nothing else is fetched, and no image is opened.
+        :param solved: Whether to look for solved or unsolved cards.
+        :param fields: The fields to return, e.g. ["name", "riddle"].
+        :return: A dictionary of the given fields per card.
+        """
+        query = {}
+        if name is not None:
+            query['name'] = name
+        if creator is not None:
+            query['creator'] = creator
+        return list(self._get_collection(solved).find(query, self._get_projection(fields)))
+
+    def explain_query(self, solved: bool, query: Mapping[str, Any]) -> dict[str, Any]:
+        """
+        This function explains how the database runs a query, for finding queries that aren't served by an index.
+        :param solved: Whether the query is of the solved or unsolved cards.
+        :param query: The query's filter.
+        :return: The stages of the query's winning plan, whether it uses an index (no COLLSCAN stage), and the amount
+        of index keys and documents it examined.
+        """
+        explanation = self._get_collection(solved).find(query).explain()
+        stages = self._get_plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+        execution_stats = explanation.get("executionStats", {})
+        return {"query": dict(query),
+                "stages": stages,
+                "indexed": "COLLSCAN" not in stages,
+                "keys_examined": execution_stats.get("totalKeysExamined"),
+                "docs_examined": execution_stats.get("totalDocsExamined")}
+
+    @staticmethod
+    def _get_plan_stages(plan: Mapping[str, Any]) -> list[str]:
+        """
+        Returns the stages of a query plan, from the top one down.
+        """
+        # Newer servers nest the plan itself under queryPlan.
+        plan = plan.get("queryPlan", plan)
+        stages = [plan["stage"]] if "stage" in plan else []
+        child_plans = list(plan.get("inputStages", []))
+        if "inputStage" in plan:
+            child_plans.append(plan["inputStage"])
+        for child_plan in child_plans:
+            stages += MongoDriver._get_plan_stages(child_plan)
+        return stages
+
+    def check_query_shapes(self) -> list[dict[str, Any]]:
+        """
+        This function explains every shape of query the driver runs, on both collections, and reports the ones that
+        aren't served by an index.
+        :return: The explanations (see explain_query) of the unindexed queries.
+        """
+        unindexed = []
+        for solved in (True, False):
+            for query in QUERY_SHAPES:
+                explanation = self.explain_query(solved, query)
+                if not explanation["indexed"]:
+                    print(f"Query {query} on the {'solved' if solved else 'unsolved'} cards isn't indexed, "
+                          f"its plan is {' <- '.join(explanation['stages'])}")
+                    unindexed.append(explanation)
+        return unindexed
+
     def _get_all_solved_cards(self) -> list[Card]:
         """
         This function returns a list of all solved cards.
         """
-        card_documents = self.solved_cards_collection.find()
-        cards = []
-        for card_document in card_documents:
-            card = self._document_to_card(card_document, solved=True)
-            cards.append(card)
-        return cards
+        return self._find_cards(True, {})
 
     def get_solved_card_by_name(self, name: str = None) -> list[Card]:
         if name is None:
             return self._get_all_solved_cards()
-        card_document = self.solved_cards_collection.find_one({'name': name})
-        if card_document is None:
+        card = self._find_card(True, {'name': name})
+        if card is None:
             raise CardNotFound(f"No such card with name: '{name}'.")
-        card = self._document_to_card(card_document, solved=True)
         return [card]
 
     def _get_all_unsolved_cards(self) -> list[Card]:
         """
         This function returns a list of all unsolved cards.
         """
-        card_documents = self.unsolved_cards_collection.find()
-        cards = []
-        for card_document in card_documents:
-            card = self._document_to_card(card_document, solved=False)
-            cards.append(card)
-        return cards
+        return self._find_cards(False, {})
 
     def get_unsolved_card_by_name(self, name: str = None, creator: str = None) -> list[Card]:
         if name is None or creator is None:
             return self._get_all_unsolved_cards()
-        card_document = self.unsolved_cards_collection.find_one({'name': name, 'creator': creator})
-        if card_document is None:
+        card = self._find_card(False, {'name': name, 'creator': creator})
+        if card is None:
             raise CardNotFound(f"No such card with name: '{name}'.")
-        card = self._document_to_card(card_document, solved=False)
         return [card]
 
     def get_unsolved_cards_by_creator(self, creator: str) -> list[Card]:
-        card_documents = self.unsolved_cards_collection.find({'creator': creator})
-        cards = []
-        for card_document in card_documents:
-            card = self._document_to_card(card_document, solved=False)
-            cards.append(card)
-        return cards
+        return self._find_cards(False, {'creator': creator})
 
     def get_solved_cards_by_creator(self, creator: str) -> list[Card]:
-        card_documents = self.solved_cards_collection.find({'creator': creator})
-        cards = []
-        for card_document in card_documents:
-            card = self._document_to_card(card_document, solved=True)
-            cards.append(card)
-        return cards
+        return self._find_cards(True, {'creator': creator})
 
     def get_solved_cards(self, name: str = None, creator: str = None) -> list[Card]:
         if name is None:
             return self.get_solved_cards_by_creator(creator)
         if creator is None:
-            return self._get_all_solved_cards()
-        card_documents = self.solved_cards_collection.find({'name': name, 'creator': creator})
-        cards = []
-        for card_document in card_documents:
-            card = self._document_to_card(card_document, solved=True)
-            cards.append(card)
-        return cards
+            return self._find_cards(True, {'name': name})
+        return self._find_cards(True, {'name': name, 'creator': creator})
@@ -0,0 +1,304 @@
+from typing import Optional, Iterator, BinaryIO
+from pathlib import Path
+import threading
+import shutil
+import struct
+import fcntl
+import mmap
+import os
+
+from backend.data_management.drivers.ingest_journal import fsync_dir
+from exceptions import StoreInUseException
+
+# Every segment has a sidecar index file, a record per card appended to (or removed from) the segment:
+# offset in the segment, length, key length, then the key. Removed cards get a record with TOMBSTONE as their length.
+RECORD_FORMAT = "<QIH"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+TOMBSTONE = 0xFFFFFFFF
+SEGMENT_SUFFIX = ".pack"
+INDEX_SUFFIX = ".idx"
+DEFAULT_SEGMENT_SIZE = 2 ** 28
+# Sealed segments with at least this fraction of removed cards are compacted.
+DEFAULT_COMPACTION_THRESHOLD = 0.5
+# Locked by the store that owns the pack directory, see PackStore.
+LOCK_FILE_NAME = ".lock"
+
+
+class PackStore:
+    """
+    Stores many card serialisations in a few large append-only segment files, instead of a file per card.
+    Cards are read through memory maps of the segments, so reading a card is a slice of the map rather than a read.
+    Removing a card only marks it removed, its space is reclaimed when its segment is compacted: the cards still in
+    it are appended to the active segment, and the old segment is deleted.
+    A pack directory has a single owner: the store keeps its cards' locations in memory, so a second store (in this
+    process or another) appending to or compacting the same segments would corrupt them. The directory is locked for
+    as long as the store is open, and opening another store on it raises StoreInUseException.
+    """
+
+    def __init__(self,
+                 pack_dir: Path,
+                 segment_size: int = DEFAULT_SEGMENT_SIZE,
+                 compaction_threshold: float = DEFAULT_COMPACTION_THRESHOLD):
+        """
+        :param pack_dir: The directory of the segments, created if needed.
+        :param segment_size: The size after which a new segment is started.
+        :param compaction_threshold: The fraction of removed bytes from which a sealed segment is compacted.
+        """
+        self.pack_dir = pack_dir
+        self.segment_size = segment_size
+        self.compaction_threshold = compaction_threshold
+        self.lock = threading.RLock()
+        # key -> (segment, offset, length)
+        self.cards: dict[str, tuple[int, int, int]] = {}
+        self.segment_sizes: dict[int, int] = {}
+        self.live_sizes: dict[int, int] = {}
+        self.maps: dict[int, mmap.mmap] = {}
+        self.active_segment = 0
+        self.segment_file: Optional[BinaryIO] = None
+        self.index_file: Optional[BinaryIO] = None
+        self.compactor: Optional[threading.Thread] = None
+        self.stop_compactor = threading.Event()
+        self.pack_dir.mkdir(parents=True, exist_ok=True)
+        self.lock_file = open(self.pack_dir / LOCK_FILE_NAME, mode="a")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock_file.close()
+            raise StoreInUseException(f"The packs at {self.pack_dir} are in use by another store (is the server "
+                                      f"running on this directory?)")
+        try:
+            self._load()
+        except BaseException:
+            self.lock_file.close()
+            raise
+
+    def __repr__(self):
+        return f"<PackStore at {self.pack_dir} ({len(self.cards)} cards in {len(self.segment_sizes)} segments)>"
+
+    def __len__(self):
+        return len(self.cards)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.cards
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.pack_dir / f"{segment:06}{SEGMENT_SUFFIX}"
+
+    def _index_path(self, segment: int) -> Path:
+        return self.pack_dir / f"{segment:06}{INDEX_SUFFIX}"
+
+    def _load(self):
+        segments = sorted(int(path.stem) for path in self.pack_dir.glob(f"*{SEGMENT_SUFFIX}"))
+        for segment in segments:
+            segment_size = self._segment_path(segment).stat().st_size
+            self.segment_sizes[segment] = segment_size
+            self.live_sizes[segment] = 0
+            for key, offset, length in self._read_index(segment):
+                if key in self.cards:
+                    # Either removed here, or moved to this (later) segment by a compaction that didn't finish.
+                    old_segment, _, old_length = self.cards.pop(key)
+                    self.live_sizes[old_segment] -= old_length
+                if length == TOMBSTONE or offset + length > segment_size:
+                    # A card whose data never made it to the segment is left out.
+                    continue
+                self.cards[key] = (segment, offset, length)
+                self.live_sizes[segment] += length
+        if segments:
+            self.active_segment = segments[-1]
+        self._open_active_segment()
+
+    def _read_index(self, segment: int) -> Iterator[tuple[str, int, int]]:
+        try:
+            index_data = self._index_path(segment).read_bytes()
+        except FileNotFoundError:
+            return
+        position = 0
+        while position + RECORD_SIZE <= len(index_data):
+            offset, length, key_length = struct.unpack_from(RECORD_FORMAT, index_data, position)
+            position += RECORD_SIZE
+            if position + key_length > len(index_data):
+                # A record cut off midway was never completed.
+                break
+            yield index_data[position:position + key_length].decode('utf8'), offset, length
+            position += key_length
+
+    def _open_active_segment(self):
+        if self.segment_file is not None:
+            # Synced before it's closed, see sync.
+            self._sync_active_segment()
+            self.segment_file.close()
+            self.index_file.close()
+        self.segment_file = open(self._segment_path(self.active_segment), mode="ab")
+        self.index_file = open(self._index_path(self.active_segment), mode="ab")
+        self.segment_sizes.setdefault(self.active_segment, self.segment_file.tell())
+        self.live_sizes.setdefault(self.active_segment, 0)
+
+    def _write_record(self, segment: int, key: str, offset: int, length: int):
+        key_bytes = key.encode('utf8')
+        record = struct.pack(RECORD_FORMAT, offset, length, len(key_bytes)) + key_bytes
+        if segment == self.active_segment:
+            self.index_file.write(record)
+            self.index_file.flush()
+        else:
+            with open(self._index_path(segment), mode="ab") as index_file:
+                index_file.write(record)
+
+    def _reserve(self, length: int) -> int:
+        """
+        Returns the offset in the active segment at which the next card goes, starting a new segment if it's full.
+        """
+        # The file's own position, rather than the size we know of, in case a failed write left part of a card behind.
+        active_size = self.segment_file.tell()
+        if active_size and active_size + length > self.segment_size:
+            self.active_segment = max(self.segment_sizes) + 1
+            self._open_active_segment()
+        return self.segment_file.tell()
+
+    def _add(self, key: str, offset: int, length: int):
+        self.segment_sizes[self.active_segment] = offset + length
+        self.live_sizes[self.active_segment] += length
+        # The record is written after the data, so a record always points at complete data.
+        self._write_record(self.active_segment, key, offset, length)
+        self.cards[key] = (self.active_segment, offset, length)
+
+    def append(self, key: str, serialisation: bytes) -> bool:
+        """
+        Appends a card serialisation to the store.
+        :return: True if the card was added, False if there's a card with the same key already.
+        """
+        with self.lock:
+            if key in self.cards:
+                return False
+            offset = self._reserve(len(serialisation))
+            self.segment_file.write(serialisation)
+            self.segment_file.flush()
+            self._add(key, offset, len(serialisation))
+            return True
+
+    def append_file(self, key: str, card_file: BinaryIO) -> bool:
+        """
+        Appends a card serialisation from a file, copied to the store without being read into memory whole.
+        :return: True if the card was added, False if there's a card with the same key already.
+        """
+        length = os.fstat(card_file.fileno()).st_size
+        with self.lock:
+            if key in self.cards:
+                return False
+            offset = self._reserve(length)
+            shutil.copyfileobj(card_file, self.segment_file)
+            self.segment_file.flush()
+            self._add(key, offset, length)
+            return True
+
+    def get(self, key: str) -> Optional[memoryview]:
+        """
+        Returns the card serialisation with the given key, as a view into the segment's memory map, or None if there's
+        no such card. The view stays valid after the card is removed or its segment compacted.
+        """
+        with self.lock:
+            location = self.cards.get(key)
+            if location is None:
+                return None
+            segment, offset, length = location
+            segment_map = self.maps.get(segment)
+            if segment_map is None or len(segment_map) < offset + length:
+                # The segment grew since it was mapped. The old map stays alive as long as views of it do.
+                with open(self._segment_path(segment), mode="rb") as segment_file:
+                    segment_map = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.maps[segment] = segment_map
+            return memoryview(segment_map)[offset:offset + length]
+
+    def remove(self, key: str) -> bool:
+        """
+        Marks the card with the given key removed, its space is reclaimed by compaction.
+        :return: True if the card was removed, False if there's no such card.
+        """
+        with self.lock:
+            location = self.cards.pop(key, None)
+            if location is None:
+                return False
+            segment, _, length = location
+            self.live_sizes[segment] -= length
+            self._write_record(segment, key, 0, TOMBSTONE)
+            return True
+
+    def _sync_active_segment(self):
+        os.fsync(self.segment_file.fileno())
+        os.fsync(self.index_file.fileno())
+
+    def sync(self):
+        """
+        Makes every card appended so far durable: the active segment and its index are fsynced (a segment is synced
+        before the next one is started too), and so is the directory, for segments that were created since.
+        """
+        with self.lock:
+            self._sync_active_segment()
+        fsync_dir(self.pack_dir)
+
+    def keys(self) -> list[str]:
+        with self.lock:
+            return list(self.cards)
+
+    def compact(self) -> int:
+        """
+        Compacts the sealed segments whose removed fraction is at least the compaction threshold.
+        :return: The amount of segments compacted.
+        """
+        with self.lock:
+            segments = [segment for segment, segment_size in self.segment_sizes.items()
+                        if segment != self.active_segment and segment_size
+                        and 1 - self.live_sizes[segment] / segment_size >= self.compaction_threshold]
+            for segment in segments:
+                self._compact_segment(segment)
+            return len(segments)
+
+    def _compact_segment(self, segment: int):
+        live_cards = [(key, offset, length) for key, (card_segment, offset, length) in self.cards.items()
+                      if card_segment == segment]
+        if live_cards:
+            with open(self._segment_path(segment), mode="rb") as segment_file:
+                for key, offset, length in live_cards:
+                    segment_file.seek(offset)
+                    new_offset = self._reserve(length)
+                    self.segment_file.write(segment_file.read(length))
+                    self.segment_file.flush()
+                    del self.cards[key]
+                    self._add(key, new_offset, length)
+        # A compaction cut off midway may have removed either file already.
+        for path in [self._index_path(segment), self._segment_path(segment)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        # Only forgotten once its files are gone, so a segment that failed to be removed is compacted again.
+        # Views into the old segment's map keep it (and the deleted file's data) alive until they're released.
+        self.maps.pop(segment, None)
+        del self.segment_sizes[segment]
+        del self.live_sizes[segment]
+
+    def start_compactor(self, interval: float):
+        """
+        Compacts the store every interval seconds, on a background thread.
+        """
+        self.stop_compactor.clear()
+        self.compactor = threading.Thread(target=self._compact_periodically, args=[interval], daemon=True)
+        self.compactor.start()
+
+    def _compact_periodically(self, interval: float):
+        while not self.stop_compactor.wait(interval):
+            try:
+                self.compact()
+            except OSError as e:
+                print(f"Failed compacting {self}: {e!r}")
+
+    def close(self):
+        if self.compactor is not None:
+            self.stop_compactor.set()
+            self.compactor.join()
+            self.compactor = None
+        with self.lock:
+            self.maps = {}
+            self.segment_file.close()
+            self.index_file.close()
+            # Closing the lock file releases the directory.
+            self.lock_file.close()
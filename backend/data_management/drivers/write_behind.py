@@ -0,0 +1,180 @@
+from typing import Optional, Any
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, ConnectionFailure
+import threading
+import queue
+import time
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BATCH_DELAY = 0.05
+DEFAULT_QUEUE_SIZE = 10000
+# How often the writer, while waiting for documents, checks whether it was closed.
+STOP_CHECK_INTERVAL = 0.05
+# A batch that fails to insert because of the connection (rather than its documents) is tried again this many times,
+# waiting RETRY_DELAY seconds before the first retry and twice as long before each one after it.
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 0.5
+DUPLICATE_KEY_ERROR = 11000
+
+
+class WriteBehindWriter:
+    """
+    Inserts documents into a collection in the background, in batches: documents are queued, and a writer thread
+    inserts them with a single insert_many once batch_size of them are queued, or once the first of them waited
+    batch_delay seconds. The queue is bounded, so when the database falls behind, submitting blocks instead of
+    holding on to more and more documents.
+    Documents are only in the database once they're flushed, flush waits for that, and close flushes the queue before
+    it stops the writer. Documents submitted before close are all inserted, and submitting after it fails.
+    Batches that fail because of the connection are retried, the ones that fail because of their documents aren't.
+    """
+
+    def __init__(self,
+                 collection: Collection,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 batch_delay: float = DEFAULT_BATCH_DELAY,
+                 queue_size: int = DEFAULT_QUEUE_SIZE,
+                 retries: int = DEFAULT_RETRIES,
+                 retry_delay: float = DEFAULT_RETRY_DELAY):
+        """
+        :param collection: The collection the documents are inserted into (anything with insert_many).
+        :param batch_size: The amount of documents after which a batch is inserted.
+        :param batch_delay: The time, in seconds, after which a batch is inserted even if it isn't full.
+        :param queue_size: The amount of documents that may wait to be inserted before submit blocks.
+        :param retries: The amount of times a batch that failed because of the connection is tried again.
+        :param retry_delay: The time, in seconds, before the first retry of a batch.
+        """
+        self.collection = collection
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.documents: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.closed = False
+        # The submits that are queueing a document, close waits for them before it stops the writer.
+        self.submitting = 0
+        self.submit_cond = threading.Condition()
+        # Set by close, the writer stops once it's set and the queue is empty.
+        self.stopped = threading.Event()
+        self.stats_lock = threading.Lock()
+        # Counters, see get_stats
+        self.inserted = 0
+        self.failed = 0
+        self.batches = 0
+        self.writer = threading.Thread(target=self._write_batches, daemon=True)
+        self.writer.start()
+
+    def __repr__(self):
+        return f"<WriteBehindWriter of {self.collection.name} ({self.documents.qsize()} queued)>"
+
+    def submit(self, document: dict[str, Any]):
+        """
+        Queues a document to be inserted, blocking while the queue is full.
+        """
+        with self.submit_cond:
+            if self.closed:
+                raise RuntimeError(f"{self} is closed, not queueing any more documents")
+            self.submitting += 1
+        try:
+            self.documents.put(document)
+        finally:
+            with self.submit_cond:
+                self.submitting -= 1
+                self.submit_cond.notify_all()
+
+    def _take_batch(self) -> Optional[list[dict[str, Any]]]:
+        while True:
+            # Checked before waiting, so a document queued before close is still taken.
+            stopped = self.stopped.is_set()
+            try:
+                batch = [self.documents.get(timeout=STOP_CHECK_INTERVAL)]
+                break
+            except queue.Empty:
+                if stopped:
+                    return None
+        deadline = time.monotonic() + self.batch_delay
+        while len(batch) < self.batch_size:
+            # Once closing, the batch is written with what's queued rather than waiting for it to fill up.
+            remaining = 0 if self.stopped.is_set() else deadline - time.monotonic()
+            try:
+                batch.append(self.documents.get(timeout=max(min(remaining, STOP_CHECK_INTERVAL), 0)))
+            except queue.Empty:
+                if remaining <= 0:
+                    break
+        return batch
+
+    def _insert_batch(self, batch: list[dict[str, Any]]) -> int:
+        """
+        Inserts a batch, trying it again if it fails because of the connection.
+        :return: The amount of documents inserted.
+        """
+        retry_delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                # Unordered, so a document that fails (a duplicate, say) doesn't keep the ones after it out.
+                self.collection.insert_many(batch, ordered=False)
+                return len(batch)
+            except BulkWriteError as e:
+                write_errors = e.details.get("writeErrors", [])
+                inserted = e.details.get("nInserted", 0)
+                if attempt:
+                    # insert_many gives the documents their _id, so a retry finds the documents an attempt before it
+                    # inserted already there.
+                    inserted += sum(error.get("code") == DUPLICATE_KEY_ERROR for error in write_errors)
+                if inserted < len(batch):
+                    print(f"Failed inserting {len(batch) - inserted} document(s) into {self.collection.name}: "
+                          f"{write_errors[:1]}")
+                return inserted
+            except ConnectionFailure as e:
+                if attempt == self.retries:
+                    raise
+                print(f"Failed inserting {len(batch)} document(s) into {self.collection.name}, retrying in "
+                      f"{retry_delay} seconds: {e!r}")
+                time.sleep(retry_delay)
+                retry_delay *= 2
+
+    def _write_batches(self):
+        while (batch := self._take_batch()) is not None:
+            inserted = 0
+            try:
+                inserted = self._insert_batch(batch)
+            except Exception as e:
+                # A connection that's still failing after the retries, or anything else (a document that can't be
+                # encoded, say), fails the batch, but not the writer.
+                print(f"Failed inserting {len(batch)} document(s) into {self.collection.name}: {e!r}")
+            finally:
+                with self.stats_lock:
+                    self.inserted += inserted
+                    self.failed += len(batch) - inserted
+                    self.batches += 1
+                for _ in batch:
+                    self.documents.task_done()
+
+    def flush(self):
+        """
+        Waits until every document submitted so far was inserted (or failed to).
+        """
+        self.documents.join()
+
+    def close(self):
+        """
+        Inserts every document submitted so far, and stops the writer.
+        """
+        with self.submit_cond:
+            if self.closed:
+                return
+            self.closed = True
+            # A document that's being queued is inserted too, rather than left behind by the writer.
+            while self.submitting:
+                self.submit_cond.wait()
+        self.stopped.set()
+        self.writer.join()
+
+    def get_stats(self) -> dict[str, int]:
+        """
+        Returns a snapshot of the writer's counters.
+        """
+        with self.stats_lock:
+            return {"queued": self.documents.qsize(),
+                    "inserted": self.inserted,
+                    "failed": self.failed,
+                    "batches": self.batches}
@@ -1,14 +1,43 @@
+from typing import Optional, Iterator, Any
 from pathlib import Path
+import threading
 
 from game.card import Card
 from backend.data_management.driver_manager import DriverManager
+from backend.data_management.base_driver import DEFAULT_ITER_BATCH_SIZE
+from backend.data_management.creator_registry import CreatorRegistry
+from backend.data_management.card_cache import CardCache, DEFAULT_CARD_CACHE_SIZE, DEFAULT_CARD_CACHE_TTL
+from backend.data_management.drivers.filesystem_driver import FilesystemDriver, UnsolvedCardWriter
 
 CREATORS_FILE = Path('backend/data/creators.txt')
+# The drivers of the server's card directories, one per directory, so each is opened only once.
+_card_dir_drivers: dict[Path, FilesystemDriver] = {}
+_card_dir_drivers_lock = threading.Lock()
+_creator_registry: Optional[CreatorRegistry] = None
+_creator_registry_lock = threading.Lock()
 
 
 class Saver:
-    def __init__(self):
+    def __init__(self, card_cache_size: int = DEFAULT_CARD_CACHE_SIZE,
+                 card_cache_ttl: Optional[float] = DEFAULT_CARD_CACHE_TTL):
+        """
+        :param card_cache_size: The most bytes of cards find_cards keeps cached, see CardCache.
+        :param card_cache_ttl: The seconds find_cards keeps a result cached.
+        """
         self.driver = DriverManager("MONGO").get_default_driver()
+        self.card_cache = CardCache(card_cache_size, card_cache_ttl)
+
+    @staticmethod
+    def _get_creator_registry() -> CreatorRegistry:
+        """
+        Returns the registry of the creators, loaded from the creators file the first time it's needed.
+        """
+        global _creator_registry
+        with _creator_registry_lock:
+            if _creator_registry is None:
+                _creator_registry = CreatorRegistry(CREATORS_FILE)
+                _creator_registry.start_compactor()
+            return _creator_registry
 
     @staticmethod
     def update_creators_file(creator: str) -> bool:
@@ -17,15 +46,7 @@ class Saver:
         :param creator: The creator to be added to the creators file.
         :return: True if the creator was added, False if the creator already exists.
         """
-        creators = []
-        with open(CREATORS_FILE, mode='a') as creators_file:
-            for line in creators_file.readlines():
-                creators.append(line)
-            if creator not in creators:
-                creators_file.write(creator + '\n')
-                return True
-            else:
-                return False
+        return Saver._get_creator_registry().add(creator)
 
     @staticmethod
     def get_creators() -> list[str]:
@@ -33,10 +54,7 @@ class Saver:
         This function returns a list of all the creators in the creators file.
         :return: A list of all the creators in the creators file.
         """
-        with open(CREATORS_FILE, mode='r') as creators_file:
-            # readlines was being weird
-            creators = creators_file.read().split("\n")
-            return creators
+        return Saver._get_creator_registry().get_creators()
 
     @staticmethod
     def load_unsolved_card_from_path(path: Path) -> Card:
@@ -51,6 +69,62 @@ class Saver:
                   f"Raising error...\n")
             raise e
 
+    @staticmethod
+    def open_card_dir(card_dir: Path, **driver_options) -> FilesystemDriver:
+        """
+        This function opens the driver of one of the server's card directories, to be used for every card saved in it.
+        A directory that's open already keeps its driver (and options).
+        :param card_dir: The directory in which cards will be saved.
+        :param driver_options: Passed on to FilesystemDriver, use_journal for example.
+        :return: The directory's driver.
+        """
+        card_dir = Path(card_dir)
+        with _card_dir_drivers_lock:
+            driver = _card_dir_drivers.get(card_dir)
+            if driver is None:
+                driver = FilesystemDriver(solved_dir=card_dir, unsolved_dir=card_dir, **driver_options)
+                _card_dir_drivers[card_dir] = driver
+            return driver
+
+    @staticmethod
+    def close_card_dirs():
+        """
+        Closes the drivers of every card directory that was opened, releasing their packs and journals.
+        """
+        with _card_dir_drivers_lock:
+            while _card_dir_drivers:
+                _, driver = _card_dir_drivers.popitem()
+                driver.close()
+
+    @staticmethod
+    def _get_card_dir_driver(card_dir: Path) -> FilesystemDriver:
+        return Saver.open_card_dir(card_dir)
+
+    @staticmethod
+    def save_serialisation(card_serialisation: bytes, card_dir: Path) -> bool:
+        """
+        This function receives a card serialisation received by the server and saves it, unchanged, as an unsolved
+        card in the given directory.
+        :param card_serialisation: The serialisation of the card.
+        :param card_dir: The directory in which the card will be saved.
+        :return: True if the card was saved, False otherwise
+        """
+        driver = Saver._get_card_dir_driver(Path(card_dir))
+        return driver.save_unsolved_serialisation(card_serialisation)
+
+    @staticmethod
+    def open_serialisation_writer(name: str, creator: str, card_dir: Path) -> Optional[UnsolvedCardWriter]:
+        """
+        This function opens a writer for a card the server receives in pieces, to be saved as an unsolved card in the
+        given directory.
+        :param name: The name of the card.
+        :param creator: The creator of the card.
+        :param card_dir: The directory in which the card will be saved.
+        :return: A writer for the card's serialisation, or None if the card already exists.
+        """
+        driver = Saver._get_card_dir_driver(Path(card_dir))
+        return driver.open_unsolved_card_writer(name, creator)
+
     def save(self, card: Card, solved: bool) -> bool:
         """
         This function receives a card to save and whether it's solved or not.
@@ -62,14 +136,38 @@ class Saver:
         """
         self.update_creators_file(card.creator)
         if solved:
-            return self.driver.save_solved_card(card)
+            saved = self.driver.save_solved_card(card)
         else:
-            return self.driver.save_unsolved_card(card)
+            saved = self.driver.save_unsolved_card(card)
+        self.card_cache.invalidate(solved, card.creator, card.name)
+        return saved
 
     def find_cards(self, solved: bool, name: str = None, creator: str = None) -> list[Card]:
+        """
+        This function returns the cards with the given name and creator, through the card cache.
+        The returned cards may be shared with other callers, and mustn't be changed.
+        """
         if name is None and creator is None:
             print("You must specify either a name or a creator, or both, but not neither.")
             return []
+        key = (solved, creator, name)
+        cards = self.card_cache.get(key)
+        if cards is not None:
+            return cards
+        generation = self.card_cache.generation
+        cards = self._find_cards(solved, name, creator)
+        self.card_cache.put(key, cards, generation)
+        return cards
+
+    def find_card_fields(self, solved: bool, fields: list[str], name: str = None,
+                         creator: str = None) -> list[dict[str, Any]]:
+        """
+        This function returns only the given fields of the cards with the given name and creator, for listings that
+        don't need whole cards (see BaseDriver.find_card_fields). Nothing else is fetched, so it isn't cached.
+        """
+        return self.driver.find_card_fields(solved, fields, name, creator)
+
+    def _find_cards(self, solved: bool, name: str = None, creator: str = None) -> list[Card]:
         if solved:
             return self.driver.get_solved_cards(name, creator)
         if name is not None:
@@ -77,6 +175,19 @@ class Saver:
         else:
             return self.driver.get_unsolved_cards_by_creator(creator)
 
+    def iter_cards(self, solved: bool, name: str = None, creator: str = None,
+                   batch_size: int = DEFAULT_ITER_BATCH_SIZE,
+                   after: Optional[tuple[str, str]] = None,
+                   limit: Optional[int] = None) -> Iterator[Card]:
+        """
+        This function yields the cards with the given name and creator (either may be None to match any) a batch at a
+        time, ordered by name and then creator, see BaseDriver.iter_solved_cards.
+        """
+        if solved:
+            return self.driver.iter_solved_cards(name, creator, batch_size, after, limit)
+        return self.driver.iter_unsolved_cards(name, creator, batch_size, after, limit)
+
+
 if __name__ == '__main__':
     saver = Saver()
     name = "test"
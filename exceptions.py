@@ -9,3 +9,11 @@ class DriverNotFound(Exception):
 
 class CardNotFound(Exception):
     pass
+
+
+class ServerBusyException(Exception):
+    pass
+
+
+class StoreInUseException(Exception):
+    pass
@@ -1,10 +1,14 @@
 from __future__ import annotations
-from typing import Optional, Any
+from typing import Optional, Iterator
 from PIL import Image
 import struct
 import json
+import os
 
-from game.crypt_image import CryptImage
+from game.crypt_image import CryptImage, RAW_IMAGE_FORMAT
+from game.compression import NO_COMPRESSION, CODEC_IDS
+from game.card_format import CardView, FORMAT_V1, FORMAT_V2, CARD_MAGIC, V2_HEADER_FORMAT, V2_TABLE_FORMAT, \
+    V2_DATA_OFFSET, IMAGE_FORMAT_IDS, is_v2, unpack_v2_header
 
 
 class Card:
@@ -13,7 +17,10 @@ class Card:
     name: str
     creator: str
     image: CryptImage
-    image_path: str
+    # Only set for cards whose image is kept in a file, deserialised cards have none until they're saved solved.
+    image_path: Optional[str] = None
+    # The SHA-256 digest of the image file, for solved cards whose image is kept in a blob store (see BlobStore).
+    image_digest: Optional[str] = None
     riddle: str
     solution: Optional[str] = None
 
@@ -28,11 +35,11 @@ class Card:
         else:
             card_str += "\tSolution: unsolved\n"
 
-    def encrypt_card(self):
+    def encrypt_card(self, codec: str = NO_COMPRESSION, level: Optional[int] = None):
         """
-        Encrypts the card's image with the solution as the key.
+        Encrypts the card's image with the solution as the key, compressing it first if a codec is given.
         """
-        self.image.encrypt(self.solution)
+        self.image.encrypt(self.solution, codec, level)
 
     def decrypt_card(self, key: str) -> bool:
         """
@@ -51,13 +58,26 @@ class Card:
         self.image.set_image(image)
 
     @classmethod
-    def create_from_path(cls, name: str, creator: str, path: str, riddle: str, solution: Optional[str] = None, key_hash: Optional[str] = None) -> Card:
+    def create_from_path(cls, name: str, creator: str, path: str, riddle: str, solution: Optional[str] = None,
+                         key_hash: Optional[str] = None, encoded: bool = False,
+                         image_format: Optional[str] = None, lazy: bool = False) -> Card:
+        """
+        :param encoded: Whether to keep the image as the bytes of an image file rather than as raw pixels, see
+        CryptImage.create_encoded_from_path.
+        :param image_format: The format of an encoded image, by default the file is kept in its own format if possible.
+        :param lazy: Whether to only open the image once it's accessed, see CryptImage.create_lazy.
+        """
         card_obj = cls()
         card_obj.name = name
         card_obj.creator = creator
-        card_obj.image = CryptImage()
         card_obj.image_path = path
-        card_obj.image.set_image(Image.open(path))
+        if encoded:
+            card_obj.image = CryptImage.create_encoded_from_path(path, image_format)
+        elif lazy:
+            card_obj.image = CryptImage.create_lazy(path)
+        else:
+            card_obj.image = CryptImage()
+            card_obj.image.set_image(Image.open(path))
         if not ((key_hash is None) ^ (solution is None)):  # If one is None and the other isn't
             raise ValueError("Either key_hash or solution must be None, not both, nor neither")
 
@@ -69,7 +89,7 @@ class Card:
     def _generate_struct_format(self) -> str:
         name_format = f"i{len(self.name)}s"
         creator_format = f"i{len(self.creator)}s"
-        image_size = self.image.image.size
+        image_size = self.image.get_size()
         image_pixels = image_size[0] * image_size[1] * 3
         image_format = f"ii{image_pixels}s"
         hash_format = f"32s"
@@ -78,70 +98,147 @@ class Card:
         return struct_format
 
     def _generate_format_parameters(self) -> tuple:
-        image_size = self.image.image.size
+        image_size = self.image.get_size()
         return (len(self.name),
                 bytes(self.name, 'utf8'),
                 len(self.creator),
                 bytes(self.creator, 'utf8'),
                 image_size[0],
                 image_size[1],
-                self.image.image.tobytes(),
+                self.image.get_image_bytes(),
                 self.image.key_hash,
                 len(self.riddle),
                 bytes(self.riddle, 'utf8'),
                 )
 
-    def serialise(self) -> bytes:
+    def serialise(self, version: int = FORMAT_V2) -> bytes:
         """
         This returns the serialization of the card object.
+        :param version: The format of the serialization, v1 is only needed by peers that can't read v2, and can't
+        hold compressed or encoded images.
         """
+        if version == FORMAT_V2:
+            return self._serialise_v2_header() + self.image.get_image_bytes()
+        self._check_v1_compatible(version)
         struct_format = self._generate_struct_format()
         serialisation = struct.pack(struct_format, *self._generate_format_parameters())
         return serialisation
 
+    def _check_v1_compatible(self, version: int):
+        if version != FORMAT_V1:
+            raise ValueError(f"Unknown card format version {version}")
+        if self.image.codec != NO_COMPRESSION:
+            raise ValueError("Compressed images can't be serialised in the v1 format")
+        if self.image.image_format != RAW_IMAGE_FORMAT:
+            raise ValueError("Encoded images can't be serialised in the v1 format")
+
+    def _serialise_v2_header(self) -> bytes:
+        """
+        This returns the v2 serialization of the card object up to the image data, which is the last field.
+        """
+        fields = [self.name.encode('utf8'), self.creator.encode('utf8'), self.image.key_hash, self.riddle.encode('utf8')]
+        image = self.image
+        width, height = image.get_size()
+        image_data_size = image.get_data_size()
+        table = []
+        offset = V2_DATA_OFFSET
+        for field_size in [len(field) for field in fields] + [image_data_size]:
+            table += [offset, field_size]
+            offset += field_size
+        header = struct.pack(V2_HEADER_FORMAT, CARD_MAGIC, FORMAT_V2, CODEC_IDS[image.codec],
+                             IMAGE_FORMAT_IDS[image.image_format], 0, width, height)
+        return b"".join([header, struct.pack(V2_TABLE_FORMAT, *table)] + fields)
+
+    def serialise_header(self, version: int = FORMAT_V2) -> bytes:
+        """
+        This returns the serialization of the card object without the image data, so the image data can be sent
+        separately, in chunks (see iter_image_chunks). Putting the image data back at the offset given by
+        parse_header results in the full serialization.
+        """
+        if version == FORMAT_V2:
+            return self._serialise_v2_header()
+        self._check_v1_compatible(version)
+        name_bytes = self.name.encode('utf8')
+        creator_bytes = self.creator.encode('utf8')
+        riddle_bytes = self.riddle.encode('utf8')
+        image_size = self.image.get_size()
+        header_format = f"<i{len(name_bytes)}si{len(creator_bytes)}sii32si{len(riddle_bytes)}s"
+        return struct.pack(header_format,
+                           len(name_bytes), name_bytes,
+                           len(creator_bytes), creator_bytes,
+                           image_size[0], image_size[1],
+                           self.image.key_hash,
+                           len(riddle_bytes), riddle_bytes)
+
+    def iter_image_chunks(self, chunk_size: int) -> Iterator[bytes]:
+        """
+        This yields the card's image data in chunks of at most chunk_size bytes. An image that's only kept as a PIL
+        image is converted a band of rows at a time, so the whole image data is never held in memory at once.
+        :param chunk_size: The maximal size of a chunk.
+        """
+        data_buffer = self.image.get_data_buffer()
+        if data_buffer is not None:
+            with memoryview(data_buffer) as data_view:
+                for offset in range(0, len(data_view), chunk_size):
+                    yield bytes(data_view[offset:offset + chunk_size])
+            return
+        image = self.image.image
+        width, height = image.size
+        row_size = width * 3
+        rows_per_band = max(1, chunk_size // row_size)
+        for top in range(0, height, rows_per_band):
+            band = image.crop((0, top, width, min(top + rows_per_band, height))).tobytes()
+            with memoryview(band) as band_view:
+                for offset in range(0, len(band), chunk_size):
+                    yield bytes(band_view[offset:offset + chunk_size])
+
     @staticmethod
-    def extract_format(data: bytes, struct_format: str, field_size: int) -> tuple[Any, bytes]:
+    def parse_header(header: bytes) -> tuple[str, str, int, int]:
         """
-        This method takes in a serialization of a card object, and extracts the requested field from it, according to
-        the format and field size given. Also returns the data without the extracted field.
-        :param data: The serial of the card object.
-        :param struct_format: The format of the field. (According to the struct module)
-        :param field_size: The size of the field.
+        This method takes in a header created by serialise_header, and returns the card's name and creator, the offset
+        in the header at which the image data belongs, and the size of the image data.
+        :param header: The header of the card object.
         """
-        return struct.unpack(struct_format, data[:field_size])[0], data[field_size:]
+        if is_v2(header):
+            _, _, _, _, fields = unpack_v2_header(header)
+            image_offset, image_size = fields["image"]
+            if image_offset != len(header) or any(offset + length > len(header)
+                                                   for offset, length in list(fields.values())[:-1]):
+                raise ValueError("Malformed card header")
+            name_offset, name_length = fields["name"]
+            creator_offset, creator_length = fields["creator"]
+            return (bytes(header[name_offset:name_offset + name_length]).decode('utf8'),
+                    bytes(header[creator_offset:creator_offset + creator_length]).decode('utf8'),
+                    image_offset, image_size)
+        offset = 0
+        fields = []
+        for _ in range(2):  # name, then creator
+            field_length = struct.unpack_from("<i", header, offset)[0]
+            offset += 4
+            fields.append(bytes(header[offset:offset + field_length]).decode('utf8'))
+            offset += field_length
+        width, height = struct.unpack_from("<ii", header, offset)
+        image_offset = offset + 8
+        riddle_length = struct.unpack_from("<i", header, image_offset + 32)[0]
+        if len(header) != image_offset + 32 + 4 + riddle_length or min(width, height, riddle_length) < 0:
+            raise ValueError("Malformed card header")
+        name, creator = fields
+        return name, creator, image_offset, width * height * 3
 
     @classmethod
     def deserialize(cls, data: bytes) -> Card:
         """
-        This method takes in a serialization of a card object and returns a new card object.
+        This method takes in a serialization of a card object (of either format) and returns a new card object.
         :param data: The serial of the card object.
         :return: The new object.
         """
-        # This function is a bit gross, it can be made cleaner, but it really wouldn't be time effective to do that.
+        card_view = CardView(data)
         card_obj = cls()
-        # FIELDS:
-        # name
-        name_length, data = cls.extract_format(data, "<i", 4)
-        name_bytes, data = cls.extract_format(data, f"{name_length}s", name_length)
-        card_obj.name = name_bytes.decode('utf8')
-        # creator
-        creator_length, data = cls.extract_format(data, "<i", 4)
-        creator_bytes, data = cls.extract_format(data, f"{creator_length}s", creator_length)
-        card_obj.creator = creator_bytes.decode('utf8')
-        # image
-        height, data = cls.extract_format(data, "<i", 4)
-        width, data = cls.extract_format(data, "<i", 4)
-        image_data_size = width * height * 3
-        image_data, data = cls.extract_format(data, f"{image_data_size}s", image_data_size)
-        # key_hash
-        key_hash, data = cls.extract_format(data, f"32s", 32)
-        # creating the image object
-        card_obj.image = CryptImage((height, width), image_data, key_hash)
-        # riddle
-        riddle_length, data = cls.extract_format(data, f"<i", 4)
-        riddle_bytes, data = cls.extract_format(data, f"{riddle_length}s", riddle_length)
-        card_obj.riddle = riddle_bytes.decode('utf8')
-
+        card_obj.name = card_view.name
+        card_obj.creator = card_view.creator
+        card_obj.riddle = card_view.riddle
+        card_obj.image = CryptImage(card_view.image_size, card_view.get_field("image"), card_view.key_hash,
+                                    card_view.codec, card_view.image_format)
         return card_obj
 
     def get_attributes(self):
@@ -152,6 +249,7 @@ class Card:
             "riddle": self.riddle,
             "solution": self.solution,
             "path": self.image_path,
+            "image_digest": self.image_digest,
         }
 
     def generate_metadata_json(self) -> str:
@@ -188,17 +286,17 @@ class Card:
             new_card.riddle = metadata["riddle"]
             new_card.solution = metadata["solution"]
             new_card.image_path = metadata["path"]
+            new_card.image_digest = metadata.get("image_digest")
         except KeyError as e:
             print("metadata file was poorly generated, and a card couldn't be loaded \n"
                   f"Offending metadata: \n {metadata}")
             raise e
-        try:
-            image = Image.open(new_card.image_path)
-        except FileNotFoundError as e:
+        if not os.path.exists(new_card.image_path):
             print(f"Path found in metadata file doesn't exist. Here's the metadata \n"
                   f"f{metadata}")
-            raise e
-        new_card.set_image(image)
+            raise FileNotFoundError(f"No image at {new_card.image_path}")
+        # The image is only opened once it's needed, a card is usually only listed.
+        new_card.image = CryptImage.create_lazy(new_card.image_path)
         return new_card
 
     def get_image_bytes(self):
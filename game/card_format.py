@@ -0,0 +1,162 @@
+from __future__ import annotations
+from typing import BinaryIO
+import struct
+
+from game.compression import NO_COMPRESSION, CODEC_NAMES
+from game.crypt_image import RAW_IMAGE_FORMAT
+
+# Cards are serialised in one of two formats.
+# v1 is the plain sequence of the fields, each string prefixed by its length:
+#   name, creator, width, height, image data (width * height * 3 bytes), key_hash (32 bytes), riddle
+# v2 starts with a fixed header, followed by a table of the (offset, length) of each field in the serialisation,
+# followed by the fields themselves, the image last. Any field can be found without going over the ones before it,
+# and compressed or encoded images (whose size can't be derived from the image's dimensions) fit in it.
+FORMAT_V1 = 1
+FORMAT_V2 = 2
+CARD_MAGIC = b"CRDZ"
+# magic, format version, compression codec id, image format id, reserved, width, height
+V2_HEADER_FORMAT = "<4sBBBBii"
+V2_HEADER_SIZE = struct.calcsize(V2_HEADER_FORMAT)
+V2_FIELDS = ("name", "creator", "key_hash", "riddle", "image")
+V2_TABLE_FORMAT = "<" + "II" * len(V2_FIELDS)
+V2_DATA_OFFSET = V2_HEADER_SIZE + struct.calcsize(V2_TABLE_FORMAT)
+# The image format ids, the image format byte used to be reserved (always 0), so raw images must stay 0.
+IMAGE_FORMAT_IDS = {RAW_IMAGE_FORMAT: 0, "JPEG": 1, "PNG": 2}
+IMAGE_FORMAT_NAMES = {format_id: image_format for image_format, format_id in IMAGE_FORMAT_IDS.items()}
+
+
+def is_v2(data: bytes) -> bool:
+    return data[:len(CARD_MAGIC)] == CARD_MAGIC
+
+
+def unpack_v2_header(data: bytes) -> tuple[str, str, int, int, dict[str, tuple[int, int]]]:
+    """
+    This function takes in (at least the beginning of) a v2 serialization, and returns the compression codec, the
+    image format, the image's width and height, and the (offset, length) of every field.
+    """
+    magic, version, codec_id, image_format_id, _, width, height = struct.unpack_from(V2_HEADER_FORMAT, data)
+    if magic != CARD_MAGIC or version != FORMAT_V2:
+        raise ValueError(f"Not a v2 card serialization (magic {magic}, version {version})")
+    if codec_id not in CODEC_NAMES:
+        raise ValueError(f"Unknown compression codec id {codec_id}")
+    if image_format_id not in IMAGE_FORMAT_NAMES:
+        raise ValueError(f"Unknown image format id {image_format_id}")
+    table = struct.unpack_from(V2_TABLE_FORMAT, data, V2_HEADER_SIZE)
+    fields = {field: (table[2 * i], table[2 * i + 1]) for i, field in enumerate(V2_FIELDS)}
+    return CODEC_NAMES[codec_id], IMAGE_FORMAT_NAMES[image_format_id], width, height, fields
+
+
+def locate_v1_fields(data: bytes) -> tuple[int, int, dict[str, tuple[int, int]]]:
+    """
+    This function takes in a v1 serialization, and returns the image's width and height, and the (offset, length)
+    of every field. Only the length prefixes are read on the way.
+    """
+    fields = {}
+    offset = 0
+    for field in ("name", "creator"):
+        field_length = struct.unpack_from("<i", data, offset)[0]
+        fields[field] = (offset + 4, field_length)
+        offset += 4 + field_length
+    width, height = struct.unpack_from("<ii", data, offset)
+    offset += 8
+    fields["image"] = (offset, width * height * 3)
+    offset += width * height * 3
+    fields["key_hash"] = (offset, 32)
+    offset += 32
+    riddle_length = struct.unpack_from("<i", data, offset)[0]
+    fields["riddle"] = (offset + 4, riddle_length)
+    return width, height, fields
+
+
+def read_header_fields(card_file: BinaryIO) -> tuple[dict[str, bytes], tuple[int, int], str, str]:
+    """
+    This function reads every field but the image from a serialization file of either format, seeking over the image
+    data instead of reading it, so only a few small reads are made no matter how big the image is.
+    :param card_file: The serialization file, opened in binary mode and positioned at its beginning.
+    :return: The name, creator, key_hash and riddle fields, the image's width and height, the compression codec and
+    the image format.
+    """
+    def read_exactly(size: int) -> bytes:
+        if size < 0:
+            raise ValueError(f"The card serialization in {card_file.name} is malformed")
+        data = card_file.read(size)
+        if len(data) != size:
+            raise ValueError(f"The card serialization in {card_file.name} is truncated")
+        return data
+
+    fields = {}
+    start = read_exactly(len(CARD_MAGIC))
+    if is_v2(start):
+        codec, image_format, width, height, table = unpack_v2_header(start + read_exactly(V2_DATA_OFFSET - len(CARD_MAGIC)))
+        for field in ("name", "creator", "key_hash", "riddle"):
+            offset, length = table[field]
+            card_file.seek(offset)
+            fields[field] = read_exactly(length)
+        return fields, (width, height), codec, image_format
+    # v1, the start we've read is the name's length
+    fields["name"] = read_exactly(struct.unpack("<i", start)[0])
+    fields["creator"] = read_exactly(struct.unpack("<i", read_exactly(4))[0])
+    width, height = struct.unpack("<ii", read_exactly(8))
+    card_file.seek(width * height * 3, 1)
+    fields["key_hash"] = read_exactly(32)
+    fields["riddle"] = read_exactly(struct.unpack("<i", read_exactly(4))[0])
+    return fields, (width, height), NO_COMPRESSION, RAW_IMAGE_FORMAT
+
+
+class CardView:
+    """
+    Read-only access to the fields of a card serialization, of either format, without deserializing it.
+    Fields are returned as memoryviews into the serialization, so reading the name of a card never copies its image.
+    """
+    __slots__ = ("data", "version", "codec", "image_format", "width", "height", "fields")
+
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        if is_v2(self.data):
+            self.version = FORMAT_V2
+            self.codec, self.image_format, self.width, self.height, self.fields = unpack_v2_header(self.data)
+        else:
+            self.version = FORMAT_V1
+            self.codec = NO_COMPRESSION
+            self.image_format = RAW_IMAGE_FORMAT
+            self.width, self.height, self.fields = locate_v1_fields(self.data)
+        for field, (offset, length) in self.fields.items():
+            if offset < 0 or length < 0 or offset + length > len(self.data):
+                raise ValueError(f"The card's {field} field is out of the serialization's bounds")
+
+    def __repr__(self):
+        return f"<CardView v{self.version} {self.name} by {self.creator}>"
+
+    def get_field(self, field: str) -> memoryview:
+        offset, length = self.fields[field]
+        return self.data[offset:offset + length]
+
+    def _get_text(self, field: str) -> str:
+        return str(self.get_field(field), 'utf8')
+
+    @property
+    def name(self) -> str:
+        return self._get_text("name")
+
+    @property
+    def creator(self) -> str:
+        return self._get_text("creator")
+
+    @property
+    def riddle(self) -> str:
+        return self._get_text("riddle")
+
+    @property
+    def key_hash(self) -> bytes:
+        return bytes(self.get_field("key_hash"))
+
+    @property
+    def image_size(self) -> tuple[int, int]:
+        return self.width, self.height
+
+    def release(self):
+        """
+        Releases the view on the serialization, so the underlying buffer (a memory mapped file, for example) can be
+        closed. Fields taken from the view before must have been released already.
+        """
+        self.data.release()
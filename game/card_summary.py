@@ -0,0 +1,98 @@
+from __future__ import annotations
+from typing import Optional
+from pathlib import Path
+
+from game.card_format import read_header_fields, CardView
+from game.crypt_image import CryptImage, RAW_IMAGE_FORMAT
+from game.card import Card
+
+
+class CardSummary:
+    """
+    An unsolved card saved in a serialisation file, of which only the header (everything but the image) was read.
+    It can stand in for the card itself: the image is only read and decoded, once, when it's needed, either for
+    decrypting the card with a key that matches its key_hash, or for accessing the card's image.
+    """
+    __slots__ = ("path", "name", "creator", "riddle", "key_hash", "image_size", "codec", "image_format", "_card",
+                 "_serialisation")
+
+    def __init__(self, path: Path, name: str, creator: str, riddle: str, key_hash: bytes,
+                 image_size: tuple[int, int], codec: str, image_format: str = RAW_IMAGE_FORMAT):
+        self.path = path
+        self.name = name
+        self.creator = creator
+        self.riddle = riddle
+        self.key_hash = key_hash
+        self.image_size = image_size
+        self.codec = codec
+        self.image_format = image_format
+        self._card: Optional[Card] = None
+        self._serialisation: Optional[bytes] = None
+
+    def __repr__(self):
+        return f"<CardSummary {self.name} by {self.creator}>"
+
+    @classmethod
+    def from_path(cls, path: Path) -> CardSummary:
+        """
+        Reads the summary of the card saved at the given path, without reading its image.
+        :param path: The path of the card's serialisation file.
+        """
+        with open(path, mode="rb") as card_file:
+            fields, image_size, codec, image_format = read_header_fields(card_file)
+        return cls(path,
+                   fields["name"].decode('utf8'),
+                   fields["creator"].decode('utf8'),
+                   fields["riddle"].decode('utf8'),
+                   fields["key_hash"],
+                   image_size,
+                   codec,
+                   image_format)
+
+    @classmethod
+    def from_serialisation(cls, path: Path, serialisation: bytes) -> CardSummary:
+        """
+        Makes the summary of a card from its serialisation (a view into a pack file, for example) instead of reading
+        its file. The serialisation is kept, and only deserialised once the card is needed.
+        :param path: The path the card is known by.
+        """
+        card_view = CardView(serialisation)
+        summary = cls(path, card_view.name, card_view.creator, card_view.riddle, card_view.key_hash,
+                      card_view.image_size, card_view.codec, card_view.image_format)
+        summary._serialisation = serialisation
+        return summary
+
+    def load_card(self) -> Card:
+        """
+        Returns the full card, reading it from its file the first time it's needed.
+        """
+        if self._card is None:
+            if self._serialisation is not None:
+                self._card = Card.deserialize(self._serialisation)
+            else:
+                with open(self.path, mode="rb") as card_file:
+                    self._card = Card.deserialize(card_file.read())
+        return self._card
+
+    @property
+    def image(self) -> CryptImage:
+        return self.load_card().image
+
+    @property
+    def solution(self) -> Optional[str]:
+        return self._card.solution if self._card is not None else None
+
+    def check_key(self, key: str) -> bool:
+        """
+        Returns whether the key is the card's solution, using only the key_hash, so the image is never read.
+        """
+        return CryptImage._generate_hash_key(key.encode('utf8')) == self.key_hash
+
+    def decrypt_card(self, key: str) -> bool:
+        """
+        Attempts to decrypt the card's image with the given key, like Card.decrypt_card. The image is only read if
+        the key is right, and a card that was decrypted already is left as it is.
+        """
+        if not self.check_key(key):
+            return False
+        return self.load_card().decrypt_card(key)
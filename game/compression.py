@@ -0,0 +1,39 @@
+from typing import Optional
+import zlib
+import lzma
+
+NO_COMPRESSION = "none"
+# The ids are written into serialised cards, so they must never change.
+CODEC_IDS = {NO_COMPRESSION: 0, "zlib": 1, "lzma": 2}
+CODEC_NAMES = {codec_id: codec for codec, codec_id in CODEC_IDS.items()}
+# The codecs we can compress with, in order of preference.
+SUPPORTED_CODECS = ["zlib", "lzma"]
+
+
+def compress(codec: str, data: bytes, level: Optional[int] = None) -> bytes:
+    """
+    Compresses the data with the given codec.
+    :param codec: The codec's name, one of CODEC_IDS.
+    :param data: The data to be compressed.
+    :param level: The codec's compression level (zlib: 0-9, lzma: 0-9), or None for the codec's default.
+    """
+    if codec == NO_COMPRESSION:
+        return data
+    if codec == "zlib":
+        return zlib.compress(data, -1 if level is None else level)
+    if codec == "lzma":
+        return lzma.compress(data, preset=level)
+    raise ValueError(f"Unknown compression codec '{codec}'")
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    """
+    Decompresses data that was compressed with the given codec.
+    """
+    if codec == NO_COMPRESSION:
+        return data
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "lzma":
+        return lzma.decompress(data)
+    raise ValueError(f"Unknown compression codec '{codec}'")
@@ -1,26 +1,127 @@
 from __future__ import annotations
 from Crypto.Cipher import AES
-from typing import Optional
+from typing import Optional, Callable
+from pathlib import Path
 from PIL import Image
 import hashlib
+import io
+
+from game.compression import NO_COMPRESSION, compress, decompress
+from game.image_cache import DECODED_IMAGES
+
+# Images are either kept as raw RGB pixels, or encoded, as the bytes of an image file in one of ENCODED_IMAGE_FORMATS
+# (named as PIL names them).
+RAW_IMAGE_FORMAT = "RAW"
+ENCODED_IMAGE_FORMATS = ["JPEG", "PNG"]
+DEFAULT_ENCODED_IMAGE_FORMAT = "PNG"
+# Buffers are encrypted and decrypted in place, a chunk of this size at a time.
+CRYPT_CHUNK_SIZE = 2 ** 16
 
 
 class CryptImage:
-    image: Image.Image = None
+    """
+    An image that can be encrypted. Raw images are kept as a buffer of RGB pixels, which is encrypted and decrypted in
+    place, and a PIL image is only made from it when the image is accessed. Images set from a PIL image are moved
+    into a buffer the first time they're encrypted.
+    """
     key_hash: Optional[bytes]
+    # The raw RGB pixels of the image, when they aren't kept in a PIL image.
+    pixel_data: Optional[bytearray] = None
+    # A compressed or encoded image can't be kept as pixels while it's encrypted, so its encrypted data is kept as is.
+    encrypted_data: Optional[bytearray] = None
+    # The image file of a decrypted encoded image, only decoded once the image is needed.
+    encoded_data: Optional[bytes] = None
+    image_format: str = RAW_IMAGE_FORMAT
+    codec: str = NO_COMPRESSION
+    # Whether the image is encrypted, so an image that was decrypted already isn't decrypted (scrambled) again.
+    encrypted: bool = False
+    image_size: Optional[tuple[int, int]] = None
+    # Loads the image of a lazy image (see create_lazy) when it's first accessed.
+    image_loader: Optional[Callable[[], Image.Image]] = None
 
     def __init__(self,
                  image_size: Optional[tuple[int, int]] = None,
                  image_data: Optional[bytes] = None,
-                 key_hash: Optional[bytes] = None
+                 key_hash: Optional[bytes] = None,
+                 codec: str = NO_COMPRESSION,
+                 image_format: str = RAW_IMAGE_FORMAT
                  ):
+        self.codec = codec
+        self.image_format = image_format
+        self.image_size = image_size
+        self.encrypted_data = None
+        self.encoded_data = None
+        self.image = None
         if image_data is None:
-            self.image = None
+            pass
+        elif codec != NO_COMPRESSION or image_format != RAW_IMAGE_FORMAT:
+            self.encrypted_data = bytearray(image_data)
         else:
-            height, width = image_size
-            self.image = Image.new('RGB', (height, width))
-            self.image.frombytes(image_data)
+            width, height = image_size
+            if len(image_data) != width * height * 3:
+                raise ValueError(f"Expected {width * height * 3} bytes of pixels, got {len(image_data)}")
+            self.pixel_data = bytearray(image_data)
         self.key_hash = key_hash
+        # An image made from a serialisation's data and key_hash is an encrypted one.
+        self.encrypted = image_data is not None and key_hash is not None
+
+    @property
+    def image(self) -> Optional[Image.Image]:
+        """
+        The image as a PIL image, made from the pixel buffer or decoded from the image file when it's first accessed.
+        """
+        if self._image is None:
+            if self.pixel_data is not None:
+                self._image = Image.frombytes('RGB', self.image_size, self.pixel_data)
+            elif self.encoded_data is not None:
+                self._image = Image.open(io.BytesIO(self.encoded_data))
+            elif self.image_loader is not None:
+                self._image = self.image_loader()
+        return self._image
+
+    @image.setter
+    def image(self, image: Optional[Image.Image]):
+        self._image = image
+        self.pixel_data = None
+        self.image_loader = None
+
+    def get_size(self) -> tuple[int, int]:
+        if self._image is None and self.image_size is None and self.image_loader is not None:
+            # A lazy image's size is only known once it's loaded.
+            return self.image.size
+        if self._image is not None:
+            return self._image.size
+        return self.image_size
+
+    def _get_rgb_image(self) -> Image.Image:
+        """
+        Returns the image as an RGB PIL image, which is what the pixel buffer holds, converting images of other modes
+        (L, P, RGBA...) first.
+        """
+        image = self.image
+        return image if image.mode == 'RGB' else image.convert('RGB')
+
+    def _get_pixel_buffer(self) -> bytearray:
+        """
+        Returns the buffer of the image's pixels, moving the pixels out of the PIL image if they're still kept there.
+        """
+        if self.pixel_data is None:
+            image = self._get_rgb_image()
+            self.image_size = image.size
+            self.pixel_data = bytearray(image.tobytes())
+        # The PIL image would go stale once the buffer is changed, it's made again if needed.
+        self._image = None
+        return self.pixel_data
+
+    @staticmethod
+    def _crypt_in_place(crypt: Callable, buffer: bytearray):
+        """
+        Encrypts or decrypts the buffer in place, with the given cipher method, a chunk at a time.
+        """
+        with memoryview(buffer) as buffer_view:
+            for offset in range(0, len(buffer_view), CRYPT_CHUNK_SIZE):
+                chunk = buffer_view[offset:offset + CRYPT_CHUNK_SIZE]
+                crypt(chunk, output=chunk)
 
     def set_image(self, image: Image.Image):
         self.image = image
@@ -37,37 +138,161 @@ class CryptImage:
         crypt_image_obj.key_hash = None
         return crypt_image_obj
 
+    @classmethod
+    def create_lazy(cls, path: str) -> CryptImage:
+        """
+        Creates an image that's only opened and decoded once it's accessed, through the cache of decoded images shared
+        by every lazy image (see DecodedImageCache). For cards that are mostly listed rather than looked at.
+        """
+        crypt_image_obj = cls()
+        crypt_image_obj.image_loader = lambda: DECODED_IMAGES.get_image(path)
+        crypt_image_obj.key_hash = None
+        return crypt_image_obj
+
+    @classmethod
+    def create_encoded_from_path(cls, path: str, image_format: Optional[str] = None) -> CryptImage:
+        """
+        Creates an image that's kept as the bytes of an image file instead of as raw pixels, which is usually a lot
+        smaller.
+        :param path: The path of the image file.
+        :param image_format: The format to keep the image in. By default, the file is kept as it is if it's in one of
+        ENCODED_IMAGE_FORMATS, and re-encoded as DEFAULT_ENCODED_IMAGE_FORMAT otherwise.
+        """
+        with open(path, mode="rb") as image_file:
+            image_data = image_file.read()
+        # Opening the image only reads the file's header, the pixels are decoded only if we have to re-encode it.
+        image = Image.open(io.BytesIO(image_data))
+        if image_format is None:
+            image_format = image.format if image.format in ENCODED_IMAGE_FORMATS else DEFAULT_ENCODED_IMAGE_FORMAT
+        if image_format not in ENCODED_IMAGE_FORMATS:
+            raise ValueError(f"Images can't be kept encoded as {image_format}, only as one of {ENCODED_IMAGE_FORMATS}")
+        if image.format != image_format:
+            encoded_image = io.BytesIO()
+            image.convert('RGB').save(encoded_image, format=image_format)
+            image_data = encoded_image.getvalue()
+        crypt_image_obj = cls(image_size=image.size, image_format=image_format)
+        crypt_image_obj.encoded_data = image_data
+        return crypt_image_obj
+
     @staticmethod
     def _generate_hash_key(key: bytes) -> bytes:
         return hashlib.sha256(hashlib.sha256(key).digest()).digest()
 
-    def encrypt(self, key: str):
+    def encrypt(self, key: str, codec: str = NO_COMPRESSION, level: Optional[int] = None):
         """
         The function encrypts the image using AES in EAX mode, with the given key. Updates the key_hash property too.
+        Encrypted data doesn't compress, so if a codec is given the image is compressed before it's encrypted.
         :param key: The key with which the image will be encrypted
+        :param codec: The compression codec to use, see game.compression
+        :param level: The compression level, None for the codec's default
         :return:
         """
         key_bytes = key.encode('utf8')
         self.key_hash = self._generate_hash_key(key_bytes)
-        image_data = self.image.tobytes()
         cipher = AES.new(key_bytes, AES.MODE_EAX, nonce=b'arazim')
-        encrypted_image_data = cipher.encrypt(image_data)
-        self.image.frombytes(encrypted_image_data)
+        if self.image_format != RAW_IMAGE_FORMAT:
+            # The image file itself is encrypted, there's no need to decode it.
+            self.encrypted_data = bytearray(compress(codec, self.encoded_data, level))
+            self._crypt_in_place(cipher.encrypt, self.encrypted_data)
+            self.encoded_data = None
+            self.image = None
+        elif codec == NO_COMPRESSION:
+            self._crypt_in_place(cipher.encrypt, self._get_pixel_buffer())
+        else:
+            self.encrypted_data = bytearray(compress(codec, self._get_pixel_buffer(), level))
+            self._crypt_in_place(cipher.encrypt, self.encrypted_data)
+            self.image = None
+        self.codec = codec
+        self.encrypted = True
 
     def decrypt(self, key: str) -> bool:
         """
         :param key:
-        :return: True if decryption succeeded, False otherwise
+        :return: True if decryption succeeded (or the image was decrypted already, with the same key), False otherwise
         """
         # Testing the key's correctness, if it's wrong, we won't bother trying to decrypt the image.
         key_bytes = key.encode('utf8')
         if self._generate_hash_key(key_bytes) != self.key_hash:
             return False
-        ciphertext = self.image.tobytes()
+        if not self.encrypted:
+            return True
         cipher = AES.new(bytes(key, 'utf8'), AES.MODE_EAX, nonce=b'arazim')
-        image_data = cipher.decrypt(ciphertext)
-        self.image.frombytes(image_data)
+        self.encrypted = False
+        if self.encrypted_data is None:
+            self._crypt_in_place(cipher.decrypt, self._get_pixel_buffer())
+            return True
+        self._crypt_in_place(cipher.decrypt, self.encrypted_data)
+        image_data = decompress(self.codec, self.encrypted_data)
+        self.encrypted_data = None
+        if self.image_format == RAW_IMAGE_FORMAT:
+            self.image = None
+            self.pixel_data = image_data if isinstance(image_data, bytearray) else bytearray(image_data)
+        else:
+            # Decoded only once the image is accessed.
+            self.encoded_data = image_data
+        self.codec = NO_COMPRESSION
         return True
 
+    def get_file_bytes(self) -> bytes:
+        """
+        Returns the decrypted image as the bytes of an image file. Encoded images are returned as they are, raw images
+        are encoded as PNG.
+        """
+        if self.encrypted_data is not None:
+            raise ValueError("The image must be decrypted before it's saved")
+        if self.image_format != RAW_IMAGE_FORMAT:
+            return self.encoded_data
+        image_file = io.BytesIO()
+        self.image.save(image_file, format="PNG")
+        return image_file.getvalue()
+
+    def save(self, path: Path) -> Path:
+        """
+        Saves the decrypted image as an image file, with the suffix of its format. Encoded images are saved as they
+        are, raw images as PNG.
+        :param path: The path of the image file, without a suffix.
+        :return: The path of the saved image file.
+        """
+        image_format = "PNG" if self.image_format == RAW_IMAGE_FORMAT else self.image_format
+        image_path = path.with_suffix("." + image_format.lower())
+        image_path.write_bytes(self.get_file_bytes())
+        return image_path
+
+    def get_data_buffer(self) -> Optional[bytearray]:
+        """
+        Returns the buffer holding the image's data as it's serialised (encrypted and compressed data, the image file
+        of an encoded image, or raw pixels), or None if the image is only kept as a PIL image.
+        """
+        if self.encrypted_data is not None:
+            return self.encrypted_data
+        if self.image_format != RAW_IMAGE_FORMAT:
+            return self.encoded_data
+        return self.pixel_data
+
+    def get_data_size(self) -> int:
+        """
+        Returns the size of the image's data, as it's serialised.
+        """
+        data_buffer = self.get_data_buffer()
+        if data_buffer is not None:
+            return len(data_buffer)
+        width, height = self.get_size()
+        return width * height * 3
+
+    def get_memory_size(self) -> int:
+        """
+        Returns the amount of bytes the image takes up in memory, roughly: its buffers, and its decoded PIL image if
+        it was made.
+        """
+        size = sum(len(buffer) for buffer in (self.pixel_data, self.encrypted_data, self.encoded_data)
+                   if buffer is not None)
+        if self._image is not None:
+            width, height = self._image.size
+            size += width * height * len(self._image.getbands())
+        return size
+
     def get_image_bytes(self) -> bytes:
-        return self.image.tobytes()
\ No newline at end of file
+        data_buffer = self.get_data_buffer()
+        if data_buffer is not None:
+            return data_buffer
+        return self._get_rgb_image().tobytes()
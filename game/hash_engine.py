@@ -0,0 +1,120 @@
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Iterable, Iterator, Optional, Callable
+import itertools
+import time
+import os
+
+from game.crypt_image import CryptImage
+
+DEFAULT_CHUNK_SIZE = 10000
+
+# The key hashes the worker processes match against, sent once to each process rather than with every chunk.
+_worker_key_hashes: frozenset[bytes] = frozenset()
+
+
+def _init_worker(key_hashes: frozenset[bytes]):
+    global _worker_key_hashes
+    _worker_key_hashes = key_hashes
+
+
+def _hash_chunk(answers: list[str]) -> tuple[int, list[tuple[str, bytes]]]:
+    """
+    Hashes a chunk of candidate answers, returns the amount hashed and the (answer, key_hash) of those that match.
+    """
+    matches = []
+    for answer in answers:
+        key_hash = CryptImage._generate_hash_key(answer.encode('utf8'))
+        if key_hash in _worker_key_hashes:
+            matches.append((answer, key_hash))
+    return len(answers), matches
+
+
+class HashEngine:
+    """
+    Hashes candidate answers over a pool of processes, matching them against a set of key hashes. The answers are
+    taken from their iterable a chunk at a time, and only a few chunks per process are in flight at once, so an answers
+    file is streamed rather than loaded whole.
+    """
+
+    def __init__(self,
+                 key_hashes: Iterable[bytes],
+                 processes: Optional[int] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 progress: Optional[Callable[[dict[str, float]], None]] = None):
+        """
+        :param key_hashes: The key hashes to match the answers against.
+        :param processes: The amount of worker processes, by default one per core. With a single process the answers
+        are hashed in the calling process.
+        :param chunk_size: The amount of answers sent to a process at once.
+        :param progress: Called with the engine's stats (see get_stats) whenever a chunk is done.
+        """
+        self.key_hashes = frozenset(key_hashes)
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.progress = progress
+        # Counters, see get_stats
+        self.hashed = 0
+        self.matched = 0
+        self.chunks = 0
+        self.start_time: Optional[float] = None
+
+    def __repr__(self):
+        return f"HashEngine(key_hashes={len(self.key_hashes)}, processes={self.processes}, " \
+               f"chunk_size={self.chunk_size})"
+
+    def _iter_chunks(self, answers: Iterable[str]) -> Iterator[list[str]]:
+        answers = iter(answers)
+        while chunk := list(itertools.islice(answers, self.chunk_size)):
+            yield chunk
+
+    def _chunk_done(self, hashed: int, matches: list[tuple[str, bytes]]):
+        self.hashed += hashed
+        self.matched += len(matches)
+        self.chunks += 1
+        if self.progress is not None:
+            self.progress(self.get_stats())
+
+    def find_matches(self, answers: Iterable[str]) -> Iterator[tuple[str, bytes]]:
+        """
+        Yields the (answer, key_hash) of every answer whose hash is one of the key hashes, as soon as its chunk is done.
+        Matches come in the order their chunks finish, which isn't necessarily the order of the answers.
+        """
+        self.start_time = time.monotonic()
+        if not self.key_hashes:
+            return
+        if self.processes == 1:
+            _init_worker(self.key_hashes)
+            for chunk in self._iter_chunks(answers):
+                hashed, matches = _hash_chunk(chunk)
+                self._chunk_done(hashed, matches)
+                yield from matches
+            return
+        executor = ProcessPoolExecutor(self.processes, initializer=_init_worker, initargs=(self.key_hashes,))
+        try:
+            chunks = self._iter_chunks(answers)
+            in_flight: set[Future] = set()
+            # Two chunks per process keep every process busy while the next chunks are read.
+            for chunk in itertools.islice(chunks, 2 * self.processes):
+                in_flight.add(executor.submit(_hash_chunk, chunk))
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    hashed, matches = future.result()
+                    self._chunk_done(hashed, matches)
+                    for chunk in itertools.islice(chunks, 1):
+                        in_flight.add(executor.submit(_hash_chunk, chunk))
+                    yield from matches
+        finally:
+            # The caller may stop early (every card is solved), the chunks that are left aren't needed.
+            executor.shutdown(cancel_futures=True)
+
+    def get_stats(self) -> dict[str, float]:
+        """
+        Returns a snapshot of the engine's progress and throughput.
+        """
+        elapsed = time.monotonic() - self.start_time if self.start_time is not None else 0
+        return {"hashed": self.hashed,
+                "matched": self.matched,
+                "chunks": self.chunks,
+                "elapsed": elapsed,
+                "hashes_per_second": self.hashed / elapsed if elapsed else 0}
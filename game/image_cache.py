@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from typing import Hashable
+from PIL import Image
+import threading
+import os
+
+DEFAULT_MAX_IMAGES = 64
+DEFAULT_MAX_SIZE = 32 * 2 ** 20
+
+
+def get_image_size(image: Image.Image) -> int:
+    """
+    Returns the amount of bytes a decoded image takes up in memory, like CryptImage.get_memory_size.
+    """
+    width, height = image.size
+    return width * height * len(image.getbands())
+
+
+class DecodedImageCache:
+    """
+    A least recently used cache of decoded image files, shared by every card whose image is loaded lazily (see
+    CryptImage.create_lazy), so a card that's read again and again is only decoded once.
+    Images are cached by their file's path, size and mtime, so a file that changed is decoded again. The cached images
+    are shared, and must not be changed.
+    The cache is bounded by the bytes its decoded images take up, and by their count.
+    """
+
+    def __init__(self, max_images: int = DEFAULT_MAX_IMAGES, max_size: int = DEFAULT_MAX_SIZE):
+        """
+        :param max_images: The most images kept.
+        :param max_size: The most bytes the decoded images may take up, an image bigger than that isn't cached.
+        """
+        self.max_images = max_images
+        self.max_size = max_size
+        # The decoded images, with the bytes each takes up.
+        self.images: OrderedDict[Hashable, tuple[Image.Image, int]] = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        return f"<DecodedImageCache ({len(self.images)}/{self.max_images} images, {self.size}/{self.max_size} bytes)>"
+
+    def get_image(self, path: str) -> Image.Image:
+        """
+        Returns the decoded image at the given path, decoding it if it isn't cached.
+        """
+        path_stat = os.stat(path)
+        key = (str(path), path_stat.st_size, path_stat.st_mtime_ns)
+        with self.lock:
+            entry = self.images.get(key)
+            if entry is not None:
+                self.images.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        # Decoded outside the lock, so one large image doesn't hold up every other card.
+        image = Image.open(path)
+        image.load()
+        image_size = get_image_size(image)
+        if image_size > self.max_size:
+            return image
+        with self.lock:
+            old_entry = self.images.pop(key, None)
+            if old_entry is not None:
+                self.size -= old_entry[1]
+            self.images[key] = (image, image_size)
+            self.size += image_size
+            while len(self.images) > self.max_images or self.size > self.max_size:
+                _, (_, old_size) = self.images.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+        return image
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.size = 0
+
+    def get_stats(self) -> dict[str, int]:
+        with self.lock:
+            return {"images": len(self.images),
+                    "size": self.size,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions}
+
+
+DECODED_IMAGES = DecodedImageCache()
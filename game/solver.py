@@ -22,26 +22,201 @@ but you might have to add some (like the directory of your cards or something).
 But you already know how to do that, so...
 Good Luck!
 '''
-from typing import Optional
+from typing import Optional, Iterator, Iterable, Callable
+from collections import defaultdict
+from contextlib import closing
 from pathlib import Path
 import npyscreen
+import threading
 import argparse
-import os
+import time
 
 
+from game.card_summary import CardSummary
+from game.hash_engine import HashEngine
 from game.card import Card
-from backend.data_management.saver import Saver
+from backend.data_management.drivers.filesystem_driver import FilesystemDriver
 
 CARD_STR = 'Card {card.name} by {card.creator}'
 
 
+def open_driver(unsolved_dir: Path, solved_dir: Path) -> FilesystemDriver:
+    """
+    Opens the driver of the cards directories, one for the whole batch solve or cli session. Its index of the unsolved
+    cards is the one the server saves cards to, and it's brought up to date with the directory when the cards are
+    first listed (and whenever the cli lists them again, see CardLoader). Opening it doesn't read the unsolved cards.
+    """
+    return FilesystemDriver(solved_dir=Path(solved_dir), unsolved_dir=Path(unsolved_dir))
+
+
+def load_unsolved_cards(driver: FilesystemDriver) -> list[CardSummary]:
+    """
+    Returns the unsolved cards. Only the headers of the cards that changed since they were last listed are read, a
+    card's image is only read once it's solved.
+    """
+    return driver.get_unsolved_card_by_name()
+
+
+def save_solved_card(card: Card, driver: FilesystemDriver) -> bool:
+    """
+    Saves a card that was decrypted as a solved card (its image is saved in the solved directory too), and removes it
+    from the unsolved cards, whether it's a file of its own or in a pack.
+    :return: True if the card was saved, False if it wasn't (and is still unsolved).
+    """
+    if not driver.save_solved_card(card):
+        return False
+    driver.remove_unsolved_card(card.name, card.creator)
+    return True
+
+
+def build_key_hash_index(cards: Iterable[CardSummary]) -> dict[bytes, list[CardSummary]]:
+    """
+    Returns the cards by their key_hash. Cards with the same solution share a key_hash, hence the lists.
+    """
+    cards_by_key_hash = defaultdict(list)
+    for card in cards:
+        cards_by_key_hash[card.key_hash].append(card)
+    return cards_by_key_hash
+
+
+def read_answers(answers_path: Path) -> Iterator[str]:
+    """
+    Yields the candidate answers in the file, one per line, skipping empty lines. The file is read as it's consumed,
+    never whole.
+    """
+    with open(answers_path, mode="r", encoding="utf8") as answers_file:
+        for line in answers_file:
+            answer = line.rstrip("\r\n")
+            if answer:
+                yield answer
+
+
+def batch_solve(unsolved_dir: Path,
+                solved_dir: Path,
+                answers: Iterable[str],
+                processes: Optional[int] = 1,
+                progress: Optional[Callable[[dict[str, float]], None]] = None) -> list[CardSummary]:
+    """
+    Solves every unsolved card whose solution is one of the answers, without the interactive cli.
+    Each answer is hashed once (over a pool of processes, see HashEngine) and looked up by its key_hash, instead of
+    being tried against every card, so only the cards that match are ever decrypted (or have their image read).
+    :param processes: The amount of processes hashing the answers, None for one per core.
+    :param progress: Called with the hashing stats as the answers are hashed, see HashEngine.get_stats.
+    :return: The cards that were solved.
+    """
+    with closing(open_driver(unsolved_dir, solved_dir)) as driver:
+        cards_by_key_hash = build_key_hash_index(load_unsolved_cards(driver))
+        engine = HashEngine(cards_by_key_hash.keys(), processes, progress=progress)
+        solved_cards = []
+        with closing(engine.find_matches(answers)) as matches:
+            for answer, key_hash in matches:
+                for card in cards_by_key_hash.pop(key_hash, []):
+                    if not card.decrypt_card(answer):
+                        continue
+                    if not save_solved_card(card.load_card(), driver):
+                        print(f"{CARD_STR.format(card=card)} was solved, but couldn't be saved as a solved card.")
+                        continue
+                    solved_cards.append(card)
+                    print(f'{CARD_STR.format(card=card)} was solved correctly!')
+                    print(f'The solution was: {answer}')
+                if not cards_by_key_hash:
+                    break
+    return solved_cards
+
+
+class ProgressPrinter:
+    """
+    Prints the hashing progress of a batch solve, at most once per interval.
+    """
+
+    def __init__(self, interval: float = 1):
+        self.interval = interval
+        self.last_print = 0.0
+
+    def __call__(self, stats: dict[str, float]):
+        now = time.monotonic()
+        if now - self.last_print < self.interval:
+            return
+        self.last_print = now
+        print(f"Hashed {stats['hashed']} answer(s) ({stats['hashes_per_second']:.0f} hashes/sec), "
+              f"{stats['matched']} match(es) so far")
+
+
+class CardLoader:
+    """
+    Loads the unsolved cards in the background, so the cli can show the cards as they're read instead of waiting for
+    all of them. The cards are listed again whenever the cards are shown (see start), so cards received meanwhile show
+    up, and solved cards are dropped as they're solved.
+    """
+
+    def __init__(self, driver: FilesystemDriver):
+        self.driver = driver
+        self.cards: list[CardSummary] = []
+        self.lock = threading.Lock()
+        self.done = False
+        # Bumped whenever the cards change, so the cli knows to show them again.
+        self.version = 0
+        # Bumped by every listing, so a listing that was started over stops adding cards.
+        self.listing = 0
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """
+        Lists the cards from scratch. A listing that's still running stops once it reads its next card.
+        """
+        with self.lock:
+            self.listing += 1
+            self.cards = []
+            self.done = False
+            self.version += 1
+            listing = self.listing
+        self.thread = threading.Thread(target=self._load, args=[listing], daemon=True)
+        self.thread.start()
+
+    def _load(self, listing: int):
+        try:
+            # The cards are listed as they're indexed, so the first ones are shown before the rest are read, and cards
+            # received since the last listing are picked up.
+            for card in self.driver.iter_refreshed_unsolved_cards():
+                if not self._add_card(card, listing):
+                    return
+        finally:
+            with self.lock:
+                if listing == self.listing:
+                    self.done = True
+
+    def _add_card(self, card: CardSummary, listing: int) -> bool:
+        with self.lock:
+            if listing != self.listing:
+                return False
+            self.cards.append(card)
+            self.version += 1
+            return True
+
+    def remove_card(self, card: CardSummary):
+        """
+        Drops a card that was solved.
+        """
+        with self.lock:
+            if card in self.cards:
+                self.cards.remove(card)
+                self.version += 1
+
+    def get_cards(self) -> list[CardSummary]:
+        """
+        Returns the cards loaded so far, as a list of the caller's own.
+        """
+        with self.lock:
+            return list(self.cards)
+
+
 class ChooseCardsForm(npyscreen.ActionForm):
 
     def __init__(self, unsolved_dir: str, *args, **kwargs):
         self.unsolved_dir = Path(unsolved_dir)
         super().__init__(*args, **kwargs)
 
-    def get_cards(self) -> list[Card]:
+    def get_cards(self) -> list[CardSummary]:
         '''
         returns list of unsolved cards.
         replace this method with your own code
@@ -52,14 +227,17 @@ class ChooseCardsForm(npyscreen.ActionForm):
         isn't a simple way to do that in npyscreen? My solution is a bit gross, didn't want to do a deep dive to find 
         a normal way to do it. :/
         """
-        card_files = os.listdir(self.unsolved_dir)
-        cards = []
-        for card_file in card_files:
-            card_path = self.unsolved_dir / card_file
-            cards.append(Saver.load_unsolved_card_from_path(card_path))
-        return cards
+        return self.parentApp.card_loader.get_cards()
+
+    def get_loading_status(self) -> str:
+        if self.parentApp.card_loader.done:
+            return f'{len(self.cards)} cards'
+        return f'Loading cards... {len(self.cards)} so far'
 
     def create(self):
+        # The form is made again every time it's shown, and the cards are listed again with it.
+        self.parentApp.card_loader.start()
+        self.cards_version = self.parentApp.card_loader.version
         self.cards = self.get_cards()
         self.cards_strs = [CARD_STR.format(card=card)
                            for card in self.cards]
@@ -71,7 +249,12 @@ class ChooseCardsForm(npyscreen.ActionForm):
                  value='Lets solve some riddles!',
                  editable=False,
                  color='STANDOUT')
+        self.status = self.add(npyscreen.FixedText,
+                               value=self.get_loading_status(),
+                               editable=False)
         self.nextrely += 1
+        # The cards keep loading while the form is shown, see while_waiting.
+        self.keypress_timeout = 2
         self.card = self.add(npyscreen.TitleSelectOne,
                              name='Pick a card. any card. '
                                   '[press cancel to exit]',
@@ -79,6 +262,18 @@ class ChooseCardsForm(npyscreen.ActionForm):
                              exit_right=True,
                              labelColor='DEFAULT')
 
+    def while_waiting(self):
+        if self.cards_version == self.parentApp.card_loader.version and \
+                self.status.value == self.get_loading_status():
+            return
+        self.cards_version = self.parentApp.card_loader.version
+        self.cards = self.get_cards()
+        self.cards_strs = [CARD_STR.format(card=card)
+                           for card in self.cards]
+        self.card.values = self.cards_strs
+        self.status.value = self.get_loading_status()
+        self.display()
+
     def on_ok(self):
         if self.card.value:
             self.parentApp.card = self.cards[self.card.value[0]]
@@ -105,42 +300,29 @@ class SolveCardForm(npyscreen.Form):
         '''
         return card.decrypt_card(solution)
 
-    def get_unsolved_card_file(self, card: Card) -> Optional[Path]:
-        """
-        This function receives a card object and returns the path to the unsolved card file.
-        """
-        # Weird format demand, why not just use the card's name? This makes it way harder...
-        unsolved_files = os.listdir(self.unsolved_dir)
-        for unsolved_card_file in unsolved_files:
-            file_path = self.unsolved_dir / unsolved_card_file
-            unsolved_card = Saver.load_unsolved_card_from_path(file_path)
-            if unsolved_card.name == card.name:
-                return file_path
-        return None
-
-    def handle_correct_solution(self, card: Card, solution):
+    def handle_correct_solution(self, card: CardSummary, solution) -> bool:
         '''
         this function handles a correct solution
         replace this with your own code.
         (move card to solved card etc.)
         '''
-        Saver.save(card, self.solved_dir / card.name)
-        unsolved_file = self.get_unsolved_card_file(card)
-        if unsolved_file is None:
-            print("Are the files moving around while the program is running? raising Exception.")
-            raise FileNotFoundError("Can't delete unsolved card file, it doesn't exist all of a sudden.")
-        print(f'Removing {unsolved_file}')
-        if unsolved_file != "/":
-            print(f"The file f{unsolved_file} has been removed!")
-            # I'm running this on bare metal, not in a vm, I trust my programming, but not that much.
-            # os.remove(unsolved_file)
+        # The driver removes the unsolved card itself, packed cards have no file of their own to remove.
+        if not save_solved_card(card.load_card(), self.parentApp.driver):
+            print(f"{CARD_STR.format(card=card)} was solved, but couldn't be saved as a solved card.")
+            return False
+        self.parentApp.card_loader.remove_card(card)
         print(f'{CARD_STR.format(card=card)} was solved correctly!')
         print(f'The solution was: {solution}')
+        return True
 
     def solve(self, card: Card, solution):
         if self.check_solution(card, solution):
-            self.handle_correct_solution(card, solution)
-            self.parentApp.setNextForm('RightSolution')
+            if self.handle_correct_solution(card, solution):
+                self.parentApp.setNextForm('RightSolution')
+            else:
+                # Back to the cards, where the card is still unsolved.
+                self.parentApp.card = None
+                self.parentApp.setNextForm('MAIN')
         else:
             self.parentApp.setNextForm('WrongSolution')
 
@@ -202,8 +384,13 @@ class InteractiveCLI(npyscreen.NPSAppManaged):
     card = None
     unsolved_dir = ""
     solved_dir = ""
+    driver: FilesystemDriver = None
+    card_loader: CardLoader = None
 
     def onStart(self):
+        self.driver = open_driver(self.unsolved_dir, self.solved_dir)
+        # Started by the cards form, whenever it's shown.
+        self.card_loader = CardLoader(self.driver)
         self.addFormClass('MAIN',
                           ChooseCardsForm,
                           name='Cards Solver',
@@ -221,6 +408,11 @@ class InteractiveCLI(npyscreen.NPSAppManaged):
                           RightSolutionForm,
                           name='Cards Solver')
 
+    def onCleanExit(self):
+        if self.card_loader.thread is not None:
+            self.card_loader.thread.join()
+        self.driver.close()
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
@@ -230,6 +422,15 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("solved_dir",
                         type=str,
                         help="The directory in which the solved cards are stored")
+    parser.add_argument("--answers",
+                        type=str,
+                        default=None,
+                        help="A file of candidate answers, one per line. If given, every card solved by one of them "
+                             "is solved without the interactive cli")
+    parser.add_argument("--processes",
+                        type=int,
+                        default=None,
+                        help="The amount of processes hashing the answers (default: one per core)")
     return parser.parse_args()
 
 
@@ -237,8 +438,13 @@ if __name__ == "__main__":
     args = parse_args()
     unsolved_dir = args.unsolved_dir
     solved_dir = args.solved_dir
-    App = InteractiveCLI()
-    App.unsolved_dir = unsolved_dir
-    App.solved_dir = solved_dir
-    App.run()
+    if args.answers is not None:
+        solved = batch_solve(Path(unsolved_dir), Path(solved_dir), read_answers(Path(args.answers)),
+                             args.processes, ProgressPrinter())
+        print(f"Solved {len(solved)} card(s).")
+    else:
+        App = InteractiveCLI()
+        App.unsolved_dir = unsolved_dir
+        App.solved_dir = solved_dir
+        App.run()
 
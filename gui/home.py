@@ -19,13 +19,29 @@ def get_cards(creator: str) -> list[dict]:
     return cards
 
 
+def get_card_image(card: dict) -> bytes:
+    """
+    Gets a card's image, through a cache kept for the session: an image that was fetched before is only checked with
+    the server (If-None-Match), which answers 304 without sending it again if it didn't change.
+    """
+    image_url = f"{API_URL}/creators/{card['creator']}/cards/{card['name']}/image.jpg"
+    image_cache = st.session_state.setdefault("image_cache", {})
+    headers = {}
+    if image_url in image_cache:
+        headers["If-None-Match"] = image_cache[image_url][0]
+    response = requests.get(image_url, headers=headers)
+    if response.status_code == 304:
+        return image_cache[image_url][1]
+    if "ETag" in response.headers:
+        image_cache[image_url] = (response.headers["ETag"], response.content)
+    return response.content
+
+
 def show_card(card: dict):
-    presentable_data = card.copy()
-    presentable_data.pop('path')
-    st.table(presentable_data)
+    # The listing only has the card's presentable fields, its image is fetched on its own.
+    st.table(card)
 
-    image_bytes = requests.get(f"{API_URL}/creators/{card['creator']}/cards/{card['name']}/image.jpg").content
-    image = Image.open(io.BytesIO(image_bytes))
+    image = Image.open(io.BytesIO(get_card_image(card)))
 
     st.image(image, use_column_width=True)
 
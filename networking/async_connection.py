@@ -0,0 +1,84 @@
+from typing import Optional
+import asyncio
+import struct
+
+from networking.connection import LENGTH_FORMAT, LENGTH_SIZE
+from networking.protocol import make_hello, parse_hello, choose_codec
+from exceptions import DisconnectionException
+
+
+class AsyncConnection:
+    """
+    The asyncio counterpart of Connection, it speaks the same length-prefixed format over asyncio streams.
+    """
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    def __repr__(self):
+        local_addr = self.writer.get_extra_info("sockname")
+        remote_addr = self.writer.get_extra_info("peername")
+        if local_addr is None or remote_addr is None:
+            return "<AsyncConnection object (Unconnected)>"
+        return f"<AsyncConnection from {local_addr[0]}:{local_addr[1]} to {remote_addr[0]}:{remote_addr[1]}>"
+
+    async def send_message(self, message: bytes) -> None:
+        """
+        Sends a message to the connection in the requested format, waiting until the transport has room for more.
+        """
+        self.writer.writelines([struct.pack(LENGTH_FORMAT, len(message)), message])
+        await self.writer.drain()
+
+    async def receive_message(self, max_length: Optional[int] = None) -> bytes:
+        """
+        Receives a message from the connection in the requested format, and returns the decoded message.
+        :param max_length: If given, longer messages are refused (and the connection closed) before they're read.
+        """
+        try:
+            length_bytes = await self.reader.readexactly(LENGTH_SIZE)
+            message_length = struct.unpack(LENGTH_FORMAT, length_bytes)[0]
+            if message_length < 0 or (max_length is not None and message_length > max_length):
+                await self.close()
+                raise ValueError(f"Received a message with an invalid length ({message_length}), closing connection.")
+            return await self.reader.readexactly(message_length)
+        except asyncio.IncompleteReadError:
+            # The connection was closed mid-message (or before one started)
+            await self.close()
+            raise DisconnectionException()
+
+    async def answer_compression_negotiation(self, hello: bytes, supported_codecs: list[str]) -> str:
+        """
+        Answers a client's negotiation message with the codec the client should use, see Connection.
+        :return: The picked codec.
+        """
+        codec = choose_codec(parse_hello(hello), supported_codecs)
+        await self.send_message(make_hello([codec]))
+        return codec
+
+    @classmethod
+    async def connect(cls, host: str, port: int):
+        """
+        Connects to a server at host:port, and returns the new object.
+        :param host: The host to connect to
+        :param port: The port to connect to
+        :return: A new AsyncConnection object connected to the specified host and port
+        """
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            # The other side is already gone, nothing left to close.
+            pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
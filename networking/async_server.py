@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import NoReturn
+from pathlib import Path
+import asyncio
+
+from networking.async_connection import AsyncConnection
+from networking.protocol import SESSION_START, SESSION_END, CARD_STREAM, MAX_CHUNK_SIZE, parse_hello
+from networking.ingest import save_card, CardStreamReceiver
+from game.compression import SUPPORTED_CODECS
+from exceptions import DisconnectionException
+
+DEFAULT_MAX_WORKERS = 8
+LISTEN_BACKLOG = 1000
+
+
+async def manage_conn(connection: AsyncConnection, card_dir: Path, executor: ThreadPoolExecutor):
+    """
+    This function manages a connection with a client. It saves the card it receives to the directory specified,
+    or every card sent over the connection if the client opens a session.
+    Saving (deserialising, PIL, the storage driver) is blocking, so it's done on the executor, never on the loop.
+    The next card isn't received before the last one is saved, so a connection holds at most one card in memory
+    (streamed cards are written out chunk by chunk as they're received).
+    :param connection: The connection with the client
+    :param card_dir: The directory in which to save the card
+    :param executor: The executor on which cards are saved
+    """
+    loop = asyncio.get_running_loop()
+
+    async def receive_card(first_message: bytes) -> bytes:
+        if first_message != CARD_STREAM:
+            return await loop.run_in_executor(executor, save_card, first_message, card_dir)
+        header = await connection.receive_message(max_length=MAX_CHUNK_SIZE)
+        receiver = await loop.run_in_executor(executor, CardStreamReceiver, header, card_dir)
+        try:
+            while limit := receiver.next_chunk_limit():
+                chunk = await connection.receive_message(max_length=limit)
+                await loop.run_in_executor(executor, receiver.feed, chunk)
+        except BaseException:
+            await loop.run_in_executor(executor, receiver.abort)
+            raise
+        return await loop.run_in_executor(executor, receiver.finish)
+
+    async with connection as conn:
+        try:
+            first_message = await conn.receive_message()
+            if parse_hello(first_message) is not None:
+                await conn.answer_compression_negotiation(first_message, SUPPORTED_CODECS)
+                first_message = await conn.receive_message()
+            if first_message == SESSION_START:
+                card_count = 0
+                while (message := await conn.receive_message()) != SESSION_END:
+                    await conn.send_message(await receive_card(message))
+                    card_count += 1
+            else:
+                card_count = 1
+                reply = await receive_card(first_message)
+                try:
+                    await conn.send_message(reply)
+                except ConnectionError:
+                    # Older clients don't wait for the reply.
+                    pass
+        except DisconnectionException:
+            print(f"{conn} disconnected midway.")
+            return
+    print(f"Received {card_count} card{'s' if card_count != 1 else ''}.")
+
+
+async def serve(server_ip: str, server_port: int, card_dir: Path, max_workers: int = DEFAULT_MAX_WORKERS):
+    """
+    Serves clients on a single event loop, using the same framing as the threaded server.
+    :param server_ip: The IP to listen on
+    :param server_port: The port to listen on
+    :param card_dir: The directory in which to store the cards
+    :param max_workers: The amount of threads used for saving cards
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        async def on_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            await manage_conn(AsyncConnection(reader, writer), card_dir, executor)
+
+        server = await asyncio.start_server(on_connection, server_ip, server_port, backlog=LISTEN_BACKLOG)
+        async with server:
+            await server.serve_forever()
+
+
+def run_async_server(server_ip: str, server_port: int, card_dir: str,
+                     max_workers: int = DEFAULT_MAX_WORKERS) -> NoReturn:
+    asyncio.run(serve(server_ip, server_port, Path(card_dir), max_workers))
@@ -1,17 +1,139 @@
+from typing import Iterable, Union, Optional
 import argparse
 import sys
 
 from networking.connection import Connection
+from networking.protocol import REPLY_OK, REPLY_BUSY, SESSION_START, SESSION_END, CARD_STREAM, MAX_CHUNK_SIZE
+from exceptions import ServerBusyException
+from game.compression import NO_COMPRESSION, SUPPORTED_CODECS
+from game.card_format import FORMAT_V1, FORMAT_V2
+from game.crypt_image import RAW_IMAGE_FORMAT, ENCODED_IMAGE_FORMATS
 from game.card import Card
 
+DEFAULT_WINDOW_SIZE = 16
 
-def send_data(server_ip: str, server_port: int, data: bytes):
+
+def send_data(server_ip: str, server_port: int, data: bytes) -> bool:
     '''
     Send data to server in address (server_ip, server_port).
+    Returns whether the server saved the card, raises ServerBusyException if the server turned the connection away.
     '''
     with Connection.connect(server_ip, server_port) as conn:
         print(f"Sending data...")
-        conn.send_message(data)
+        try:
+            conn.send_message(data)
+        except OSError:
+            # A busy server replies and hangs up without reading the card, which may break the send midway.
+            _receive_acknowledgement(conn)
+            raise
+        return _receive_acknowledgement(conn)
+
+
+def send_card(server_ip: str, server_port: int, card: Card, codecs: list[str] = SUPPORTED_CODECS,
+              level: Optional[int] = None, stream: bool = False) -> bool:
+    '''
+    Encrypt the card and send it to server in address (server_ip, server_port). The card's image is compressed
+    (before it's encrypted) with whichever of the given codecs the server picks, servers that don't support the
+    negotiation get the card uncompressed. Returns whether the server saved the card.
+    Cards with encoded images can only be sent to servers that support the negotiation.
+    '''
+    with Connection.connect(server_ip, server_port) as conn:
+        codec = conn.negotiate_compression(codecs) if codecs else NO_COMPRESSION
+        if codec is not None:
+            card.encrypt_card(codec, level)
+            return _send_encrypted_card(conn, card, stream)
+    # The server didn't understand the negotiation, and hung up on it. It predates v2 cards too.
+    if card.image.image_format != RAW_IMAGE_FORMAT:
+        print("The server is too old for cards with encoded images, send the card with raw pixels instead.")
+        return False
+    card.encrypt_card()
+    with Connection.connect(server_ip, server_port) as conn:
+        return _send_encrypted_card(conn, card, stream, FORMAT_V1)
+
+
+def send_card_stream(server_ip: str, server_port: int, card: Card) -> bool:
+    '''
+    Send an encrypted card to server in address (server_ip, server_port), streaming its image in chunks instead of
+    serialising it whole. Returns whether the server saved the card.
+    '''
+    with Connection.connect(server_ip, server_port) as conn:
+        return _send_encrypted_card(conn, card, stream=True)
+
+
+def _send_encrypted_card(conn: Connection, card: Card, stream: bool, version: int = FORMAT_V2) -> bool:
+    print(f"Sending card...")
+    try:
+        if stream:
+            stream_card(conn, card, version=version)
+        else:
+            conn.send_message(card.serialise(version))
+    except OSError:
+        # A busy server replies and hangs up without reading the card, which may break the send midway.
+        _receive_acknowledgement(conn)
+        raise
+    return _receive_acknowledgement(conn)
+
+
+def stream_card(conn: Connection, card: Card, chunk_size: int = MAX_CHUNK_SIZE, version: int = FORMAT_V2):
+    '''
+    Sends the card over the connection as a stream: its header first, then its image data chunk by chunk.
+    '''
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f"The chunk size must be between 1 and {MAX_CHUNK_SIZE}, got {chunk_size}")
+    conn.send_message(CARD_STREAM)
+    conn.send_message(card.serialise_header(version))
+    for chunk in card.iter_image_chunks(chunk_size):
+        conn.send_message(chunk)
+
+
+def send_cards(server_ip: str, server_port: int, card_serialisations: Iterable[Union[bytes, Card]],
+               window: int = DEFAULT_WINDOW_SIZE) -> list[bool]:
+    '''
+    Send many cards to server in address (server_ip, server_port), all over a single connection.
+    Cards may be given serialised, or as Card objects, which are streamed.
+    Returns, for each card in order, whether the server saved it.
+    '''
+    with Connection.connect(server_ip, server_port) as conn:
+        print(f"Sending cards...")
+        return send_session(conn, card_serialisations, window)
+
+
+def send_session(conn: Connection, card_serialisations: Iterable[Union[bytes, Card]],
+                 window: int = DEFAULT_WINDOW_SIZE) -> list[bool]:
+    '''
+    Sends the cards over a session on the given connection. Up to `window` cards are sent ahead of their
+    acknowledgements, so the connection never idles waiting for the server to save a card.
+    '''
+    if window < 1:
+        raise ValueError(f"The window must allow at least one unacknowledged card, got {window}")
+    results = []
+    unacknowledged = 0
+    try:
+        conn.send_message(SESSION_START)
+        for card_serialisation in card_serialisations:
+            if unacknowledged >= window:
+                results.append(_receive_acknowledgement(conn))
+                unacknowledged -= 1
+            if isinstance(card_serialisation, Card):
+                stream_card(conn, card_serialisation)
+            else:
+                conn.send_message(card_serialisation)
+            unacknowledged += 1
+        conn.send_message(SESSION_END)
+    except OSError:
+        # A busy server replies and hangs up without reading the session, which may break the send midway.
+        _receive_acknowledgement(conn)
+        raise
+    for _ in range(unacknowledged):
+        results.append(_receive_acknowledgement(conn))
+    return results
+
+
+def _receive_acknowledgement(conn: Connection) -> bool:
+    reply = conn.receive_message()
+    if reply == REPLY_BUSY:
+        raise ServerBusyException("The server is busy, try again later.")
+    return reply == REPLY_OK
 
 
 def get_args():
@@ -30,6 +152,19 @@ def get_args():
                         help="The riddle")
     parser.add_argument("solution", type=str,
                         help="The solution to the riddle")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream the card's image in chunks instead of sending the card whole")
+    parser.add_argument("--compression", action="append", choices=SUPPORTED_CODECS,
+                        help="A compression codec to offer the server, may be given more than once, most preferred "
+                             "first (default: all supported codecs)")
+    parser.add_argument("--compression-level", type=int, default=None,
+                        help="The compression level, 0-9 (default: the codec's default)")
+    parser.add_argument("--no-compression", action="store_true",
+                        help="Send the card uncompressed, without negotiating with the server")
+    parser.add_argument("--encoded", action="store_true",
+                        help="Send the image file itself instead of its raw pixels, which is usually much smaller")
+    parser.add_argument("--image-format", choices=ENCODED_IMAGE_FORMATS, default=None,
+                        help="The format to send an encoded image in (default: the file's own format, if possible)")
     return parser.parse_args()
 
 
@@ -38,11 +173,17 @@ def main():
     Implementation of CLI and sending data to server.
     '''
     args = get_args()
-    card = Card.create_from_path(args.name, args.creator, args.image_path, args.riddle, args.solution)
-    card.encrypt_card()
+    card = Card.create_from_path(args.name, args.creator, args.image_path, args.riddle, args.solution,
+                                 encoded=args.encoded or args.image_format is not None,
+                                 image_format=args.image_format)
+    codecs = [] if args.no_compression else (args.compression or SUPPORTED_CODECS)
     try:
-        send_data("127.0.0.1", 6666, card.serialise())
-        print('Done.')
+        saved = send_card("127.0.0.1", 6666, card, codecs, args.compression_level, args.stream)
+        if saved:
+            print('Done.')
+        else:
+            print('The server refused the card, maybe it already has it?')
+            return 1
     except Exception as error:
         print(f'ERROR: {error}')
         return 1
@@ -1,8 +1,14 @@
+from typing import Optional
 import socket
 import struct
 
 
-from exceptions import DisconnectionException
+from networking.protocol import REPLY_BUSY, make_hello, parse_hello, choose_codec
+from exceptions import DisconnectionException, ServerBusyException
+
+# Every message is prefixed by its length, as a big-endian 4 byte integer.
+LENGTH_FORMAT = ">i"
+LENGTH_SIZE = struct.calcsize(LENGTH_FORMAT)
 
 
 class Connection:
@@ -26,34 +32,104 @@ class Connection:
             # Hasn't connected yet, This shouldn't really happen, but it's good to have
             return f"<Connection object {local_addr[0]}:{local_addr[1]} (Unconnected)>"
 
+    def get_peer_host(self) -> str:
+        """
+        Returns the host on the other side of the connection, used to tell apart connections from different clients.
+        """
+        peer_addr = self.sock.getpeername()
+        if isinstance(peer_addr, tuple):
+            return peer_addr[0]
+        return peer_addr
+
     def send_message(self, message: bytes) -> None:
         """
         Sends a message to the connection in the requested format. The function will format the message correctly.
+        The length prefix and the message are handed to the socket as separate buffers, so the message isn't copied.
         """
-        encoded_data = struct.pack(f">i{len(message)}s", len(message), message)
-        self.sock.send(encoded_data)
+        length_bytes = struct.pack(LENGTH_FORMAT, len(message))
+        self._send_buffers([length_bytes, message])
 
-    def receive_message(self) -> bytes:
+    def _send_buffers(self, buffers: list) -> None:
+        """
+        Sends all the given buffers, in order, using vectored writes where the socket supports them.
+        :param buffers: A list of bytes-like objects to be sent one after the other.
+        """
+        views = [memoryview(buffer).cast('B') for buffer in buffers]
+        views = [view for view in views if view.nbytes > 0]
+        if not hasattr(self.sock, "sendmsg"):
+            # sendmsg isn't available on every platform (windows), fall back to a write per buffer.
+            for view in views:
+                self.sock.sendall(view)
+            return
+        while views:
+            sent = self.sock.sendmsg(views)
+            # Dropping whatever was fully sent, and trimming the buffer that was only partially sent.
+            while views and sent >= views[0].nbytes:
+                sent -= views[0].nbytes
+                views.pop(0)
+            if sent:
+                views[0] = views[0][sent:]
+
+    def _receive_exact(self, size: int) -> bytearray:
+        """
+        Receives exactly size bytes from the connection. The buffer is allocated once and filled in place.
+        :param size: The amount of bytes to receive.
+        :return: The received bytes.
+        """
+        buffer = bytearray(size)
+        received = 0
+        with memoryview(buffer) as view:
+            while received < size:
+                chunk_size = self.sock.recv_into(view[received:])
+                if chunk_size == 0:  # Zero bytes means the connection was closed
+                    self.close()
+                    raise DisconnectionException()
+                received += chunk_size
+        return buffer
+
+    def receive_message(self, max_length: Optional[int] = None) -> bytearray:
         """
         Receives a message from the connection in the requested format, and returns the decoded message.
+        The whole message is read into a single buffer of the announced length, which is returned as is.
+        :param max_length: If given, longer messages are refused (and the connection closed) before anything is
+        allocated for them.
         """
-        length_bytes = self.sock.recv(4)
-        if not length_bytes:  # An empty bytes string means the connection was closed
+        length_bytes = self._receive_exact(LENGTH_SIZE)
+        message_length = struct.unpack(LENGTH_FORMAT, length_bytes)[0]
+        if message_length < 0 or (max_length is not None and message_length > max_length):
             self.close()
-            raise DisconnectionException()
-        message_length = struct.unpack("<i", length_bytes)[0]
-        # Note the requested message format if this isn't clear.
-        raw_msg = self.sock.recv(2**8)
-        message = b""
-
-        while len(message) < message_length:
-            message += raw_msg
-            raw_msg = self.sock.recv(2**8)
-            if raw_msg == b'':
-                self.close()
-                raise DisconnectionException()
-
-        return message
+            raise ValueError(f"Received a message with an invalid length ({message_length}), closing connection.")
+        return self._receive_exact(message_length)
+
+    def negotiate_compression(self, codecs: list[str]) -> Optional[str]:
+        """
+        Offers the given compression codecs to the server, most preferred first, and returns the one it picked
+        ("none" if it can't use any of them). Cards sent over the connection should then be compressed with it.
+        :return: The codec picked by the server, or None if the server doesn't support negotiation at all, in which
+        case it has most likely closed the connection already.
+        """
+        self.send_message(make_hello(codecs))
+        try:
+            reply = self.receive_message()
+        except DisconnectionException:
+            return None
+        if reply == REPLY_BUSY:
+            raise ServerBusyException("The server is busy, try again later.")
+        picked_codecs = parse_hello(reply)
+        if picked_codecs is None or len(picked_codecs) != 1:
+            return None
+        return picked_codecs[0]
+
+    def answer_compression_negotiation(self, hello: bytes, supported_codecs: list[str]) -> str:
+        """
+        Answers a client's negotiation message with the codec the client should use.
+        :param hello: The negotiation message received from the client.
+        :param supported_codecs: The codecs that can be accepted.
+        :return: The picked codec.
+        """
+        codec = choose_codec(parse_hello(hello), supported_codecs)
+        self.send_message(make_hello([codec]))
+        return codec
 
     @classmethod
     def connect(cls, host: str, port: int):
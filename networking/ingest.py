@@ -0,0 +1,73 @@
+from typing import Optional
+from pathlib import Path
+
+from networking.protocol import REPLY_OK, REPLY_ERROR, MAX_CHUNK_SIZE
+from backend.data_management.drivers.filesystem_driver import UnsolvedCardWriter
+from backend.data_management.saver import Saver
+from game.card import Card
+
+
+def save_card(card_serialisation: bytes, card_dir: Path) -> bytes:
+    """
+    Saves a card received by the server, and returns the reply that should be sent back for it.
+    A card that fails to save is reported to the client rather than tearing down the whole connection.
+    :param card_serialisation: The serialisation of the card, as received.
+    :param card_dir: The directory in which to save the card
+    :return: The reply for the client.
+    """
+    try:
+        saved = Saver.save_serialisation(card_serialisation, card_dir)
+    except Exception as e:
+        print(f"Failed saving a card: {e!r}")
+        return REPLY_ERROR
+    return REPLY_OK if saved else REPLY_ERROR
+
+
+class CardStreamReceiver:
+    """
+    Saves a streamed card as its chunks arrive, so the server holds at most one chunk of it at a time.
+    It's fed by the server's receiving loop (threaded or asyncio) until next_chunk_limit returns 0:
+
+        while limit := receiver.next_chunk_limit():
+            receiver.feed(conn.receive_message(max_length=limit))
+        reply = receiver.finish()
+    """
+
+    def __init__(self, header: bytes, card_dir: Path):
+        """
+        :param header: The card's header, see Card.serialise_header. A malformed header raises ValueError, since the
+        stream can't be followed without it.
+        :param card_dir: The directory in which to save the card
+        """
+        self.name, self.creator, self.image_offset, self.remaining = Card.parse_header(header)
+        self.header = header
+        # Without a writer (the card exists already) the chunks are still received, and thrown away.
+        self.writer: Optional[UnsolvedCardWriter] = Saver.open_serialisation_writer(self.name, self.creator, card_dir)
+        if self.writer is not None:
+            self.writer.write(self.header[:self.image_offset])
+
+    def next_chunk_limit(self) -> int:
+        """
+        Returns the maximal size of the next chunk, or 0 if the whole image was received.
+        """
+        return min(self.remaining, MAX_CHUNK_SIZE)
+
+    def feed(self, chunk: bytes):
+        if not chunk:
+            raise ValueError("Received an empty chunk in the middle of a card stream")
+        self.remaining -= len(chunk)
+        if self.writer is not None:
+            self.writer.write(chunk)
+
+    def finish(self) -> bytes:
+        """
+        Saves the card, and returns the reply that should be sent back for it.
+        """
+        if self.writer is None:
+            return REPLY_ERROR
+        self.writer.write(self.header[self.image_offset:])
+        return REPLY_OK if self.writer.commit() else REPLY_ERROR
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.abort()
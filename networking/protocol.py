@@ -0,0 +1,45 @@
+from typing import Optional
+
+from game.compression import NO_COMPRESSION
+
+# Replies sent by the server, as a message of their own, once it's done with a card.
+REPLY_OK = b"OK"
+REPLY_ERROR = b"ERROR"
+# Sent instead of handling the connection at all, when the server is saturated.
+REPLY_BUSY = b"BUSY"
+
+# Sent as the first message of a connection to carry many cards over it. Each card is then acknowledged, in order,
+# with a reply of its own, and an empty message ends the session.
+SESSION_START = b"CARDAZIM/SESSION"
+SESSION_END = b""
+
+# Sent before a card that is streamed rather than sent whole: the next message is the card's header (see
+# Card.serialise_header), followed by the image data in messages of at most MAX_CHUNK_SIZE bytes each.
+CARD_STREAM = b"CARDAZIM/STREAM"
+MAX_CHUNK_SIZE = 2**20
+
+# Sent by a client before its cards, offering the compression codecs (see game.compression) it can use, in order of
+# preference: b"CARDAZIM/HELLO zlib,lzma". The server answers with the same prefix and the single codec it picked, which
+# is "none" if it can't use any of them. A server that predates the handshake would take it for a card, and fail it.
+HELLO_PREFIX = b"CARDAZIM/HELLO "
+
+
+def make_hello(codecs: list[str]) -> bytes:
+    return HELLO_PREFIX + ",".join(codecs).encode('ascii')
+
+
+def parse_hello(message: bytes) -> Optional[list[str]]:
+    """
+    Returns the codecs listed in a handshake message, or None if the message isn't a handshake message.
+    """
+    if not message.startswith(HELLO_PREFIX):
+        return None
+    codecs = bytes(message[len(HELLO_PREFIX):]).decode('ascii', errors='replace')
+    return [codec for codec in codecs.split(",") if codec]
+
+
+def choose_codec(offered_codecs: list[str], supported_codecs: list[str]) -> str:
+    """
+    Picks the codec the client prefers most out of the ones supported.
+    """
+    return next((codec for codec in offered_codecs if codec in supported_codecs), NO_COMPRESSION)
@@ -1,40 +1,124 @@
-from typing import NoReturn
+from typing import NoReturn, Optional
 from pathlib import Path
 import threading
 import argparse
+import time
 
 
+from networking.async_server import run_async_server, DEFAULT_MAX_WORKERS
+from networking.worker_pool import WorkerPool, DEFAULT_WORKERS, DEFAULT_QUEUE_SIZE, DEFAULT_PER_PEER_LIMIT
+from networking.protocol import SESSION_START, SESSION_END, CARD_STREAM, MAX_CHUNK_SIZE, parse_hello
+from networking.ingest import save_card, CardStreamReceiver
 from networking.listener import Listener
 from networking.connection import Connection
+from game.compression import SUPPORTED_CODECS
+from backend.data_management.drivers.filesystem_driver import PACK_DIR_NAME
+from backend.data_management.drivers.ingest_journal import DEFAULT_BATCH_SIZE, DEFAULT_BATCH_INTERVAL
 from backend.data_management.saver import Saver
 
 
-def run_server(server_ip: str, server_port: int, card_dir: str) -> NoReturn:
+def run_server(server_ip: str, server_port: int, card_dir: str,
+               workers: int = DEFAULT_WORKERS,
+               queue_size: int = DEFAULT_QUEUE_SIZE,
+               per_peer_limit: int = DEFAULT_PER_PEER_LIMIT,
+               stats_interval: Optional[float] = None) -> NoReturn:
     io_lock = threading.Lock()
-    with Listener(server_ip, server_port) as listener:
+
+    def handle(conn: Connection):
+        manage_conn(conn, card_dir, io_lock)
+
+    with Listener(server_ip, server_port) as listener, \
+            WorkerPool(handle, workers, queue_size, per_peer_limit) as pool:
+        if stats_interval:
+            stats_thread = threading.Thread(target=report_stats, args=[pool, stats_interval, io_lock], daemon=True)
+            stats_thread.start()
         while True:
             conn = listener.accept()
-            # Why did we demand connection to be a context manager? That doesn't work with multithreading very well
-            connection_thread = threading.Thread(target=manage_conn, args=[conn, card_dir, io_lock])
-            connection_thread.start()
+            try:
+                # Connections the pool can't take are answered with a busy reply and closed by the pool itself.
+                pool.submit(conn)
+            except OSError as e:
+                # The client may be gone before it's even admitted (getpeername fails), which mustn't stop the server.
+                with io_lock:
+                    print(f"Dropping a connection that failed on admission: {e!r}")
+                conn.close()
+
+
+def report_stats(pool: WorkerPool, interval: float, lock: threading.Lock) -> NoReturn:
+    """
+    Periodically prints the pool's counters, to help sizing it.
+    """
+    while True:
+        time.sleep(interval)
+        stats = pool.get_stats()
+        with lock:
+            print(f"Pool stats: {stats}")
 
 
 def manage_conn(connection: Connection, card_dir: Path, lock: threading.Lock):
     """
     This function manages a connection with a client. It saves the card it receives to the directory specified.
+    If the client opens a session, it saves every card sent over the connection until the client ends it.
     :param connection: The connection with the client
     :param card_dir: The directory in which to save the card
     :param lock: threading lock, this function is thread sensitive
     :return:
     """
     with connection as conn:
-        card_serialisation = conn.receive_message()
-        Saver.  save_serialisation(card_serialisation, card_dir)
+        first_message = conn.receive_message()
+        if parse_hello(first_message) is not None:
+            conn.answer_compression_negotiation(first_message, SUPPORTED_CODECS)
+            first_message = conn.receive_message()
+        if first_message == SESSION_START:
+            card_count = manage_session(conn, card_dir)
+        else:
+            reply = receive_card(conn, first_message, card_dir)
+            card_count = 1
+            try:
+                conn.send_message(reply)
+            except OSError:
+                # Older clients don't wait for the reply.
+                pass
     lock.acquire()
-    print(f"Received card.")
+    print(f"Received {card_count} card{'s' if card_count != 1 else ''}.")
     lock.release()
 
 
+def manage_session(conn: Connection, card_dir: Path) -> int:
+    """
+    Saves every card sent over a session, acknowledging each one in order. The client doesn't wait for an
+    acknowledgement before sending the next card, so cards keep flowing while the previous ones are saved.
+    :param conn: The connection with the client, right after the session started
+    :param card_dir: The directory in which to save the cards
+    :return: The amount of cards received
+    """
+    card_count = 0
+    while (message := conn.receive_message()) != SESSION_END:
+        conn.send_message(receive_card(conn, message, card_dir))
+        card_count += 1
+    return card_count
+
+
+def receive_card(conn: Connection, first_message: bytes, card_dir: Path) -> bytes:
+    """
+    Receives and saves a single card, which is either sent whole or streamed.
+    :param conn: The connection with the client
+    :param first_message: The first message of the card, either its serialisation or the start of a stream.
+    :param card_dir: The directory in which to save the card
+    :return: The reply for the client.
+    """
+    if first_message != CARD_STREAM:
+        return save_card(first_message, card_dir)
+    receiver = CardStreamReceiver(conn.receive_message(max_length=MAX_CHUNK_SIZE), card_dir)
+    try:
+        while limit := receiver.next_chunk_limit():
+            receiver.feed(conn.receive_message(max_length=limit))
+    except BaseException:
+        receiver.abort()
+        raise
+    return receiver.finish()
+
+
 def get_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument("IPv4",
@@ -46,6 +130,44 @@ def get_args() -> argparse.Namespace:
     parser.add_argument("card_dir",
                         type=str,
                         help="The directory in which to store the cards")
+    parser.add_argument("--mode",
+                        choices=["threads", "asyncio"],
+                        default="threads",
+                        help="Serve each connection on its own thread, or all of them on a single event loop")
+    parser.add_argument("--max-workers",
+                        type=int,
+                        default=DEFAULT_MAX_WORKERS,
+                        help="The amount of threads saving cards (asyncio mode only)")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=DEFAULT_WORKERS,
+                        help="The amount of threads handling connections (threads mode only)")
+    parser.add_argument("--queue-size",
+                        type=int,
+                        default=DEFAULT_QUEUE_SIZE,
+                        help="The amount of connections that may wait for a worker before the server reports it's busy")
+    parser.add_argument("--per-peer-limit",
+                        type=int,
+                        default=DEFAULT_PER_PEER_LIMIT,
+                        help="The amount of concurrent connections allowed from a single host")
+    parser.add_argument("--stats-interval",
+                        type=float,
+                        default=None,
+                        help="Print the worker pool's counters every this many seconds")
+    parser.add_argument("--packs",
+                        action="store_true",
+                        help="Keep the cards in a few large pack files instead of a file per card")
+    parser.add_argument("--journal",
+                        action="store_true",
+                        help="Save cards through a write-ahead journal, fsynced once per batch of cards")
+    parser.add_argument("--journal-batch-size",
+                        type=int,
+                        default=DEFAULT_BATCH_SIZE,
+                        help="The amount of cards after which the journal is committed")
+    parser.add_argument("--journal-batch-interval",
+                        type=float,
+                        default=DEFAULT_BATCH_INTERVAL,
+                        help="The time, in seconds, after which the journal is committed even if the batch isn't full")
     return parser.parse_args()
 
 
@@ -54,5 +176,17 @@ if __name__ == '__main__':
     server_ip = args.IPv4
     server_port = args.port
     card_dir = args.card_dir
-    run_server(server_ip, server_port, card_dir)
+    if args.packs:
+        # The card directory keeps using packs from now on, see FilesystemDriver.
+        (Path(card_dir) / PACK_DIR_NAME).mkdir(parents=True, exist_ok=True)
+    Saver.open_card_dir(Path(card_dir), use_journal=args.journal,
+                        journal_batch_size=args.journal_batch_size, journal_batch_interval=args.journal_batch_interval)
+    try:
+        if args.mode == "asyncio":
+            run_async_server(server_ip, server_port, card_dir, args.max_workers)
+        else:
+            run_server(server_ip, server_port, card_dir,
+                       args.workers, args.queue_size, args.per_peer_limit, args.stats_interval)
+    finally:
+        Saver.close_card_dirs()
 
@@ -0,0 +1,140 @@
+from collections import defaultdict
+from typing import Callable
+import threading
+import queue
+
+from networking.connection import Connection
+from networking.protocol import REPLY_BUSY
+
+DEFAULT_WORKERS = 16
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_PER_PEER_LIMIT = 8
+
+
+class WorkerPool:
+    """
+    A fixed amount of threads handling connections from a bounded queue. Connections that can't be admitted, either
+    because the queue is full or because their peer already has too many connections, are answered with a busy reply
+    and closed right away, instead of piling up.
+    """
+
+    def __init__(self,
+                 handler: Callable[[Connection], None],
+                 workers: int = DEFAULT_WORKERS,
+                 queue_size: int = DEFAULT_QUEUE_SIZE,
+                 per_peer_limit: int = DEFAULT_PER_PEER_LIMIT):
+        """
+        :param handler: The function handling a single connection, called on one of the worker threads.
+        :param workers: The amount of worker threads.
+        :param queue_size: The amount of accepted connections that may wait for a worker.
+        :param per_peer_limit: The amount of connections (waiting or handled) a single host may have at once.
+        """
+        self.handler = handler
+        self.workers = workers
+        self.per_peer_limit = per_peer_limit
+        self.pending: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.threads: list[threading.Thread] = []
+        self.lock = threading.Lock()
+        self.peer_connections: dict[str, int] = defaultdict(int)
+        # Counters, see get_stats
+        self.active = 0
+        self.admitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected_busy = 0
+        self.rejected_quota = 0
+
+    def __repr__(self):
+        return f"WorkerPool(workers={self.workers}, queue_size={self.pending.maxsize}, " \
+               f"per_peer_limit={self.per_peer_limit})"
+
+    def start(self):
+        for _ in range(self.workers):
+            worker_thread = threading.Thread(target=self._work, daemon=True)
+            worker_thread.start()
+            self.threads.append(worker_thread)
+
+    def stop(self):
+        """
+        Lets the workers finish the connections already admitted, and waits for them to exit.
+        """
+        for _ in self.threads:
+            self.pending.put(None)
+        for worker_thread in self.threads:
+            worker_thread.join()
+        self.threads = []
+
+    def submit(self, connection: Connection) -> bool:
+        """
+        Admits a connection to the pool, or rejects it with a busy reply if the pool is saturated.
+        :param connection: A newly accepted connection.
+        :return: True if the connection was admitted, False if it was rejected.
+        """
+        peer = connection.get_peer_host()
+        with self.lock:
+            if self.peer_connections[peer] >= self.per_peer_limit:
+                self.rejected_quota += 1
+                admitted = False
+            else:
+                try:
+                    self.pending.put_nowait((peer, connection))
+                    self.peer_connections[peer] += 1
+                    self.admitted += 1
+                    admitted = True
+                except queue.Full:
+                    self.rejected_busy += 1
+                    admitted = False
+        if not admitted:
+            self._reject(connection)
+        return admitted
+
+    @staticmethod
+    def _reject(connection: Connection):
+        with connection as conn:
+            try:
+                conn.send_message(REPLY_BUSY)
+            except OSError:
+                # The client is gone already, nobody to tell.
+                pass
+
+    def _work(self):
+        while (item := self.pending.get()) is not None:
+            peer, connection = item
+            with self.lock:
+                self.active += 1
+            try:
+                self.handler(connection)
+                succeeded = True
+            except Exception as e:
+                print(f"Failed handling {connection}: {e!r}")
+                succeeded = False
+            with self.lock:
+                self.active -= 1
+                self.completed += succeeded
+                self.failed += not succeeded
+                self.peer_connections[peer] -= 1
+                if self.peer_connections[peer] == 0:
+                    del self.peer_connections[peer]
+
+    def get_stats(self) -> dict[str, int]:
+        """
+        Returns a snapshot of the pool's counters, for sizing the pool.
+        """
+        with self.lock:
+            return {"queue_depth": self.pending.qsize(),
+                    "queue_size": self.pending.maxsize,
+                    "active": self.active,
+                    "workers": self.workers,
+                    "admitted": self.admitted,
+                    "completed": self.completed,
+                    "failed": self.failed,
+                    "rejected_busy": self.rejected_busy,
+                    "rejected_quota": self.rejected_quota,
+                    "peers": len(self.peer_connections)}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,204 @@
+from pathlib import Path
+from PIL import Image
+import pytest
+
+from game.card_format import CardView, CARD_MAGIC, FORMAT_V1, FORMAT_V2
+from game.card_summary import CardSummary
+from game.image_cache import DecodedImageCache, get_image_size
+from game.card import Card
+import game.crypt_image
+
+TEST_IMAGE_PATH = Path(__file__).parent.parent / "networking" / "cheese.jpg"
+SOLUTION = "test" * 4
+
+
+def get_card(name: str = "test") -> Card:
+    return Card.create_from_path(name=name, creator="testy mctestface", path=str(TEST_IMAGE_PATH),
+                                 riddle="i <3 tests", solution=SOLUTION)
+
+
+@pytest.mark.parametrize("codec, version", [("none", FORMAT_V1), ("none", FORMAT_V2), ("zlib", FORMAT_V2),
+                                            ("lzma", FORMAT_V2)])
+def test_serialisation_round_trip(codec, version):
+    card = get_card()
+    image_data = card.image.image.tobytes()
+    card.encrypt_card(codec)
+    serialisation = card.serialise(version)
+    assert serialisation.startswith(CARD_MAGIC) == (version == FORMAT_V2)
+    card2 = Card.deserialize(serialisation)
+    assert (card2.name, card2.creator, card2.riddle) == (card.name, card.creator, card.riddle)
+    assert not card2.decrypt_card("wrong" * 4)
+    assert card2.decrypt_card(SOLUTION)
+    assert card2.image.image.tobytes() == image_data
+
+
+@pytest.mark.parametrize("codec, version", [("none", FORMAT_V1), ("none", FORMAT_V2), ("zlib", FORMAT_V2)])
+def test_header_and_chunks_rebuild_serialisation(codec, version):
+    card = get_card()
+    card.encrypt_card(codec)
+    header = card.serialise_header(version)
+    name, creator, image_offset, image_size = Card.parse_header(header)
+    chunks = list(card.iter_image_chunks(1000))
+    assert (name, creator) == (card.name, card.creator)
+    assert sum(len(chunk) for chunk in chunks) == image_size
+    assert header[:image_offset] + b"".join(chunks) + header[image_offset:] == card.serialise(version)
+
+
+def test_raw_image_is_crypted_in_place():
+    card = get_card()
+    image_data = card.image.image.tobytes()
+    card.encrypt_card()
+    pixel_data = card.image.pixel_data
+    card2 = Card.deserialize(card.serialise())
+    assert card2.image.pixel_data == pixel_data
+    assert card2.decrypt_card(SOLUTION)
+    # Neither side needed a PIL image, and the pixels never left their buffer.
+    assert card.image._image is None and card2.image._image is None
+    assert card.image.pixel_data is pixel_data
+    assert card2.image.pixel_data == image_data
+    assert card2.image.image.tobytes() == image_data
+
+
+def test_v1_refuses_compressed_images():
+    card = get_card()
+    card.encrypt_card("zlib")
+    with pytest.raises(ValueError):
+        card.serialise(FORMAT_V1)
+
+
+@pytest.mark.parametrize("image_format, codec", [(None, "none"), ("JPEG", "zlib"), ("PNG", "none")])
+def test_encoded_image_round_trip(image_format, codec):
+    card = Card.create_from_path(name="test", creator="testy mctestface", path=str(TEST_IMAGE_PATH),
+                                 riddle="i <3 tests", solution=SOLUTION, encoded=True, image_format=image_format)
+    image_size = card.image.get_size()
+    if image_format is None:
+        # The file is sent as it is.
+        assert card.image.image_format == "JPEG"
+        assert card.image.encoded_data == TEST_IMAGE_PATH.read_bytes()
+    card.encrypt_card(codec)
+    with pytest.raises(ValueError):
+        card.serialise(FORMAT_V1)
+    serialisation = card.serialise()
+    header = card.serialise_header()
+    _, _, image_offset, _ = Card.parse_header(header)
+    assert header[:image_offset] + b"".join(card.iter_image_chunks(1000)) + header[image_offset:] == serialisation
+    card2 = Card.deserialize(serialisation)
+    assert card2.image.image_format == card.image.image_format
+    assert card2.decrypt_card(SOLUTION)
+    # The image is only decoded once it's accessed.
+    assert card2.image._image is None
+    assert card2.image.image.format == card.image.image_format
+    assert card2.image.image.size == image_size
+
+
+@pytest.mark.parametrize("version", [FORMAT_V1, FORMAT_V2])
+def test_card_view(version):
+    card = get_card()
+    card.encrypt_card()
+    serialisation = card.serialise(version)
+    card_view = CardView(serialisation)
+    assert card_view.version == version
+    assert (card_view.name, card_view.creator, card_view.riddle) == (card.name, card.creator, card.riddle)
+    assert card_view.key_hash == card.image.key_hash
+    assert card_view.image_size == card.image.image.size
+    assert card_view.get_field("image") == card.image.image.tobytes()
+    assert card_view.get_field("image").obj is serialisation
+
+
+def test_card_view_bounds():
+    card = get_card()
+    card.encrypt_card()
+    with pytest.raises(ValueError):
+        CardView(card.serialise()[:-1])
+
+
+@pytest.mark.parametrize("codec, version", [("none", FORMAT_V1), ("none", FORMAT_V2), ("zlib", FORMAT_V2)])
+def test_card_summary(tmp_path, codec, version):
+    card = get_card()
+    image_data = card.image.image.tobytes()
+    card.encrypt_card(codec)
+    card_path = tmp_path / "card"
+    card_path.write_bytes(card.serialise(version))
+    summary = CardSummary.from_path(card_path)
+    assert (summary.name, summary.creator, summary.riddle) == (card.name, card.creator, card.riddle)
+    assert summary.key_hash == card.image.key_hash
+    assert summary.image_size == card.image.get_size()
+    assert not summary.decrypt_card("wrong" * 4)
+    # A wrong key is caught by the key_hash, without reading the image.
+    assert summary._card is None
+    assert summary.decrypt_card(SOLUTION)
+    assert summary.solution == SOLUTION
+    assert summary.image.image.tobytes() == image_data
+
+
+
+@pytest.mark.parametrize("codec", ["none", "zlib"])
+def test_decrypting_twice_leaves_the_image_be(tmp_path, codec):
+    card = get_card()
+    image_data = card.image.image.tobytes()
+    card.encrypt_card(codec)
+    card_path = tmp_path / "card"
+    card_path.write_bytes(card.serialise())
+    summary = CardSummary.from_path(card_path)
+    # A card that's solved again (picked again in the solver, say) is already decrypted.
+    assert summary.decrypt_card(SOLUTION) and summary.decrypt_card(SOLUTION)
+    assert not summary.decrypt_card("wrong" * 4)
+    assert summary.image.image.tobytes() == image_data
+
+
+def test_lazy_images(tmp_path, monkeypatch):
+    cache = DecodedImageCache(max_images=1)
+    monkeypatch.setattr(game.crypt_image, "DECODED_IMAGES", cache)
+    image_path = tmp_path / "cheese.jpg"
+    image_path.write_bytes(TEST_IMAGE_PATH.read_bytes())
+    cards = [Card.create_from_path("test", "testy mctestface", str(image_path), "i <3 tests", "test" * 4, lazy=True)
+             for _ in range(2)]
+    # Nothing is opened until the image is needed.
+    image_path.unlink()
+    with pytest.raises(FileNotFoundError):
+        cards[0].image.image
+    image_path.write_bytes(TEST_IMAGE_PATH.read_bytes())
+    assert cards[0].image.get_size() == cards[1].image.get_size()
+    assert cards[0].image.image is cards[1].image.image
+    assert cache.get_stats() == {"images": 1, "size": get_image_size(cards[0].image.image), "hits": 1, "misses": 1,
+                                 "evictions": 0}
+    # The image's a copy once it's encrypted, the cached image is left as it is.
+    cards.append(Card.create_from_path("test", "testy mctestface", str(image_path), "i <3 tests", "test" * 4,
+                                       lazy=True))
+    cards[2].encrypt_card()
+    assert cards[2].decrypt_card("test" * 4)
+    assert cards[2].image.image.tobytes() == cards[1].image.image.tobytes()
+    cards[0].encrypt_card()
+    assert cards[0].decrypt_card("test" * 4)
+    assert cards[0].image.image.tobytes() == cards[1].image.image.tobytes()
+
+
+def test_decoded_images_are_bounded_by_bytes(tmp_path):
+    image_paths = []
+    for i in range(3):
+        image_path = tmp_path / f"image{i}.png"
+        Image.new("RGB", (100, 100)).save(image_path)
+        image_paths.append(str(image_path))
+    image_size = 100 * 100 * 3
+    cache = DecodedImageCache(max_size=image_size * 2)
+    for image_path in image_paths:
+        cache.get_image(image_path)
+    stats = cache.get_stats()
+    assert stats["images"] == 2 and stats["size"] == image_size * 2 and stats["evictions"] == 1
+    # An image that doesn't fit at all isn't cached.
+    small_cache = DecodedImageCache(max_size=image_size - 1)
+    assert small_cache.get_image(image_paths[0]).size == (100, 100)
+    assert small_cache.get_stats()["images"] == 0
+
+
+@pytest.mark.parametrize("mode", ["L", "P", "RGBA"])
+def test_images_of_other_modes_are_kept_as_rgb(tmp_path, mode):
+    image_path = tmp_path / "image.png"
+    game.crypt_image.Image.open(TEST_IMAGE_PATH).convert(mode).save(image_path)
+    card = Card.create_from_path(name="test", creator="testy mctestface", path=str(image_path),
+                                 riddle="i <3 tests", solution=SOLUTION)
+    image_data = card.image.image.convert('RGB').tobytes()
+    card.encrypt_card()
+    card2 = Card.deserialize(card.serialise())
+    assert card2.decrypt_card(SOLUTION)
+    assert card2.image.image.tobytes() == image_data
@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+from pathlib import Path
+
+from backend.data_management.card_cache import CardCache, get_card_size, ENTRY_OVERHEAD
+from backend.data_management.driver_manager import DriverManager
+from backend.data_management.saver import Saver
+from game.card import Card
+
+TEST_IMAGE_PATH = Path(__file__).parent.parent / "networking" / "cheese.jpg"
+
+
+def get_card(name: str, creator: str) -> Card:
+    return Card.create_from_path(name, creator, str(TEST_IMAGE_PATH), "i <3 tests", "test" * 4, lazy=True)
+
+
+class StandInDriver:
+    """
+    Stands in for the Saver's driver, counting the queries that get to it.
+    """
+
+    def __init__(self):
+        self.cards = []
+        self.queries = 0
+
+    def save_solved_card(self, card: Card) -> bool:
+        self.cards.append(card)
+        return True
+
+    def get_solved_cards(self, name: str = None, creator: str = None) -> list[Card]:
+        self.queries += 1
+        return [card for card in self.cards
+                if (name is None or card.name == name) and (creator is None or card.creator == creator)]
+
+
+def test_cache_is_bounded_by_bytes():
+    cards = [get_card(f"card{i}", "alice") for i in range(3)]
+    entry_size = get_card_size(cards[0]) + ENTRY_OVERHEAD
+    cache = CardCache(max_size=entry_size * 2)
+    for card in cards:
+        cache.put((True, card.creator, card.name), [card])
+    assert cache.get((True, "alice", "card0")) is None
+    assert cache.get((True, "alice", "card2")) == [cards[2]]
+    # Loading a cached card's image makes it bigger, which evicts the card that was least recently used.
+    cards[2].image.image.load()
+    assert cache.get((True, "alice", "card2")) == [cards[2]]
+    assert cache.get((True, "alice", "card1")) is None
+    assert cache.get_stats()["evictions"] == 3
+
+
+def test_empty_results_take_up_room():
+    cache = CardCache(max_size=ENTRY_OVERHEAD * 10)
+    for i in range(100):
+        cache.put((True, "alice", f"missing{i}"), [])
+    assert cache.get_stats()["entries"] == 10
+    assert cache.get((True, "alice", "missing99")) == []
+
+
+def test_results_expire(monkeypatch):
+    now = [1000.0]
+    # Only the cache's clock is stood in for, not the time module's.
+    monkeypatch.setattr("backend.data_management.card_cache.time", SimpleNamespace(monotonic=lambda: now[0]))
+    card = get_card("first", "alice")
+    cache = CardCache(ttl=60)
+    cache.put((True, "alice", "first"), [card])
+    now[0] += 30
+    assert cache.get((True, "alice", "first")) == [card]
+    # Getting a result doesn't keep it from expiring.
+    now[0] += 31
+    assert cache.get((True, "alice", "first")) is None
+    stats = cache.get_stats()
+    assert stats["expirations"] == 1 and stats["entries"] == 0 and stats["size"] == 0
+
+
+def test_saver_invalidates_on_save(tmp_path, monkeypatch):
+    monkeypatch.setattr(DriverManager, "get_default_driver", lambda self: StandInDriver())
+    monkeypatch.setattr("backend.data_management.saver.CREATORS_FILE", tmp_path / "creators.txt")
+    monkeypatch.setattr("backend.data_management.saver._creator_registry", None)
+    saver = Saver()
+    assert saver.save(get_card("first", "alice"), True)
+    for _ in range(3):
+        assert [card.name for card in saver.find_cards(True, creator="alice", name="first")] == ["first"]
+        assert [card.name for card in saver.find_cards(True, creator="alice")] == ["first"]
+    assert saver.driver.queries == 2
+    assert saver.save(get_card("second", "alice"), True)
+    assert [card.name for card in saver.find_cards(True, creator="alice")] == ["first", "second"]
+    # The card that was saved isn't in the cached result of the first card.
+    assert [card.name for card in saver.find_cards(True, creator="alice", name="first")] == ["first"]
+    assert saver.driver.queries == 3
+    assert saver.card_cache.get_stats()["invalidations"] == 1
+    assert saver.card_cache.get_stats()["hits"] == 5
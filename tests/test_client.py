@@ -19,6 +19,11 @@ class MockSocket:
     def send(self, data):
         self.sent_data.append(data)
 
+    def sendmsg(self, buffers):
+        data = b"".join(buffers)
+        self.sent_data.append(data)
+        return len(data)
+
     def recv(self, size):
         if self.already_received:
             return b""
@@ -0,0 +1,70 @@
+import pytest
+import socket
+import struct
+import threading
+import asyncio
+
+from networking.connection import Connection
+from networking.async_connection import AsyncConnection
+from exceptions import DisconnectionException
+
+
+@pytest.fixture
+def connection_pair():
+    left, right = socket.socketpair()
+    with Connection(left) as sender, Connection(right) as receiver:
+        yield sender, receiver
+
+
+def test_round_trip(connection_pair):
+    sender, receiver = connection_pair
+    sender.send_message(b"hello")
+    assert receiver.receive_message() == b"hello"
+
+
+def test_large_message(connection_pair):
+    sender, receiver = connection_pair
+    # Bigger than any socket buffer, so both sides have to loop.
+    message = bytes(range(256)) * (2**14)
+    sending_thread = threading.Thread(target=sender.send_message, args=[message])
+    sending_thread.start()
+    received = receiver.receive_message()
+    sending_thread.join()
+    assert received == message
+
+
+def test_empty_message(connection_pair):
+    sender, receiver = connection_pair
+    sender.send_message(b"")
+    sender.send_message(b"after")
+    assert receiver.receive_message() == b""
+    assert receiver.receive_message() == b"after"
+
+
+def test_length_prefix_format(connection_pair):
+    sender, receiver = connection_pair
+    sender.send_message(b"abc")
+    assert receiver._receive_exact(7) == struct.pack(">i3s", 3, b"abc")
+
+
+def test_disconnection(connection_pair):
+    sender, receiver = connection_pair
+    sender.sock.sendall(struct.pack(">i", 10) + b"short")
+    sender.sock.shutdown(socket.SHUT_WR)
+    with pytest.raises(DisconnectionException):
+        receiver.receive_message()
+
+
+def test_async_round_trip(connection_pair):
+    sender, receiver = connection_pair
+
+    async def receive_and_reply():
+        reader, writer = await asyncio.open_connection(sock=receiver.sock)
+        async_connection = AsyncConnection(reader, writer)
+        message = await async_connection.receive_message()
+        await async_connection.send_message(message[::-1])
+        return message
+
+    sender.send_message(b"async")
+    assert asyncio.run(receive_and_reply()) == b"async"
+    assert sender.receive_message() == b"cnysa"
@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor
+import fcntl
+import time
+
+from backend.data_management.creator_registry import CreatorRegistry, LOCK_SUFFIX
+
+
+def test_creators_are_added_once(tmp_path):
+    log_path = tmp_path / "data" / "creators.txt"
+    registry = CreatorRegistry(log_path)
+    with ThreadPoolExecutor(8) as executor:
+        added = list(executor.map(registry.add, ["alice", "bob"] * 8))
+    assert added.count(True) == 2
+    assert "alice" in registry and "carol" not in registry
+    assert registry.get_creators() in (["alice", "bob"], ["bob", "alice"])
+    assert sorted(log_path.read_text().split()) == ["alice", "bob"]
+    # A new registry gets its creators from the log.
+    assert sorted(CreatorRegistry(log_path).get_creators()) == ["alice", "bob"]
+
+
+def test_compaction(tmp_path):
+    log_path = tmp_path / "creators.txt"
+    log_path.write_text("alice\nbob\n\nalice\nbob")
+    registry = CreatorRegistry(log_path)
+    assert registry.get_creators() == ["alice", "bob"]
+    assert log_path.read_text() == "alice\nbob\n"
+    # Creators appended by someone else are picked up by the next compaction.
+    with open(log_path, mode="a") as log_file:
+        log_file.write("carol\nalice\n")
+    assert registry.compact() == 1
+    assert registry.get_creators() == ["alice", "bob", "carol"]
+    assert log_path.read_text() == "alice\nbob\ncarol\n"
+    assert registry.compact() == 0
+
+
+def test_log_is_locked_while_changed(tmp_path):
+    log_path = tmp_path / "creators.txt"
+    registry = CreatorRegistry(log_path)
+    # Stands in for another process holding the log, compacting it say.
+    with open(tmp_path / ("creators.txt" + LOCK_SUFFIX), mode="a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        with ThreadPoolExecutor(1) as executor:
+            added = executor.submit(registry.add, "alice")
+            time.sleep(0.1)
+            assert not added.done() and not log_path.exists()
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            assert added.result()
+    assert log_path.read_text() == "alice\n"
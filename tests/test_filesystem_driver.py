@@ -0,0 +1,158 @@
+from pathlib import Path
+import pytest
+
+from backend.data_management.drivers.filesystem_driver import FilesystemDriver
+from game.card_summary import CardSummary
+from game.card import Card
+
+TEST_IMAGE_PATH = Path(__file__).parent.parent / "networking" / "cheese.jpg"
+SOLUTION = "test" * 4
+
+
+def get_card(name: str, creator: str) -> Card:
+    card = Card.create_from_path(name=name, creator=creator, path=str(TEST_IMAGE_PATH), riddle="i <3 tests",
+                                 solution=SOLUTION)
+    card.encrypt_card("zlib")
+    return card
+
+
+@pytest.fixture
+def driver(tmp_path) -> FilesystemDriver:
+    (tmp_path / "solved").mkdir()
+    (tmp_path / "unsolved").mkdir()
+    return FilesystemDriver(solved_dir=tmp_path / "solved", unsolved_dir=tmp_path / "unsolved")
+
+
+def test_unsolved_queries(driver):
+    assert driver.save_unsolved_card(get_card("first", "alice"))
+    assert driver.save_unsolved_serialisation(get_card("second", "alice").serialise())
+    writer = driver.open_unsolved_card_writer("third", "bob")
+    writer.write(get_card("third", "bob").serialise())
+    assert writer.commit()
+    assert [card.name for card in driver.get_unsolved_cards_by_creator("alice")] == ["first", "second"]
+    assert [card.creator for card in driver.get_unsolved_card_by_name("third")] == ["bob"]
+    assert len(driver.get_unsolved_card_by_name()) == 3
+    # Cards removed behind the driver's back are dropped.
+    (driver.unsolved_dir / "alicefirst").unlink()
+    assert [card.name for card in driver.get_unsolved_cards_by_creator("alice")] == ["second"]
+    with pytest.raises(FileNotFoundError):
+        driver.get_unsolved_card_by_name("first")
+
+
+def test_solved_queries(driver):
+    for name, creator in [("first", "alice"), ("second", "bob")]:
+        card = Card.deserialize(get_card(name, creator).serialise())
+        assert card.decrypt_card(SOLUTION)
+        assert driver.save_solved_card(card)
+    assert [card.name for card in driver.get_solved_cards_by_creator("bob")] == ["second"]
+    assert [card.creator for card in driver.get_solved_card_by_name("first")] == ["alice"]
+    assert [card.name for card in driver.get_solved_cards()] == ["first", "second"]
+    assert driver.get_solved_cards(name="first", creator="bob") == []
+
+
+def test_reindex(driver):
+    driver.save_unsolved_card(get_card("first", "alice"))
+    (driver.unsolved_dir / "bobsecond").write_bytes(get_card("second", "bob").serialise())
+    assert driver.reindex() == 2
+    assert [card.name for card in driver.get_unsolved_cards_by_creator("bob")] == ["second"]
+    # A new index is built from the cards already in the directories.
+    new_driver = FilesystemDriver(driver.solved_dir, driver.unsolved_dir, driver.unsolved_dir / ".other_index")
+    assert len(new_driver.get_unsolved_card_by_name()) == 2
+
+
+def test_solved_images_are_deduplicated(driver):
+    for name, creator in [("first", "alice"), ("second", "bob")]:
+        card = Card.deserialize(get_card(name, creator).serialise())
+        assert card.decrypt_card(SOLUTION)
+        assert driver.save_solved_card(card)
+    # A card saved from its image file keeps the file as is, rather than as PNG.
+    card = Card.create_from_path("third", "carol", str(TEST_IMAGE_PATH), "i <3 tests", SOLUTION)
+    assert driver.save_solved_card(card)
+    first, second = driver.get_solved_cards_by_creator("alice")[0], driver.get_solved_cards_by_creator("bob")[0]
+    assert first.image_digest == second.image_digest
+    assert first.image.image.tobytes() == second.image.image.tobytes()
+    stats = driver.blob_store.get_stats()
+    assert stats["blobs"] == 2 and stats["referenced_size"] > stats["stored_size"]
+    assert driver.blob_store.get_refs(first.image_digest) == 2
+
+    assert driver.remove_solved_card("first")
+    assert driver.blob_store.get_path(first.image_digest).exists()
+    assert driver.remove_solved_card("second")
+    assert not driver.blob_store.get_path(first.image_digest).exists()
+    assert not driver.remove_solved_card("second")
+    assert [card.name for card in driver.get_solved_cards()] == ["third"]
+
+
+def test_iter_cards(driver):
+    names = [f"card{i}" for i in range(5)]
+    for name in names:
+        driver.save_unsolved_card(get_card(name, "alice"))
+    driver.save_unsolved_card(get_card("card2", "bob"))
+    cards = list(driver.iter_unsolved_cards(batch_size=2))
+    assert [(card.name, card.creator) for card in cards] == \
+           [("card0", "alice"), ("card1", "alice"), ("card2", "alice"), ("card2", "bob"), ("card3", "alice"),
+            ("card4", "alice")]
+    # Resuming after the last card seen, a page at a time.
+    page = list(driver.iter_unsolved_cards(creator="alice", batch_size=2, after=("card1", "alice"), limit=2))
+    assert [card.name for card in page] == ["card2", "card3"]
+    assert [card.creator for card in driver.iter_unsolved_cards(name="card2", after=("card2", "alice"))] == ["bob"]
+    assert list(driver.iter_solved_cards()) == []
+
+
+def test_unsolved_cards_put_in_without_the_driver(driver, monkeypatch):
+    driver.save_unsolved_card(get_card("first", "alice"))
+    (driver.unsolved_dir / "bobsecond").write_bytes(get_card("second", "bob").serialise())
+    reads = []
+    from_path = CardSummary.from_path
+
+    def counting_from_path(path: Path) -> CardSummary:
+        reads.append(path.name)
+        return from_path(path)
+    monkeypatch.setattr(CardSummary, "from_path", counting_from_path)
+
+    # Only the card that isn't in the index is read, the rest are listed from the index.
+    assert [card.name for card in driver.get_unsolved_card_by_name()] == ["first", "second"]
+    assert reads == ["bobsecond"]
+    assert not driver.refresh_unsolved()
+    # A card changed in place is read again.
+    (driver.unsolved_dir / "bobsecond").write_bytes(get_card("third", "bob").serialise())
+    assert [card.name for card in driver.get_unsolved_cards_by_creator("bob")] == ["third"]
+    assert reads == ["bobsecond", "bobsecond"]
+    card = driver.get_unsolved_cards_by_creator("bob")[0]
+    assert card.decrypt_card(SOLUTION)
+
+
+def test_unsolved_directory_is_listed_once(driver, monkeypatch):
+    driver.save_unsolved_card(get_card("first", "alice"))
+    listings = []
+    iter_paths = FilesystemDriver._iter_unsolved_card_paths
+
+    def counting_iter_paths(self):
+        listings.append(self)
+        return iter_paths(self)
+    monkeypatch.setattr(FilesystemDriver, "_iter_unsolved_card_paths", counting_iter_paths)
+
+    for _ in range(3):
+        assert [card.name for card in driver.get_unsolved_card_by_name("first")] == ["first"]
+    assert len(listings) == 1
+    # Cards put in without the driver since are only found by an explicit refresh.
+    (driver.unsolved_dir / "bobsecond").write_bytes(get_card("second", "bob").serialise())
+    assert driver.get_unsolved_cards_by_creator("bob") == []
+    assert driver.refresh_unsolved()
+    assert [card.name for card in driver.get_unsolved_cards_by_creator("bob")] == ["second"]
+
+
+def test_new_index_is_built_as_it_is_listed(driver):
+    for name in ["first", "second", "third"]:
+        (driver.unsolved_dir / f"alice{name}").write_bytes(get_card(name, "alice").serialise())
+    # Opening a driver on a new index doesn't read the unsolved cards.
+    new_driver = FilesystemDriver(driver.solved_dir, driver.unsolved_dir, driver.unsolved_dir / ".new_index")
+    assert new_driver.index.find(solved=False) == []
+    cards = new_driver.iter_refreshed_unsolved_cards(workers=1, batch_size=1)
+    # The first card is yielded once it's indexed, before the rest are.
+    first = next(cards)
+    assert len(new_driver.index.find(solved=False)) == 1
+    assert sorted([first.name] + [card.name for card in cards]) == ["first", "second", "third"]
+    assert len(new_driver.index.find(solved=False)) == 3
+    assert not new_driver.refresh_unsolved()
+    new_driver.close()
@@ -0,0 +1,86 @@
+from pathlib import Path
+import pytest
+
+from backend.api.image_cache import RenderedImageCache, RenderedImage, get_card_image_key, render_card_image, \
+    make_image_response, parse_byte_range
+from game.card import Card
+
+TEST_IMAGE_PATH = Path(__file__).parent.parent / "networking" / "cheese.jpg"
+
+
+def test_images_spill_to_disk(tmp_path):
+    cache = RenderedImageCache(max_memory_size=100, spill_dir=tmp_path / "spill", max_disk_size=100)
+    renders = []
+
+    def render(key):
+        renders.append(key)
+        return bytes([key]) * 60
+
+    images = [cache.get(key, lambda: render(key)) for key in range(3)]
+    # Only the last image fits in memory, the one before it was spilled, and the first was dropped from the disk too.
+    assert cache.get_stats()["memory_images"] == 1 and cache.get_stats()["disk_images"] == 1
+    spilled = cache.get(1, lambda: render(1))
+    assert spilled.data == images[1].data and spilled.etag == images[1].etag
+    assert cache.get(0, lambda: render(0)).data == images[0].data
+    assert renders == [0, 1, 2, 0]
+    assert cache.get_stats()["disk_hits"] == 1
+
+    cache.close()
+
+
+def test_caches_share_a_spill_dir(tmp_path):
+    spill_dir = tmp_path / "spill"
+    caches = [RenderedImageCache(max_memory_size=10, spill_dir=spill_dir) for _ in range(2)]
+    for i, cache in enumerate(caches):
+        cache.get("image", lambda: bytes([i]) * 20)
+    # Each cache spilled to a directory of its own, and closing one leaves the other's be.
+    assert caches[0].spill_dir != caches[1].spill_dir and len(list(spill_dir.iterdir())) == 2
+    caches[0].close()
+    assert list(spill_dir.iterdir()) == [caches[1].spill_dir]
+    assert caches[1].get("image", lambda: pytest.fail("rendered again")).data == bytes([1]) * 20
+    # An image whose file is gone is rendered again.
+    for spilled_path in caches[1].spill_dir.iterdir():
+        spilled_path.unlink()
+    assert caches[1].get("image", lambda: b"again").data == b"again"
+    assert caches[1].get_stats()["disk_images"] == 0
+    caches[1].close()
+
+
+def test_card_image_is_rendered_once():
+    card = Card.create_from_path("test", "testy mctestface", str(TEST_IMAGE_PATH), "i <3 tests", "test" * 4,
+                                 lazy=True)
+    cache = RenderedImageCache()
+    key = get_card_image_key(card, "JPEG")
+    first = cache.get(key, lambda: render_card_image(card, "JPEG"))
+    assert first.data.startswith(b"\xff\xd8")
+    assert cache.get(key, lambda: pytest.fail("rendered again")) is first
+
+
+def test_conditional_and_range_responses():
+    rendered = RenderedImage(bytes(range(100)))
+    response = make_image_response(rendered, {}, "image/jpeg")
+    assert response.status_code == 200 and response.body == rendered.data
+    assert response.headers["etag"] == rendered.etag and "max-age" in response.headers["cache-control"]
+
+    assert make_image_response(rendered, {"if-none-match": rendered.etag}, "image/jpeg").status_code == 304
+    assert make_image_response(rendered, {"if-none-match": f'"other", W/{rendered.etag}'},
+                               "image/jpeg").status_code == 304
+    assert make_image_response(rendered, {"if-none-match": '"other"'}, "image/jpeg").status_code == 200
+
+    response = make_image_response(rendered, {"range": "bytes=10-19"}, "image/jpeg")
+    assert response.status_code == 206 and response.body == bytes(range(10, 20))
+    assert response.headers["content-range"] == "bytes 10-19/100"
+    assert make_image_response(rendered, {"range": "bytes=-5"}, "image/jpeg").body == bytes(range(95, 100))
+    assert make_image_response(rendered, {"range": "bytes=200-"}, "image/jpeg").status_code == 416
+    # A range of a different version of the image gets the whole (current) image.
+    assert make_image_response(rendered, {"range": "bytes=10-19", "if-range": '"old"'},
+                               "image/jpeg").status_code == 200
+
+
+def test_parse_byte_range():
+    assert parse_byte_range("bytes=0-", 10) == (0, 9)
+    assert parse_byte_range("bytes=5-100", 10) == (5, 9)
+    assert parse_byte_range("bytes=0-1,5-6", 10) is None
+    assert parse_byte_range("lines=0-1", 10) is None
+    with pytest.raises(ValueError):
+        parse_byte_range("bytes=5-4", 10)
@@ -0,0 +1,113 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import pytest
+import struct
+import zlib
+
+from backend.data_management.drivers.filesystem_driver import FilesystemDriver, JOURNAL_FILE_NAME
+from backend.data_management.drivers.ingest_journal import IngestJournal, RECORD_HEADER_FORMAT
+from game.card import Card
+from exceptions import StoreInUseException
+
+TEST_IMAGE_PATH = Path(__file__).parent.parent / "networking" / "cheese.jpg"
+
+
+def get_card(name: str) -> Card:
+    card = Card.create_from_path(name=name, creator="testy mctestface", path=str(TEST_IMAGE_PATH),
+                                 riddle="i <3 tests", solution="test" * 4)
+    card.encrypt_card("zlib")
+    return card
+
+
+def get_records(records: list[bytes]) -> bytes:
+    return b"".join(struct.pack(RECORD_HEADER_FORMAT, len(data), zlib.crc32(data)) + data for data in records)
+
+
+def test_group_commit(tmp_path):
+    applied = []
+    synced_sizes = []
+    journal = IngestJournal(tmp_path / "journal", applied.append, batch_size=8, batch_interval=1,
+                            sync=lambda: synced_sizes.append((tmp_path / "journal").stat().st_size))
+    journal.start()
+    with ThreadPoolExecutor(16) as executor:
+        list(executor.map(journal.submit, [bytes([i]) * 10 for i in range(32)]))
+    journal.flush()
+    stats = journal.get_stats()
+    assert stats["submitted"] == stats["committed"] == stats["applied"] == 32
+    # Submitters waited on each other's fsync instead of each doing its own.
+    assert stats["batches"] < 32
+    assert sorted(applied) == sorted(bytes([i]) * 10 for i in range(32))
+    journal.close()
+    # Everything was applied (and synced before the journal was emptied), so there's nothing left to replay.
+    assert synced_sizes and all(synced_sizes)
+    assert (tmp_path / "journal").stat().st_size == 0
+
+
+def test_replay_drops_torn_tail(tmp_path):
+    records = [b"first", b"second"]
+    journal_data = get_records(records)
+    # A record whose write was cut off by a crash.
+    journal_data += struct.pack(RECORD_HEADER_FORMAT, 100, 0) + b"third"
+    (tmp_path / "journal").write_bytes(journal_data)
+    applied = []
+    assert IngestJournal(tmp_path / "journal", applied.append).replay() == 2
+    assert applied == records
+    assert (tmp_path / "journal").stat().st_size == 0
+
+
+def test_replay_keeps_the_journal_on_failure(tmp_path):
+    records = [b"first", b"broken", b"third"]
+    (tmp_path / "journal").write_bytes(get_records(records) + struct.pack(RECORD_HEADER_FORMAT, 100, 0))
+    applied = []
+
+    def apply(data: bytes):
+        if data == b"broken":
+            raise ValueError("Can't apply this one")
+        applied.append(data)
+    # The replay stops at the card that failed, and only the uncommitted tail is dropped.
+    assert IngestJournal(tmp_path / "journal", apply).replay() == 1
+    assert applied == [b"first"]
+    assert (tmp_path / "journal").read_bytes() == get_records(records)
+    assert IngestJournal(tmp_path / "journal", applied.append).replay() == 3
+    assert (tmp_path / "journal").stat().st_size == 0
+
+
+def test_journal_has_a_single_owner(tmp_path):
+    def fail(data: bytes):
+        raise ValueError("Kept in the journal")
+    journal = IngestJournal(tmp_path / "journal", fail)
+    journal.start()
+    journal.submit(b"first")
+    journal.flush()
+    with pytest.raises(StoreInUseException):
+        IngestJournal(tmp_path / "journal", fail).start()
+    # The journal's cards are left to the journal that's writing it.
+    applied = []
+    assert IngestJournal(tmp_path / "journal", applied.append).replay() == 0
+    assert applied == [] and (tmp_path / "journal").read_bytes() == get_records([b"first"])
+    journal.close()
+    assert IngestJournal(tmp_path / "journal", applied.append).replay() == 1
+    assert applied == [b"first"]
+
+
+def test_journaled_driver(tmp_path):
+    driver = FilesystemDriver(solved_dir=tmp_path, unsolved_dir=tmp_path, use_journal=True,
+                              journal_batch_size=4, journal_batch_interval=0.05)
+    serialisations = [get_card(f"card{i}").serialise() for i in range(6)]
+    with ThreadPoolExecutor(6) as executor:
+        assert all(executor.map(driver.save_unsolved_serialisation, serialisations))
+    # A card still waiting in the journal is a duplicate too.
+    assert not driver.save_unsolved_serialisation(serialisations[0])
+    driver.flush()
+    assert sorted(card.name for card in driver.get_unsolved_card_by_name()) == [f"card{i}" for i in range(6)]
+    driver.close()
+
+    # Cards left in the journal by a crash are saved when the directory is opened again.
+    card = get_card("crashed")
+    serialisation = card.serialise()
+    with open(tmp_path / JOURNAL_FILE_NAME, mode="ab") as journal_file:
+        journal_file.write(struct.pack(RECORD_HEADER_FORMAT, len(serialisation), zlib.crc32(serialisation)))
+        journal_file.write(serialisation)
+    driver = FilesystemDriver(solved_dir=tmp_path, unsolved_dir=tmp_path)
+    assert driver.get_unsolved_card_by_name("crashed")[0].load_card().riddle == card.riddle
+    driver.close()
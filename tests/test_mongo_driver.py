@@ -0,0 +1,97 @@
+from pathlib import Path
+
+from backend.data_management.drivers.mongo_driver import MongoDriver
+from game.card import Card
+
+TEST_IMAGE_PATH = Path(__file__).parent.parent / "networking" / "cheese.jpg"
+
+INDEXED_PLAN = {"queryPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "name_creator"}}}
+UNINDEXED_PLAN = {"stage": "PROJECTION_SIMPLE", "inputStage": {"stage": "COLLSCAN"}}
+
+
+class StandInCursor:
+    def __init__(self, query):
+        self.query = query
+
+    def explain(self):
+        # Stands in for a collection that only has the name index.
+        plan = INDEXED_PLAN if "name" in self.query else UNINDEXED_PLAN
+        return {"queryPlanner": {"winningPlan": plan},
+                "executionStats": {"totalKeysExamined": 1, "totalDocsExamined": 1}}
+
+
+class StandInCollection:
+    def __init__(self):
+        self.documents = []
+
+    def find(self, query, projection=None):
+        return StandInCursor(query)
+
+    def insert_one(self, document):
+        self.documents.append(document)
+
+
+class StandInCardCollection(StandInCollection):
+    """
+    Stands in for a collection of cards, recording the indexes made on it and the projections it's queried with.
+    """
+
+    def __init__(self, documents):
+        super().__init__()
+        self.documents = documents
+        self.indexes = []
+        self.projections = []
+
+    def create_indexes(self, indexes):
+        self.indexes += indexes
+
+    def find(self, query, projection=None):
+        self.projections.append(projection)
+        return [{field: document[field] for field in projection if projection[field] and field in document}
+                for document in self.documents if all(document[key] == value for key, value in query.items())]
+
+
+def test_plan_stages():
+    assert MongoDriver._get_plan_stages(INDEXED_PLAN) == ["FETCH", "IXSCAN"]
+    assert MongoDriver._get_plan_stages({"stage": "OR", "inputStages": [UNINDEXED_PLAN, INDEXED_PLAN]}) == \
+           ["OR", "PROJECTION_SIMPLE", "COLLSCAN", "FETCH", "IXSCAN"]
+
+
+def test_check_query_shapes():
+    # The client doesn't connect until it's used, and the collections are replaced before they are.
+    driver = MongoDriver("mongodb://127.0.0.1:1", "test", "unsolved", "solved", create_indexes=False)
+    driver.solved_cards_collection = driver.unsolved_cards_collection = StandInCollection()
+    unindexed = driver.check_query_shapes()
+    assert [explanation["query"] for explanation in unindexed] == [{"creator": ""}, {"creator": ""}]
+    assert unindexed[0]["stages"] == ["PROJECTION_SIMPLE", "COLLSCAN"] and not unindexed[0]["indexed"]
+    driver.close()
+
+
+def test_blob_store_is_opened_once_needed(tmp_path):
+    blob_dir = tmp_path / "blobs"
+    driver = MongoDriver("mongodb://127.0.0.1:1", "test", "unsolved", "solved", blob_dir=blob_dir,
+                         create_indexes=False)
+    assert driver.blob_store is None and not blob_dir.exists()
+    driver.solved_cards_collection = StandInCollection()
+    card = Card.create_from_path("first", "alice", str(TEST_IMAGE_PATH), "i <3 tests", "test" * 4)
+    assert driver.save_solved_card(card)
+    document = driver.solved_cards_collection.documents[0]
+    assert driver.blob_store.get_path(document["image_digest"]).exists()
+    driver.close()
+    assert driver.blob_store is None
+
+
+def test_indexes_are_made_before_the_first_query():
+    driver = MongoDriver("mongodb://127.0.0.1:1", "test", "unsolved", "solved")
+    document = {"name": "first", "creator": "alice", "riddle": "i <3 tests", "image_path": "cheese.jpg",
+                "solution": "test" * 4}
+    driver.solved_cards_collection = StandInCardCollection([document])
+    driver.unsolved_cards_collection = StandInCardCollection([])
+    assert driver.solved_cards_collection.indexes == []
+    # Listings only fetch the fields they're after.
+    assert driver.find_card_fields(True, ["name", "riddle"], creator="alice") == \
+           [{"name": "first", "riddle": "i <3 tests"}]
+    assert driver.solved_cards_collection.projections == [{"name": True, "riddle": True, "_id": False}]
+    driver.find_card_fields(True, ["name"])
+    assert len(driver.solved_cards_collection.indexes) == len(driver.unsolved_cards_collection.indexes) == 2
+    driver.close()
@@ -0,0 +1,125 @@
+from pathlib import Path
+import pytest
+
+from backend.data_management.drivers.filesystem_driver import FilesystemDriver
+from backend.data_management.drivers.pack_store import PackStore
+from game.solver import batch_solve
+from game.card import Card
+from exceptions import StoreInUseException
+
+TEST_IMAGE_PATH = Path(__file__).parent.parent / "networking" / "cheese.jpg"
+
+
+def test_pack_store_round_trip(tmp_path):
+    pack_store = PackStore(tmp_path, segment_size=100)
+    cards = {f"card{i}": bytes([i]) * 60 for i in range(6)}
+    for key, serialisation in cards.items():
+        assert pack_store.append(key, serialisation)
+    assert not pack_store.append("card0", b"duplicate")
+    # Every card went to a segment of its own, as two don't fit in one.
+    assert len(list(tmp_path.glob("*.pack"))) == 6
+    view = pack_store.get("card1")
+    assert isinstance(view, memoryview) and view == cards["card1"]
+    assert pack_store.remove("card1") and pack_store.remove("card2")
+    assert not pack_store.remove("card1")
+    pack_store.close()
+
+    # The sidecar indexes bring the cards back, without the removed ones.
+    pack_store = PackStore(tmp_path, segment_size=100)
+    assert sorted(pack_store.keys()) == ["card0", "card3", "card4", "card5"]
+    assert pack_store.get("card1") is None
+    assert pack_store.compact() == 2
+    assert len(list(tmp_path.glob("*.pack"))) == 4
+    # Views taken before compaction stay valid.
+    assert view == cards["card1"]
+    pack_store.close()
+    pack_store = PackStore(tmp_path, segment_size=100)
+    assert {key: bytes(pack_store.get(key)) for key in pack_store.keys()} == \
+           {key: cards[key] for key in ["card0", "card3", "card4", "card5"]}
+    pack_store.close()
+
+
+def test_compaction_moves_live_cards(tmp_path):
+    pack_store = PackStore(tmp_path, segment_size=200, compaction_threshold=0.5)
+    for i in range(3):
+        pack_store.append(f"card{i}", bytes([i]) * 60)
+    pack_store.append("card3", b"x" * 150)
+    pack_store.remove("card0")
+    pack_store.remove("card1")
+    assert pack_store.compact() == 1
+    assert bytes(pack_store.get("card2")) == bytes([2]) * 60
+    pack_store.close()
+    pack_store = PackStore(tmp_path)
+    assert sorted(pack_store.keys()) == ["card2", "card3"]
+    pack_store.close()
+
+
+def test_compaction_finishes_a_cut_off_one(tmp_path):
+    pack_store = PackStore(tmp_path, segment_size=100)
+    for i in range(3):
+        pack_store.append(f"card{i}", bytes([i]) * 60)
+    pack_store.remove("card0")
+    pack_store.close()
+    # A compaction that was cut off after it removed the segment's index left the segment behind, all of it removed.
+    (tmp_path / "000000.idx").unlink()
+    pack_store = PackStore(tmp_path, segment_size=100)
+    assert pack_store.compact() == 1
+    assert not (tmp_path / "000000.pack").exists()
+    assert sorted(pack_store.keys()) == ["card1", "card2"]
+    pack_store.close()
+
+
+def test_pack_directory_has_a_single_owner(tmp_path):
+    pack_store = PackStore(tmp_path)
+    with pytest.raises(StoreInUseException):
+        PackStore(tmp_path)
+    pack_store.close()
+    PackStore(tmp_path).close()
+
+
+def test_driver_with_packs(tmp_path):
+    driver = FilesystemDriver(tmp_path, tmp_path, use_packs=True)
+    for name in ["first", "second"]:
+        card = Card.create_from_path(name=name, creator="testy mctestface", path=str(TEST_IMAGE_PATH),
+                                     riddle="i <3 tests", solution="test" * 4)
+        card.encrypt_card("zlib")
+        if name == "first":
+            assert driver.save_unsolved_card(card)
+        else:
+            writer = driver.open_unsolved_card_writer(card.name, card.creator)
+            writer.write(card.serialise())
+            assert writer.commit()
+    assert not driver.save_unsolved_card(card)
+    # No file per card, and the card is read from the pack.
+    assert [path.name for path in tmp_path.iterdir() if not path.name.startswith(".")] == []
+    summaries = driver.get_unsolved_cards_by_creator("testy mctestface")
+    assert [summary.name for summary in summaries] == ["first", "second"]
+    assert summaries[1].decrypt_card("test" * 4)
+    assert driver.remove_unsolved_card("first", "testy mctestface")
+    driver.close()
+    # The pack directory marks the directory as packed.
+    driver = FilesystemDriver(tmp_path, tmp_path)
+    assert driver.reindex() == 1
+    assert [summary.name for summary in driver.get_unsolved_card_by_name()] == ["second"]
+    driver.close()
+
+
+def test_batch_solve_with_packs(tmp_path):
+    unsolved_dir, solved_dir = tmp_path / "unsolved", tmp_path / "solved"
+    solved_dir.mkdir()
+    driver = FilesystemDriver(solved_dir, unsolved_dir, use_packs=True)
+    for name, solution in [("first", "a" * 16), ("second", "b" * 16)]:
+        card = Card.create_from_path(name=name, creator="testy mctestface", path=str(TEST_IMAGE_PATH),
+                                     riddle="i <3 tests", solution=solution)
+        card.encrypt_card("zlib")
+        assert driver.save_unsolved_card(card)
+    # The solver can't open the packs while another driver (the server's) has them.
+    with pytest.raises(StoreInUseException):
+        batch_solve(unsolved_dir, solved_dir, ["a" * 16])
+    driver.close()
+
+    assert [card.name for card in batch_solve(unsolved_dir, solved_dir, ["a" * 16])] == ["first"]
+    driver = FilesystemDriver(solved_dir, unsolved_dir)
+    assert [card.name for card in driver.get_unsolved_card_by_name()] == ["second"]
+    assert [card.name for card in driver.get_solved_cards()] == ["first"]
+    driver.close()
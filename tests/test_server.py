@@ -0,0 +1,87 @@
+from pathlib import Path
+import threading
+import socket
+
+from networking.connection import Connection
+from networking.client import send_session, stream_card
+from networking import ingest, server
+from networking.protocol import REPLY_OK, REPLY_ERROR
+from game.card import Card
+
+TEST_IMAGE_PATH = Path(__file__).parent.parent / "networking" / "cheese.jpg"
+
+
+def fake_save_serialisation(card_serialisation: bytes, card_dir: Path) -> bool:
+    # Cards are stand-in bytes here, "dup" ones are refused like duplicates would be.
+    return not card_serialisation.startswith(b"dup")
+
+
+def test_pipelined_session(monkeypatch):
+    monkeypatch.setattr(ingest.Saver, "save_serialisation", fake_save_serialisation)
+    server_side, client_side = socket.socketpair()
+    server_thread = threading.Thread(target=server.manage_conn,
+                                     args=[Connection(server_side), Path("."), threading.Lock()])
+    server_thread.start()
+    cards = [b"card1", b"dup2", b"card3", b"card4", b"dup5"]
+    with Connection(client_side) as conn:
+        results = send_session(conn, cards, window=2)
+    server_thread.join()
+    assert results == [True, False, True, True, False]
+
+
+def test_single_card_reply(monkeypatch):
+    monkeypatch.setattr(ingest.Saver, "save_serialisation", fake_save_serialisation)
+    server_side, client_side = socket.socketpair()
+    server_thread = threading.Thread(target=server.manage_conn,
+                                     args=[Connection(server_side), Path("."), threading.Lock()])
+    server_thread.start()
+    with Connection(client_side) as conn:
+        conn.send_message(b"card")
+        assert conn.receive_message() == REPLY_OK
+    server_thread.join()
+
+
+def test_streamed_card(tmp_path):
+    card = Card.create_from_path("streamed", "testy mctestface", str(TEST_IMAGE_PATH), "i <3 tests", "test" * 4)
+    card.encrypt_card()
+    server_side, client_side = socket.socketpair()
+    server_thread = threading.Thread(target=server.manage_conn,
+                                     args=[Connection(server_side), tmp_path, threading.Lock()])
+    server_thread.start()
+    with Connection(client_side) as conn:
+        # Tiny chunks, so the image spans many of them and rows get split between chunks.
+        stream_card(conn, card, chunk_size=1000)
+        assert conn.receive_message() == REPLY_OK
+    server_thread.join()
+    # No partial files are left behind, only the card and the driver's index.
+    assert sorted(path.name for path in tmp_path.iterdir()) == [".metadata_index.sqlite3", "testy mctestfacestreamed"]
+    assert (tmp_path / "testy mctestfacestreamed").read_bytes() == card.serialise()
+
+
+def test_compression_negotiation(monkeypatch):
+    monkeypatch.setattr(ingest.Saver, "save_serialisation", fake_save_serialisation)
+    server_side, client_side = socket.socketpair()
+    server_thread = threading.Thread(target=server.manage_conn,
+                                     args=[Connection(server_side), Path("."), threading.Lock()])
+    server_thread.start()
+    with Connection(client_side) as conn:
+        assert conn.negotiate_compression(["brotli", "lzma", "zlib"]) == "lzma"
+        conn.send_message(b"card")
+        assert conn.receive_message() == REPLY_OK
+    server_thread.join()
+
+
+def test_negotiation_with_old_server():
+    server_side, client_side = socket.socketpair()
+
+    def old_server():
+        # Takes the negotiation message for a card, fails it and hangs up.
+        with Connection(server_side) as conn:
+            conn.receive_message()
+            conn.send_message(REPLY_ERROR)
+
+    server_thread = threading.Thread(target=old_server)
+    server_thread.start()
+    with Connection(client_side) as conn:
+        assert conn.negotiate_compression(["zlib"]) is None
+    server_thread.join()
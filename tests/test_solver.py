@@ -0,0 +1,103 @@
+from pathlib import Path
+import itertools
+import pytest
+import json
+
+from game.hash_engine import HashEngine
+from game.solver import batch_solve, read_answers, open_driver, CardLoader
+from game.crypt_image import CryptImage
+from game.card import Card
+
+TEST_IMAGE_PATH = Path(__file__).parent.parent / "networking" / "cheese.jpg"
+
+
+def save_unsolved_card(unsolved_dir: Path, name: str, solution: str, encoded: bool = False):
+    card = Card.create_from_path(name=name, creator="testy mctestface", path=str(TEST_IMAGE_PATH),
+                                 riddle="i <3 tests", solution=solution, encoded=encoded)
+    card.encrypt_card("zlib")
+    (unsolved_dir / (card.creator + card.name)).write_bytes(card.serialise())
+
+
+def test_batch_solve(tmp_path):
+    unsolved_dir = tmp_path / "unsolved"
+    solved_dir = tmp_path / "solved"
+    unsolved_dir.mkdir()
+    solved_dir.mkdir()
+    save_unsolved_card(unsolved_dir, "first", "a" * 16)
+    save_unsolved_card(unsolved_dir, "second", "b" * 16, encoded=True)
+    save_unsolved_card(unsolved_dir, "unsolvable", "c" * 16)
+    answers_path = tmp_path / "answers.txt"
+    answers_path.write_text("\n".join(["wrong" * 4, "b" * 16, "", "a" * 16, "b" * 16]) + "\n")
+
+    solved = batch_solve(unsolved_dir, solved_dir, read_answers(answers_path))
+
+    assert sorted(card.name for card in solved) == ["first", "second"]
+    # Solved cards aren't unsolved anymore.
+    assert sorted(path.name for path in unsolved_dir.iterdir() if not path.name.startswith(".")) == \
+           ["testy mctestfaceunsolvable"]
+    # Next to the cards is the (hidden) blob store of their images.
+    assert sorted(path.name for path in solved_dir.iterdir()) == [".blobs", "first", "second"]
+    metadata = json.loads((solved_dir / "second" / "metadata.json").read_text())
+    assert metadata["solution"] == "b" * 16
+    # The encoded image is saved as the file it was sent as.
+    assert Path(metadata["path"]).read_bytes() == TEST_IMAGE_PATH.read_bytes()
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_hash_engine(processes):
+    solutions = ["a" * 16, "b" * 16]
+    key_hashes = [CryptImage._generate_hash_key(solution.encode('utf8')) for solution in solutions]
+    answers = (f"{i:016}" for i in range(1000))
+    engine = HashEngine(key_hashes, processes, chunk_size=64)
+    matches = list(engine.find_matches(itertools.chain(answers, ["b" * 16], [str(i) for i in range(100)])))
+    assert matches == [("b" * 16, key_hashes[1])]
+    stats = engine.get_stats()
+    assert (stats["hashed"], stats["matched"]) == (1101, 1)
+    assert stats["hashes_per_second"] > 0
+
+
+def test_card_loader(tmp_path):
+    for name in ["first", "second", "third"]:
+        save_unsolved_card(tmp_path, name, name[0] * 16)
+    # The first loader reads every header, the second finds them all in the index.
+    for _ in range(2):
+        driver = open_driver(tmp_path, tmp_path / "solved")
+        card_loader = CardLoader(driver)
+        card_loader.start()
+        card_loader.thread.join()
+        driver.close()
+        assert card_loader.done
+        assert sorted(card.name for card in card_loader.get_cards()) == ["first", "second", "third"]
+
+
+def test_card_loader_lists_again(tmp_path):
+    save_unsolved_card(tmp_path, "first", "a" * 16)
+    driver = open_driver(tmp_path, tmp_path / "solved")
+    card_loader = CardLoader(driver)
+    card_loader.start()
+    card_loader.thread.join()
+    first = card_loader.get_cards()[0]
+    assert first.decrypt_card("a" * 16)
+    card_loader.remove_card(first)
+    assert card_loader.get_cards() == []
+    # Cards received since the cards were last listed show up once they're listed again.
+    save_unsolved_card(tmp_path, "second", "b" * 16)
+    version = card_loader.version
+    card_loader.start()
+    card_loader.thread.join()
+    assert card_loader.version > version and card_loader.done
+    assert sorted(card.name for card in card_loader.get_cards()) == ["first", "second"]
+    driver.close()
+
+
+def test_batch_solve_skips_cards_that_cant_be_saved(tmp_path):
+    unsolved_dir = tmp_path / "unsolved"
+    solved_dir = tmp_path / "solved"
+    unsolved_dir.mkdir()
+    solved_dir.mkdir()
+    save_unsolved_card(unsolved_dir, "first", "a" * 16)
+    save_unsolved_card(unsolved_dir, "second", "b" * 16)
+    # A solved card of the same name is already there, so the first card isn't saved.
+    (solved_dir / "first").mkdir()
+    solved = batch_solve(unsolved_dir, solved_dir, ["a" * 16, "b" * 16])
+    assert [card.name for card in solved] == ["second"]
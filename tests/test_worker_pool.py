@@ -0,0 +1,54 @@
+import socket
+import threading
+
+from networking.connection import Connection
+from networking.worker_pool import WorkerPool
+from networking.protocol import REPLY_BUSY
+
+
+def make_connection_pair() -> tuple[Connection, Connection]:
+    server_side, client_side = socket.socketpair()
+    return Connection(server_side), Connection(client_side)
+
+
+def test_rejects_when_saturated():
+    release = threading.Event()
+    started = threading.Event()
+
+    def handler(conn: Connection):
+        started.set()
+        release.wait()
+        conn.close()
+
+    with WorkerPool(handler, workers=1, queue_size=1, per_peer_limit=10) as pool:
+        pairs = [make_connection_pair() for _ in range(3)]
+        assert pool.submit(pairs[0][0])
+        started.wait()
+        assert pool.submit(pairs[1][0])
+        # One is handled, one waits in the queue, there's no room for a third.
+        assert not pool.submit(pairs[2][0])
+        assert pairs[2][1].receive_message() == REPLY_BUSY
+        stats = pool.get_stats()
+        assert stats["rejected_busy"] == 1
+        assert stats["queue_depth"] == 1
+        release.set()
+    assert pool.get_stats()["completed"] == 2
+
+
+def test_per_peer_limit():
+    release = threading.Event()
+
+    def handler(conn: Connection):
+        release.wait()
+        conn.close()
+
+    with WorkerPool(handler, workers=4, queue_size=4, per_peer_limit=2) as pool:
+        # socketpairs all share the same (empty) peer address, so they count as a single host.
+        pairs = [make_connection_pair() for _ in range(3)]
+        assert pool.submit(pairs[0][0])
+        assert pool.submit(pairs[1][0])
+        assert not pool.submit(pairs[2][0])
+        assert pairs[2][1].receive_message() == REPLY_BUSY
+        assert pool.get_stats()["rejected_quota"] == 1
+        release.set()
+    assert pool.get_stats()["peers"] == 0
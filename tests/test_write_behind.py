@@ -0,0 +1,104 @@
+from concurrent.futures import ThreadPoolExecutor
+from pymongo.errors import BulkWriteError, AutoReconnect
+import threading
+import pytest
+import time
+
+from backend.data_management.drivers.write_behind import WriteBehindWriter
+
+
+class StandInCollection:
+    """
+    Stands in for a Mongo collection, recording the batches inserted into it. Documents named "duplicate" fail.
+    """
+    name = "stand_in"
+
+    def __init__(self):
+        self.batches = []
+        self.documents = []
+        self.lock = threading.Lock()
+
+    def insert_many(self, documents, ordered=True):
+        assert not ordered
+        with self.lock:
+            self.batches.append(list(documents))
+            inserted = [document for document in documents if document["name"] != "duplicate"]
+            self.documents += inserted
+        if len(inserted) != len(documents):
+            raise BulkWriteError({"nInserted": len(inserted), "writeErrors": [{"code": 11000}]})
+
+
+def test_batches_by_size():
+    collection = StandInCollection()
+    writer = WriteBehindWriter(collection, batch_size=10, batch_delay=60, queue_size=5)
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(writer.submit, [{"name": f"card{i}"} for i in range(40)]))
+    writer.flush()
+    assert sorted(document["name"] for document in collection.documents) == sorted(f"card{i}" for i in range(40))
+    assert all(len(batch) == 10 for batch in collection.batches)
+    writer.close()
+
+
+def test_close_writes_everything_queued():
+    collection = StandInCollection()
+    writer = WriteBehindWriter(collection, batch_size=100, batch_delay=60)
+    for name in ["first", "duplicate", "second"]:
+        writer.submit({"name": name})
+    writer.close()
+    # The batch wasn't full, and its delay didn't pass, but closing writes it anyway.
+    assert [document["name"] for document in collection.documents] == ["first", "second"]
+    assert writer.get_stats() == {"queued": 0, "inserted": 2, "failed": 1, "batches": 1}
+
+
+def test_writer_outlives_a_failed_batch():
+    class FailingCollection(StandInCollection):
+        def insert_many(self, documents, ordered=True):
+            if any(document["name"] == "unencodable" for document in documents):
+                raise TypeError("Can't encode this one")
+            super().insert_many(documents, ordered)
+
+    collection = FailingCollection()
+    writer = WriteBehindWriter(collection, batch_size=2, batch_delay=60)
+    for name in ["first", "unencodable", "second", "third"]:
+        writer.submit({"name": name})
+    # The failed batch is still accounted for, so flushing doesn't hang, and the writer goes on to the next one.
+    writer.flush()
+    assert [document["name"] for document in collection.documents] == ["second", "third"]
+    writer.close()
+    assert writer.get_stats() == {"queued": 0, "inserted": 2, "failed": 2, "batches": 2}
+
+
+def test_batches_are_retried_when_the_connection_fails():
+    class FlakyCollection(StandInCollection):
+        failures = 2
+
+        def insert_many(self, documents, ordered=True):
+            if self.failures:
+                self.failures -= 1
+                raise AutoReconnect("Connection reset")
+            super().insert_many(documents, ordered)
+
+    collection = FlakyCollection()
+    writer = WriteBehindWriter(collection, batch_size=10, batch_delay=60, retry_delay=0)
+    for name in ["first", "second"]:
+        writer.submit({"name": name})
+    writer.close()
+    assert [document["name"] for document in collection.documents] == ["first", "second"]
+    assert writer.get_stats() == {"queued": 0, "inserted": 2, "failed": 0, "batches": 1}
+
+
+def test_close_waits_for_documents_being_submitted():
+    collection = StandInCollection()
+    writer = WriteBehindWriter(collection, batch_size=100, batch_delay=60, queue_size=1)
+    writer.submit({"name": "first"})
+    # The queue is full, so this submit is (likely) still queueing its document when the writer is closed.
+    with ThreadPoolExecutor(1) as executor:
+        submitted = executor.submit(writer.submit, {"name": "second"})
+        while not writer.submitting and not submitted.done():
+            time.sleep(0.01)
+        writer.close()
+        submitted.result()
+    writer.flush()
+    assert sorted(document["name"] for document in collection.documents) == ["first", "second"]
+    with pytest.raises(RuntimeError):
+        writer.submit({"name": "third"})